@@ -0,0 +1,11 @@
+"""Helpers shared by the benchmark scripts."""
+
+
+def token_counter():
+    """Count tokens with tiktoken when available, else estimate at 4 characters per token."""
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding('cl100k_base')
+        return lambda text: len(encoding.encode(text)), 'cl100k_base'
+    except Exception:
+        return lambda text: (len(text) + 3) // 4, 'estimate (chars/4)'
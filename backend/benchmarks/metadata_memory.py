@@ -0,0 +1,90 @@
+"""
+Compare the memory held by stored metadata as per-document dicts (the old
+MetadataStorage layout) against compact RowTable rows.
+
+Run from the backend directory:
+
+    python -m benchmarks.metadata_memory --documents 100000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+from services.row_schema import RowTable
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _sample_record(template_id: str) -> dict:
+    """Build a representative record from a template in backend/templates."""
+    with open(os.path.join(BACKEND_DIR, 'templates', f'{template_id}.json'), 'r') as f:
+        template = json.load(f)
+    record = {field['name']: f"{field['description'][:60]}" for field in template['metadataFields']}
+    record['File Name'] = 'product-information_en.pdf'
+    record['Template ID'] = template_id
+    return record
+
+
+def _make_records(sample: dict, count: int) -> dict:
+    """Build count distinct records as json.load would produce them."""
+    records = {}
+    for i in range(count):
+        records[f"https://example.com/doc-{i}.pdf"] = {
+            key: f"{value} #{i}" for key, value in sample.items()
+        }
+    # Round-trip through JSON so key strings are shared the way the loader shares them
+    return json.loads(json.dumps(records))
+
+
+def _measure(build) -> tuple:
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return result, used
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=100000)
+    parser.add_argument('--template', default='1758095910987')
+    args = parser.parse_args()
+
+    sample = _sample_record(args.template)
+    records = _make_records(sample, args.documents)
+    payload = json.dumps(records)
+    del records
+
+    dicts, dict_bytes = _measure(lambda: json.loads(payload))
+
+    def build_table():
+        table = RowTable()
+        for document_url, record in json.loads(payload).items():
+            table.upsert(document_url, record)
+        return table
+
+    table, table_bytes = _measure(build_table)
+
+    assert len(dicts) == len(table) == args.documents
+    # Both layouts hold the same value strings; the rest is per-record structure
+    value_bytes = sum(sys.getsizeof(value) for record in dicts.values() for value in record.values())
+    dict_overhead = dict_bytes - value_bytes
+    table_overhead = table_bytes - value_bytes
+
+    mib = 1024 * 1024
+    print(f"documents:         {args.documents:,} x {len(sample)} fields")
+    print(f"value strings:     {value_bytes / mib:8.1f} MiB")
+    print(f"dict records:      {dict_bytes / mib:8.1f} MiB  ({dict_overhead / mib:.1f} MiB structure)")
+    print(f"row table:         {table_bytes / mib:8.1f} MiB  ({table_overhead / mib:.1f} MiB structure)")
+    print(f"total reduction:   {100 * (1 - table_bytes / dict_bytes):8.1f} %")
+    print(f"structure reduction: {100 * (1 - table_overhead / dict_overhead):6.1f} %")
+
+
+if __name__ == '__main__':
+    main()
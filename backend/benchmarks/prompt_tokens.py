@@ -0,0 +1,107 @@
+"""
+Compare the static prompt tokens of the verbose and compact prompt modes
+for every template in backend/templates.
+
+Run from the backend directory:
+
+    python -m benchmarks.prompt_tokens
+
+With --pdf-dir and --model, the compact prompt is also run against PDFs
+whose results are already stored in metadata_storage.json. The harness
+then reports how often the compact answers agree with the stored ones.
+This needs OPENROUTER_API_KEY.
+"""
+import argparse
+import json
+import os
+import re
+
+from context.template_context import TemplateContext
+from services.metadata_storage import MetadataStorage
+from services.prompt_builder import build_prefix, build_prompt
+from benchmarks.common import token_counter
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _words(value: str) -> set:
+    return set(re.findall(r'\w+', str(value).lower()))
+
+
+def _agrees(stored: str, extracted: str) -> bool:
+    """Treat two answers as agreeing when both are missing or their words mostly overlap."""
+    stored_missing = not stored or str(stored).lower() == 'not found'
+    extracted_missing = not extracted or str(extracted).lower() == 'not found'
+    if stored_missing or extracted_missing:
+        return stored_missing == extracted_missing
+    stored_words, extracted_words = _words(stored), _words(extracted)
+    overlap = len(stored_words & extracted_words) / max(len(stored_words | extracted_words), 1)
+    return overlap >= 0.5
+
+
+def _compare_with_stored(template_context, pdf_dir: str, model_id: str) -> None:
+    from PyPDF2 import PdfReader
+    from services.openRouter import request_completion
+
+    storage = MetadataStorage(os.path.join(BACKEND_DIR, 'metadata_storage.json'))
+    pdfs = {name: os.path.join(pdf_dir, name) for name in os.listdir(pdf_dir) if name.lower().endswith('.pdf')}
+
+    print(f"\nCompact prompt agreement with stored results ({model_id}):")
+    for template_id, table in storage.tables.items():
+        compiled = template_context.get_compiled_template(template_id)
+        if not compiled:
+            continue
+        agreed = compared = prompt_tokens = 0
+        for _, record in table.iter_dicts():
+            path = pdfs.get(record.get('File Name'))
+            if not path:
+                continue
+            with open(path, 'rb') as f:
+                text = "\n".join(page.extract_text() for page in PdfReader(f).pages)
+            result = request_completion(
+                build_prompt(compiled, text, record['File Name'], mode='compact'), model_id, record['File Name']
+            )
+            prompt_tokens += result.prompt_tokens
+            content = result.content.strip().strip('`')
+            content = content[content.find('{'):content.rfind('}') + 1]
+            try:
+                extracted = json.loads(content)
+            except json.JSONDecodeError:
+                extracted = {}
+            for name in compiled.field_names:
+                compared += 1
+                agreed += _agrees(record.get(name), extracted.get(name))
+        if compared:
+            print(f"  {template_id}: {agreed}/{compared} fields agree ({100 * agreed / compared:.1f}%), "
+                  f"{prompt_tokens:,} prompt tokens")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pdf-dir', help='Folder of PDFs already extracted into metadata_storage.json')
+    parser.add_argument('--model', help='OpenRouter model ID for the agreement check')
+    args = parser.parse_args()
+
+    count_tokens, tokenizer = token_counter()
+    template_context = TemplateContext()
+
+    print(f"Static prompt tokens per call (tokenizer: {tokenizer})")
+    print(f"{'template':<16}{'name':<24}{'fields':>7}{'verbose':>10}{'compact':>10}{'saved':>8}")
+    total_verbose = total_compact = 0
+    for template_id in sorted(template_context.templates):
+        compiled = template_context.get_compiled_template(template_id)
+        verbose = count_tokens(build_prefix(compiled, 'verbose'))
+        compact = count_tokens(build_prefix(compiled, 'compact'))
+        total_verbose += verbose
+        total_compact += compact
+        print(f"{template_id:<16}{compiled.name[:22]:<24}{len(compiled.fields):>7}{verbose:>10,}{compact:>10,}"
+              f"{100 * (1 - compact / verbose):>7.1f}%")
+    if total_verbose:
+        print(f"{'total':<47}{total_verbose:>10,}{total_compact:>10,}{100 * (1 - total_compact / total_verbose):>7.1f}%")
+
+    if args.pdf_dir and args.model:
+        _compare_with_stored(template_context, args.pdf_dir, args.model)
+
+
+if __name__ == '__main__':
+    main()
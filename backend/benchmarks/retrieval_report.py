@@ -0,0 +1,104 @@
+"""
+Report how well BM25 retrieval keeps the answers already stored in
+metadata_storage.json, and what it saves in prompt size.
+
+Run from the backend directory with a folder holding the stored PDFs:
+
+    python -m benchmarks.retrieval_report --pdf-dir path/to/pdfs
+
+A stored answer counts as found in a text when most of its words appear
+there. Recall is measured only over answers that are found in the full
+document text, so extraction mistakes are not counted against retrieval.
+No LLM calls are made.
+"""
+import argparse
+import os
+import re
+import time
+
+from PyPDF2 import PdfReader
+
+from context.template_context import TemplateContext
+from services.metadata_storage import MetadataStorage
+from services.retrieval import select_passages
+from benchmarks.common import token_counter
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _words(value: str) -> list:
+    return re.findall(r'\w+', str(value).lower())
+
+
+def _is_answer(value) -> bool:
+    return bool(value) and str(value).strip().lower() != 'not found'
+
+
+def _found_in(answer_words: list, text_words: set) -> bool:
+    """Treat an answer as present when at least 80% of its words appear in the text."""
+    if not answer_words:
+        return False
+    return sum(word in text_words for word in answer_words) >= 0.8 * len(answer_words)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pdf-dir', required=True, help='Folder of PDFs already extracted into metadata_storage.json')
+    parser.add_argument('--top-k', default='1,3,5', help='Comma-separated passages-per-field values to compare')
+    parser.add_argument('--chunk-words', type=int, default=None, help='Target passage size in words')
+    args = parser.parse_args()
+
+    count_tokens, tokenizer = token_counter()
+    template_context = TemplateContext()
+    storage = MetadataStorage(os.path.join(BACKEND_DIR, 'metadata_storage.json'))
+    pdfs = {name: os.path.join(args.pdf_dir, name) for name in os.listdir(args.pdf_dir) if name.lower().endswith('.pdf')}
+
+    # Read every stored document once
+    documents = []
+    for template_id, table in storage.tables.items():
+        compiled = template_context.get_compiled_template(template_id)
+        if not compiled:
+            continue
+        for _, record in table.iter_dicts():
+            path = pdfs.get(record.get('File Name'))
+            if not path:
+                continue
+            with open(path, 'rb') as f:
+                pages = [page.extract_text() or '' for page in PdfReader(f).pages]
+            documents.append((compiled, record, pages))
+
+    if not documents:
+        print("No stored results have a matching PDF in --pdf-dir")
+        return
+
+    print(f"{len(documents)} documents (tokenizer: {tokenizer})")
+    print(f"{'top-k':>6}{'recall':>10}{'full tokens':>14}{'kept tokens':>14}{'reduction':>11}{'ms/doc':>9}")
+    for top_k in (int(value) for value in args.top_k.split(',')):
+        kept = answers = full_tokens = kept_tokens = 0
+        elapsed = 0.0
+        for compiled, record, pages in documents:
+            full_text = '\n'.join(pages)
+            start_time = time.perf_counter()
+            retrieval = select_passages(pages, compiled, top_k=top_k, chunk_words=args.chunk_words)
+            elapsed += time.perf_counter() - start_time
+            selected_text = retrieval.text if retrieval else full_text
+
+            full_words, selected_words = set(_words(full_text)), set(_words(selected_text))
+            for name in compiled.field_names:
+                if not _is_answer(record.get(name)):
+                    continue
+                answer_words = _words(record[name])
+                if _found_in(answer_words, full_words):
+                    answers += 1
+                    kept += _found_in(answer_words, selected_words)
+            full_tokens += count_tokens(full_text)
+            kept_tokens += count_tokens(selected_text)
+
+        recall = 100 * kept / answers if answers else 100.0
+        reduction = full_tokens / kept_tokens if kept_tokens else 0.0
+        print(f"{top_k:>6}{recall:>9.1f}%{full_tokens:>14,}{kept_tokens:>14,}{reduction:>10.1f}x"
+              f"{1000 * elapsed / len(documents):>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
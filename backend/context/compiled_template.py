@@ -0,0 +1,267 @@
+import hashlib
+import json
+import logging
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Columns every workbook row carries after the template's own fields
+REQUIRED_COLUMNS = ('File Name', 'Template ID')
+
+
+def sanitize_column_name(column_name: str) -> str:
+    """Sanitize column name to be valid for Excel."""
+    try:
+        # Handle None or empty values
+        if not column_name:
+            return "Column"
+
+        # Convert to string if not already
+        column_name = str(column_name)
+
+        # First, handle special cases for template-specific columns
+        if '[' in column_name or ']' in column_name:
+            # Extract content between square brackets if it exists
+            bracket_content = re.findall(r'\[(.*?)\]', column_name)
+            if bracket_content:
+                column_name = '_'.join(bracket_content)
+            else:
+                # Remove brackets if no content between them
+                column_name = column_name.replace('[', '').replace(']', '')
+
+        # Remove any characters that are not letters, numbers, or spaces
+        sanitized = ''.join(c for c in column_name if c.isalnum() or c.isspace())
+
+        # Replace multiple spaces with single space
+        sanitized = ' '.join(sanitized.split())
+
+        # Replace spaces with underscores
+        sanitized = sanitized.replace(' ', '_')
+
+        # Ensure the name starts with a letter
+        if sanitized and not sanitized[0].isalpha():
+            sanitized = 'C_' + sanitized
+
+        # Ensure the name is not empty
+        if not sanitized:
+            sanitized = 'Column'
+
+        # Ensure the name is not too long (Excel has a limit)
+        if len(sanitized) > 31:
+            sanitized = sanitized[:31]
+
+        return sanitized
+
+    except Exception as e:
+        logger.error(f"Error sanitizing column name '{column_name}': {str(e)}")
+        return "Column"  # Return a safe default value
+
+
+def column_letter(index: int) -> str:
+    """Convert a 1-based column index to an Excel column letter."""
+    letters = ''
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def render_field_description(name: str, description: str) -> str:
+    """Render a field's line in the prompt's field list."""
+    return f"- {name}: {description}"
+
+
+def render_field_search_instructions(name: str) -> str:
+    """Render the search instruction block for a field."""
+    return (
+        f"For '{name}':\n" +
+        f"1. Look for exact matches of '{name}'\n" +
+        f"2. Look for variations (e.g., '{name.lower()}', '{name.replace('/', ' or ')}')\n" +
+        f"3. Look for related terms and synonyms\n" +
+        f"4. Check nearby paragraphs and sections\n" +
+        f"5. Extract ALL relevant information found\n" +
+        f"6. Look for information in tables, lists, and formatted sections\n" +
+        f"7. Check for information in headers and footers\n" +
+        f"8. Look for information in any part of the document\n" +
+        f"9. Consider context and surrounding information\n" +
+        f"10. Extract partial information when available"
+    )
+
+
+@dataclass(frozen=True)
+class CompiledTemplate:
+    """
+    A template prepared once per version of its file: everything the
+    extraction and Excel paths would otherwise rebuild for every document.
+    """
+    template_id: str
+    name: str
+    fields: Tuple[Tuple[str, str], ...]  # (name, description) in template order
+    field_names: Tuple[str, ...]
+    field_descriptions: str  # Rendered field list for the prompt
+    search_instructions: str  # Rendered per-field search instruction blocks
+    column_names: Tuple[str, ...]  # Workbook columns: the fields, then REQUIRED_COLUMNS
+    sanitized_columns: Tuple[str, ...]  # Excel-safe header for column_names
+    column_letters: Tuple[str, ...]  # Excel column letter for each column
+    schema_hash: str  # Stable hash of the fields and their routing, usable as a cache key
+    field_sections: Tuple[Tuple[str, Tuple[str, ...]], ...] = ()  # (name, document sections) for routed fields
+    field_extractors: Tuple[Tuple[str, str], ...] = ()  # (name, pre-extractor name) for bound fields
+
+    def field_dicts(self) -> List[Dict]:
+        """Get the fields in the template file's {'name', 'description'} form."""
+        return [{'name': name, 'description': description} for name, description in self.fields]
+
+
+def compute_schema_hash(fields: Tuple[Tuple[str, str], ...],
+                        field_sections: Tuple[Tuple[str, Tuple[str, ...]], ...] = (),
+                        field_extractors: Tuple[Tuple[str, str], ...] = ()) -> str:
+    """
+    Hash a field list so identical schemas share a key across templates.
+
+    Section routing and extractor bindings change what an extraction
+    returns, so they are hashed too; a template without them hashes as
+    its field list alone.
+    """
+    data = [list(field) for field in fields]
+    if field_sections or field_extractors:
+        data = {
+            'fields': data,
+            'sections': [[name, list(sections)] for name, sections in field_sections],
+            'extractors': [list(binding) for binding in field_extractors]
+        }
+    payload = json.dumps(data, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def compile_template(template_id: str, template_data: Dict) -> CompiledTemplate:
+    """
+    Compile a template's data into an immutable CompiledTemplate.
+
+    Args:
+        template_id (str): The ID of the template
+        template_data (Dict): The template as loaded from its JSON file
+
+    Returns:
+        CompiledTemplate: The compiled template
+    """
+    template_fields = [field for field in template_data.get('metadataFields', []) if field.get('name')]
+    fields = tuple((str(field.get('name')), str(field.get('description', ''))) for field in template_fields)
+    field_sections = tuple(
+        (str(field['name']), tuple(str(section) for section in field['sections']))
+        for field in template_fields
+        if field.get('sections')
+    )
+    field_extractors = tuple(
+        (str(field['name']), str(field['extractor']))
+        for field in template_fields
+        if field.get('extractor')
+    )
+    return _build_compiled_template(template_id, template_data.get('name', ''), fields, field_sections, field_extractors)
+
+
+def _build_compiled_template(template_id: str, name: str, fields: Tuple[Tuple[str, str], ...],
+                             field_sections: Tuple[Tuple[str, Tuple[str, ...]], ...],
+                             field_extractors: Tuple[Tuple[str, str], ...]) -> CompiledTemplate:
+    column_names = tuple(field_name for field_name, _ in fields) + REQUIRED_COLUMNS
+    return CompiledTemplate(
+        template_id=template_id,
+        name=name,
+        fields=fields,
+        field_names=tuple(field_name for field_name, _ in fields),
+        field_descriptions="\n".join(render_field_description(field_name, description) for field_name, description in fields),
+        search_instructions="\n".join(render_field_search_instructions(field_name) for field_name, _ in fields),
+        column_names=column_names,
+        sanitized_columns=tuple(sanitize_column_name(column) for column in column_names),
+        column_letters=tuple(column_letter(index + 1) for index in range(len(column_names))),
+        schema_hash=compute_schema_hash(fields, field_sections, field_extractors),
+        field_sections=field_sections,
+        field_extractors=field_extractors
+    )
+
+
+# Field subsets can vary per document, so the cache is bounded
+SUBSET_CACHE_SIZE = 1024
+_subset_cache = {}  # {(template_id, schema_hash, field_names): CompiledTemplate}
+
+
+def subset_template(compiled: CompiledTemplate, field_names: Iterable[str]) -> CompiledTemplate:
+    """
+    Get a compiled template restricted to some of its fields, for prompts
+    that ask for only part of a template.
+
+    Args:
+        compiled (CompiledTemplate): The full template
+        field_names (Iterable[str]): Fields to keep; template order is preserved
+
+    Returns:
+        CompiledTemplate: The template with only those fields, cached per
+            template version and field set
+    """
+    wanted = frozenset(field_names)
+    if wanted >= set(compiled.field_names):
+        return compiled
+    key = (compiled.template_id, compiled.schema_hash, wanted)
+    subset = _subset_cache.get(key)
+    if subset is None:
+        subset = _build_compiled_template(
+            compiled.template_id,
+            compiled.name,
+            tuple(field for field in compiled.fields if field[0] in wanted),
+            tuple(routing for routing in compiled.field_sections if routing[0] in wanted),
+            tuple(binding for binding in compiled.field_extractors if binding[0] in wanted)
+        )
+        if len(_subset_cache) >= SUBSET_CACHE_SIZE:
+            _subset_cache.clear()
+        _subset_cache[key] = subset
+    return subset
+
+
+# Merged templates are keyed by every member's version, so the cache is bounded
+MERGED_CACHE_SIZE = 256
+_merged_cache = {}  # {((template_id, schema_hash), ...): CompiledTemplate}
+
+
+def merge_templates(templates: Sequence[CompiledTemplate]) -> CompiledTemplate:
+    """
+    Get one compiled template asking for the union of several templates'
+    fields, so a document can be extracted for all of them in one pass.
+
+    A field in several templates is asked for once. Its description is the
+    first template's, with differing descriptions from the others appended.
+    Each template's own rows are cut from the merged result by its
+    field_names, as ExcelGenerator.add_metadata already does.
+
+    Args:
+        templates (Sequence[CompiledTemplate]): The templates, in priority order
+
+    Returns:
+        CompiledTemplate: The merged template; a single template is returned as is
+    """
+    if len(templates) == 1:
+        return templates[0]
+    key = tuple((compiled.template_id, compiled.schema_hash) for compiled in templates)
+    merged = _merged_cache.get(key)
+    if merged is None:
+        descriptions, sections, extractors = {}, {}, {}
+        for compiled in templates:
+            for field_name, description in compiled.fields:
+                known = descriptions.setdefault(field_name, [])
+                if description and description not in known:
+                    known.append(description)
+            for field_name, field_sections in compiled.field_sections:
+                sections.setdefault(field_name, field_sections)
+            for field_name, extractor in compiled.field_extractors:
+                extractors.setdefault(field_name, extractor)
+        merged = _build_compiled_template(
+            "+".join(compiled.template_id for compiled in templates),
+            " + ".join(compiled.name for compiled in templates),
+            tuple((field_name, " / ".join(known)) for field_name, known in descriptions.items()),
+            tuple(sections.items()),
+            tuple(extractors.items())
+        )
+        if len(_merged_cache) >= MERGED_CACHE_SIZE:
+            _merged_cache.clear()
+        _merged_cache[key] = merged
+    return merged
@@ -1,12 +1,148 @@
 import json
 import os
 import logging
+import threading
+import time
 from typing import Dict, List, Optional
+from context.compiled_template import CompiledTemplate, compile_template, merge_templates
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Seconds a cached template is served without checking its file's mtime
+TEMPLATE_CACHE_TTL = float(os.getenv('TEMPLATE_CACHE_TTL', '1.0'))
+
+
+class _CachedTemplate:
+    __slots__ = ('data', 'mtime_ns', 'size', 'checked_at', 'compiled')
+
+    def __init__(self, data: Dict, mtime_ns: int, size: int, checked_at: float):
+        self.data = data
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.checked_at = checked_at
+        # Compiled on first use; a changed file gets a new entry, dropping it
+        self.compiled = None
+
+
+class _TemplateCache:
+    """
+    Process-wide cache of template files.
+
+    A lookup within TEMPLATE_CACHE_TTL of the last check is a dict read.
+    After that, the template's own file is stat'ed and only that file is
+    re-read if its mtime or size changed. Listing all templates re-reads
+    the directory only when the directory's mtime changes.
+    """
+
+    def __init__(self, templates_dir: str, ttl: float = TEMPLATE_CACHE_TTL):
+        self.templates_dir = templates_dir
+        self.ttl = ttl
+        self._entries = {}  # {template_id: _CachedTemplate}
+        self._dir_mtime_ns = None
+        self._template_ids = []
+        self._lock = threading.Lock()
+
+    def _path(self, template_id: str) -> str:
+        return os.path.join(self.templates_dir, f"{template_id}.json")
+
+    def get(self, template_id: str) -> Optional[Dict]:
+        """Get a template, reloading its file only if it changed on disk."""
+        entry = self._get_entry(template_id)
+        return entry.data if entry is not None else None
+
+    def get_compiled(self, template_id: str) -> Optional[CompiledTemplate]:
+        """Get a template compiled for its current file version."""
+        entry = self._get_entry(template_id)
+        if entry is None:
+            return None
+        compiled = entry.compiled
+        if compiled is None:
+            compiled = entry.compiled = compile_template(template_id, entry.data)
+        return compiled
+
+    def _get_entry(self, template_id: str) -> Optional[_CachedTemplate]:
+        entry = self._entries.get(template_id)
+        now = time.monotonic()
+        if entry is not None and now - entry.checked_at < self.ttl:
+            return entry
+
+        with self._lock:
+            try:
+                stat = os.stat(self._path(template_id))
+            except OSError:
+                self._entries.pop(template_id, None)
+                return None
+
+            entry = self._entries.get(template_id)
+            if entry is not None and entry.mtime_ns == stat.st_mtime_ns and entry.size == stat.st_size:
+                entry.checked_at = now
+                return entry
+
+            try:
+                with open(self._path(template_id), 'r') as f:
+                    template_data = json.load(f)
+            except Exception as e:
+                logger.error(f"Error loading template {template_id}: {str(e)}")
+                return None
+            entry = self._entries[template_id] = _CachedTemplate(template_data, stat.st_mtime_ns, stat.st_size, now)
+            return entry
+
+    def get_all(self) -> Dict[str, Dict]:
+        """Get all templates, re-listing the directory only if it changed."""
+        try:
+            dir_mtime_ns = os.stat(self.templates_dir).st_mtime_ns
+            if dir_mtime_ns != self._dir_mtime_ns:
+                template_ids = [
+                    filename[:-len('.json')]
+                    for filename in os.listdir(self.templates_dir)
+                    if filename.endswith('.json')
+                ]
+                with self._lock:
+                    self._template_ids = template_ids
+                    self._dir_mtime_ns = dir_mtime_ns
+                    for template_id in list(self._entries):
+                        if template_id not in template_ids:
+                            del self._entries[template_id]
+        except Exception as e:
+            logger.error(f"Error loading templates: {str(e)}")
+            return {}
+
+        templates = {}
+        for template_id in self._template_ids:
+            template_data = self.get(template_id)
+            if template_data is not None:
+                templates[template_id] = template_data
+        return templates
+
+    def invalidate(self, template_id: str) -> None:
+        """Drop a template so the next lookup reads its file."""
+        with self._lock:
+            self._entries.pop(template_id, None)
+            self._dir_mtime_ns = None
+
+
+_template_caches = {}
+_template_caches_lock = threading.Lock()
+
+
+def _get_template_cache(templates_dir: str) -> _TemplateCache:
+    with _template_caches_lock:
+        cache = _template_caches.get(templates_dir)
+        if cache is None:
+            cache = _template_caches[templates_dir] = _TemplateCache(templates_dir)
+        return cache
+
+
+def invalidate_template(template_id: str) -> None:
+    """Drop a template from the shared cache after its file was written or removed."""
+    with _template_caches_lock:
+        caches = list(_template_caches.values())
+    for cache in caches:
+        cache.invalidate(template_id)
+
+
 class TemplateContext:
     def __init__(self):
         # Get the backend directory path
@@ -18,37 +154,13 @@ class TemplateContext:
         # Create templates directory if it doesn't exist
         os.makedirs(self.templates_dir, exist_ok=True)
         
-        # Initialize templates dictionary
-        self.templates = {}
-        
-        # Load all templates
-        self._load_templates()
-        
-    def _load_templates(self):
-        """Load all templates from the templates directory."""
-        try:
-            # Clear existing templates
-            self.templates.clear()
-            
-            # Load each template file
-            for filename in os.listdir(self.templates_dir):
-                if filename.endswith('.json'):
-                    template_id = filename.replace('.json', '')
-                    template_path = os.path.join(self.templates_dir, filename)
-                    
-                    try:
-                        with open(template_path, 'r') as f:
-                            template_data = json.load(f)
-                            self.templates[template_id] = template_data
-                    except Exception as e:
-                        logger.error(f"Error loading template {template_id}: {str(e)}")
-                        continue
-            
-            # logger.info(f"Loaded {len(self.templates)} templates")
-            
-        except Exception as e:
-            logger.error(f"Error loading templates: {str(e)}")
-            self.templates = {}
+        # Templates are served from the process-wide cache, so construction is cheap
+        self._cache = _get_template_cache(self.templates_dir)
+
+    @property
+    def templates(self) -> Dict[str, Dict]:
+        """All templates by ID."""
+        return self._cache.get_all()
     
     def get_template(self, template_id: str) -> Optional[Dict]:
         """
@@ -60,15 +172,48 @@ class TemplateContext:
         Returns:
             Optional[Dict]: The template data if found, None otherwise
         """
-        # Reload templates to ensure we have the latest data
-        self._load_templates()
+        template = self._cache.get(template_id)
+        if template is not None:
+            return template
         
-        if template_id in self.templates:
-            return self.templates[template_id]
+        logger.error(f"Template with ID {template_id} not found")
+        return None
+    
+    def get_compiled_template(self, template_id: str) -> Optional[CompiledTemplate]:
+        """
+        Get a template compiled for its current version.
+        
+        Args:
+            template_id (str): The ID of the template
+            
+        Returns:
+            Optional[CompiledTemplate]: The compiled template if found, None otherwise
+        """
+        compiled = self._cache.get_compiled(template_id)
+        if compiled is not None:
+            return compiled
         
         logger.error(f"Template with ID {template_id} not found")
         return None
     
+    def get_merged_template(self, template_ids: List[str]) -> Optional[CompiledTemplate]:
+        """
+        Get several templates compiled into one with the union of their fields.
+        
+        Args:
+            template_ids (List[str]): The IDs of the templates
+            
+        Returns:
+            Optional[CompiledTemplate]: The merged template, None if any template is missing
+        """
+        templates = []
+        for template_id in dict.fromkeys(template_ids):
+            compiled = self.get_compiled_template(template_id)
+            if compiled is None:
+                return None
+            templates.append(compiled)
+        return merge_templates(templates) if templates else None
+    
     def get_template_fields(self, template_id: str) -> List[Dict]:
         """
         Get the fields for a specific template.
@@ -106,8 +251,8 @@ class TemplateContext:
             with open(template_path, 'w') as f:
                 json.dump(template_data, f, indent=2)
                 
-            # Update the in-memory templates
-            self.templates[template_id] = template_data
+            # Drop the cached copy so the next lookup reads the new file
+            self._cache.invalidate(template_id)
             
             # logger.info(f"Saved template with ID: {template_id}")
             return True
@@ -131,8 +276,7 @@ class TemplateContext:
             
             if os.path.exists(template_path):
                 os.remove(template_path)
-                if template_id in self.templates:
-                    del self.templates[template_id]
+                self._cache.invalidate(template_id)
                     
                 # logger.info(f"Deleted template with ID: {template_id}")
                 return True
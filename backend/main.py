@@ -1,6 +1,7 @@
 import os
 from dotenv import load_dotenv
 import json
+import asyncio
 from typing import List, Dict
 import pandas as pd
 import io
@@ -15,14 +16,22 @@ load_dotenv()
 
 from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
 import logging
 from services.document_processor import DocumentProcessor
 from services.excel_generator import ExcelGenerator
-from services.metadata_storage import MetadataStorage
 from services.sharepoint_service import SharePointService
+from context.template_context import invalidate_template
+from services.metrics import metrics
+from services.hedging import hedge_stats
+from services.second_pass import second_pass_stats
+from services.near_duplicate import NEAR_DUPLICATE_REUSE, get_near_duplicate_index
+from services.extraction_cache import get_extraction_cache
+from services.jobs import Job, get_job_registry
+from services.cancellation import OperationCancelled
+from services.scheduler import PRIORITY_BATCH, PRIORITY_CLASSES, get_scheduler
 import shutil
 from pathlib import Path
 
@@ -40,6 +49,8 @@ class DocumentProcessRequest(BaseModel):
 class TemplateField(BaseModel):
     name: str
     description: str
+    sections: Optional[List[str]] = None  # SmPC sections (e.g. "4.1") the field is read from
+    extractor: Optional[str] = None  # Pre-extractor that can fill the field without the LLM
 
 class Template(BaseModel):
     id: str
@@ -65,8 +76,16 @@ app.add_middleware(
 document_processor = DocumentProcessor()
 # Initialize ExcelGenerator
 excel_generator = ExcelGenerator(output_dir="output")
-# Initialize metadata storage
-metadata_storage = MetadataStorage()
+# Share the metadata storage behind the process-wide metadata index
+metadata_storage = excel_generator.metadata_storage
+# Background extraction jobs and their events
+job_registry = get_job_registry()
+
+# Seconds between checks for new job events, and between keep-alive comments on an idle event stream
+JOB_EVENTS_POLL_INTERVAL = float(os.getenv('JOB_EVENTS_POLL_INTERVAL', '0.2'))
+JOB_EVENTS_KEEPALIVE = float(os.getenv('JOB_EVENTS_KEEPALIVE', '15'))
+# Running job tasks, referenced so they are not garbage collected
+_job_tasks = set()
 
 @app.get("/health")
 async def health_check():
@@ -78,6 +97,52 @@ async def health_check():
     """
     return {"status": "healthy"}
 
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Get in-process counters and timings, such as LLM token usage
+    (including cached prompt tokens) and generation times per model.
+    
+    Returns:
+        dict: Counters and timing summaries, plus hedging rates, second-pass yield
+            and each scheduler class's queue wait and latency
+    """
+    snapshot = metrics.snapshot()
+    snapshot['hedging'] = hedge_stats()
+    snapshot['second_pass'] = second_pass_stats()
+    snapshot['scheduler'] = get_scheduler().stats()
+    return snapshot
+
+
+@app.get("/revision-diffs")
+async def get_revision_diffs(limit: int = 50):
+    """
+    Get how recently extracted documents differ from the earlier revisions
+    they were matched to, newest first.
+    
+    Returns:
+        dict: Per-document diff statistics, empty unless NEAR_DUPLICATE_REUSE is on
+    """
+    if not NEAR_DUPLICATE_REUSE:
+        return {"reports": []}
+    return {"reports": get_near_duplicate_index().get_reports(limit)}
+
+
+@app.delete("/extraction-cache")
+async def clear_extraction_cache(content_hash: Optional[str] = None):
+    """
+    Drop cached extractions, so their documents are sent to the LLM again.
+    
+    Args:
+        content_hash (str, optional): SHA-256 of one document's bytes; drops every extraction when omitted
+        
+    Returns:
+        dict: The number of extractions dropped
+    """
+    dropped = get_extraction_cache().invalidate(content_hash)
+    logger.info(f"Dropped {dropped} cached extractions")
+    return {"dropped": dropped}
+
 
 
 
@@ -104,7 +169,8 @@ async def create_template(template: Template):
         
         # Save template as JSON file
         with open(template_path, "w") as f:
-            json.dump(template.dict(), f, indent=2)
+            json.dump(template.dict(exclude_none=True), f, indent=2)
+        invalidate_template(template.id)
             
         logger.info(f"Created new template with ID: {template.id}")
         return {"message": "Template created successfully", "template": template}
@@ -169,6 +235,7 @@ async def delete_template(template_id: str):
         if not os.path.exists(template_path):
             raise HTTPException(status_code=404, detail="Template not found")
         os.remove(template_path)
+        invalidate_template(template_id)
         return {"message": "Template deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -264,19 +331,28 @@ async def upload_template_fields(file: UploadFile = File(...)):
 
 
 @app.post("/process-document")
-async def process_document(document_url: str, template_id: str,model_id: str):
+async def process_document(document_url: str, model_id: str, template_id: List[str] = Query(...),
+                           first_model_id: Optional[str] = None, priority: Optional[str] = None,
+                           refresh: bool = False):
     """
     Process one or more documents and extract metadata.
     
     Args:
         document_url (str): URL of the document, Drive folder, or SharePoint folder
-        template_id (str): ID of the template to use for processing
+        template_id (List[str]): ID of the template to use for processing; repeat the
+            parameter to extract several templates from one download of each document
+        first_model_id (str, optional): Cheaper model to try first; model_id only gets the fields it leaves unresolved
+        priority (str, optional): Scheduler class, 'interactive' or 'batch'; defaults to
+            batch for folders and interactive for single documents
+        refresh (bool): Extract afresh instead of reusing cached extractions of the same content
         
     Returns:
         dict: Response containing metadata and success message
     """
+    _check_priority(priority)
     try:
-        logger.info(f"Processing document(s) with template ID: {template_id}")
+        template_ids = list(dict.fromkeys(template_id))
+        logger.info(f"Processing document(s) with template ID(s): {', '.join(template_ids)}")
         logging.info(f"Document URL: {document_url}")
         logging.info(f"Model ID: {model_id}")
 
@@ -286,14 +362,18 @@ async def process_document(document_url: str, template_id: str,model_id: str):
         current_document = files_to_process[0]['name'] if files_to_process else None
 
         # Process the document(s) asynchronously
-        all_metadata = await document_processor.process_documents(document_url, template_id,model_id)
+        all_metadata = await document_processor.process_documents(
+            document_url, template_ids, model_id, first_model_id, priority=priority, refresh=refresh
+        )
         
-        # Add each document's metadata to Excel file and collect sharepoint_url
+        # Add each document's metadata to each template's Excel file and collect sharepoint_url;
+        # add_metadata keeps only the template's own fields of the merged result
         sharepoint_url = None
         for metadata in all_metadata:
-            result = excel_generator.add_metadata(metadata, document_url, template_id)
-            if isinstance(result, dict) and result.get('sharepoint_url'):
-                sharepoint_url = result['sharepoint_url']
+            for each_template_id in template_ids:
+                result = excel_generator.add_metadata(metadata, document_url, each_template_id)
+                if isinstance(result, dict) and result.get('sharepoint_url'):
+                    sharepoint_url = result['sharepoint_url']
         
         return {
             "status": "success",
@@ -311,6 +391,194 @@ async def process_document(document_url: str, template_id: str,model_id: str):
 
 
 
+def _check_priority(priority: Optional[str]) -> None:
+    if priority is not None and priority not in PRIORITY_CLASSES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown priority '{priority}'; use one of: {', '.join(PRIORITY_CLASSES)}"
+        )
+
+
+async def _run_job(job: Job, document_url: str, template_ids: List[str], model_id: str,
+                   first_model_id: Optional[str], priority: str = PRIORITY_BATCH, refresh: bool = False) -> None:
+    """
+    Run a job's extraction, storing each document's metadata as soon as it completes.
+    
+    Progress events arrive from worker threads; completed documents are
+    handed to the event loop, so add_metadata runs on one thread as it
+    does for /process-document.
+    """
+    loop = asyncio.get_running_loop()
+    completed = asyncio.Queue()
+    
+    def on_progress(event: str, data: Dict) -> None:
+        job.emit(event, data)
+        if event == 'document_completed':
+            loop.call_soon_threadsafe(completed.put_nowait, data)
+        elif event == 'document_failed':
+            job.add_failure({'file': data.get('file'), 'url': data.get('url'), 'error': data.get('error')})
+    
+    job.emit('job_started', {'document_url': document_url, 'template_ids': template_ids, 'model_id': model_id})
+    task = asyncio.create_task(
+        document_processor.process_documents(
+            document_url, template_ids, model_id, first_model_id, progress=on_progress, cancel_token=job.cancel_token,
+            priority=priority, refresh=refresh
+        )
+    )
+    # Runs after every completion the workers scheduled before finishing
+    task.add_done_callback(lambda _: completed.put_nowait(None))
+    
+    while True:
+        data = await completed.get()
+        if data is None:
+            break
+        metadata = data['metadata']
+        try:
+            sharepoint_url = None
+            for template_id in template_ids:
+                result = excel_generator.add_metadata(metadata, document_url, template_id)
+                if isinstance(result, dict) and result.get('sharepoint_url'):
+                    sharepoint_url = result['sharepoint_url']
+            job.add_result(metadata)
+            job.emit('document_stored', {'file': data.get('file'), 'url': data.get('url'), 'sharepoint_url': sharepoint_url})
+        except Exception as e:
+            logger.error(f"Error storing metadata of {data.get('file')} for job {job.id}: {str(e)}")
+            job.add_failure({'file': data.get('file'), 'url': data.get('url'), 'error': str(e)})
+            job.emit('document_store_failed', {'file': data.get('file'), 'url': data.get('url'), 'error': str(e)})
+    
+    try:
+        task.result()
+        job.finish('cancelled' if job.cancel_token.is_cancelled else 'completed')
+    except OperationCancelled:
+        job.finish('cancelled')
+    except Exception as e:
+        logger.error(f"Job {job.id} failed: {str(e)}")
+        job.finish('failed', str(e))
+
+
+@app.post("/jobs")
+async def start_job(document_url: str, model_id: str, template_id: List[str] = Query(...),
+                    first_model_id: Optional[str] = None, priority: str = PRIORITY_BATCH, refresh: bool = False):
+    """
+    Start processing a document or folder in the background.
+    
+    Takes the same parameters as /process-document. Jobs run in the batch
+    priority class unless priority says otherwise. Follow the job's
+    progress on /jobs/{job_id}/events.
+    
+    Returns:
+        dict: The job ID and the URL of its event stream
+    """
+    _check_priority(priority)
+    template_ids = list(dict.fromkeys(template_id))
+    job = job_registry.create({
+        'document_url': document_url,
+        'template_ids': template_ids,
+        'model_id': model_id,
+        'first_model_id': first_model_id,
+        'priority': priority,
+        'refresh': refresh
+    })
+    logger.info(f"Started job {job.id} for {document_url} with template ID(s): {', '.join(template_ids)}")
+    task = asyncio.create_task(_run_job(job, document_url, template_ids, model_id, first_model_id, priority, refresh))
+    _job_tasks.add(task)
+    task.add_done_callback(_job_tasks.discard)
+    return {"job_id": job.id, "status": job.status, "events_url": f"/jobs/{job.id}/events"}
+
+
+@app.get("/jobs")
+async def list_jobs():
+    """Get the status of recent jobs, newest first."""
+    return {"jobs": job_registry.list()}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Get a job's status and the metadata of the documents completed so far.
+    """
+    job = job_registry.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return dict(job.summary(), metadata=list(job.results), failures=list(job.failures))
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """
+    Cancel a running job.
+    
+    Queued documents are skipped and downloads and LLM requests in flight
+    are aborted. Documents already completed stay stored and listed on the
+    job. The job ends with a job_cancelled event.
+    
+    Returns:
+        dict: The job's status, and whether this request cancelled it
+    """
+    job = job_registry.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    cancelled = job.cancel()
+    if cancelled:
+        logger.info(f"Cancelling job {job_id}")
+    return {"job_id": job.id, "status": job.status, "cancelled": cancelled}
+
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, request: Request, last_event_id: int = 0,
+                            cancel_on_disconnect: bool = False):
+    """
+    Stream a job's events as Server-Sent Events.
+    
+    Each document reports document_started, downloaded, text_extracted,
+    llm_sent, llm_parsed (and field_parsed when streaming from the LLM),
+    document_completed with its metadata, and document_stored, or
+    document_failed or document_cancelled. Every event carries the seconds since the job started
+    and its stage's timing. The stream ends after job_completed,
+    job_failed or job_cancelled. Earlier events are replayed first; a reconnecting client
+    resumes after its Last-Event-ID header.
+    
+    With cancel_on_disconnect, the job is cancelled when the client goes
+    away before it finishes, such as when the page is closed.
+    """
+    job = job_registry.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    start_after = last_event_id
+    header = request.headers.get('last-event-id')
+    if header:
+        try:
+            start_after = max(int(header), 0)
+        except ValueError:
+            logger.warning(f"Ignoring malformed Last-Event-ID header for job {job_id}: {header!r}")
+    
+    async def event_stream():
+        sent = start_after
+        idle = 0.0
+        while not await request.is_disconnected():
+            events = job.events_after(sent, 0)
+            for event in events:
+                yield f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event['data'], default=str)}\n\n"
+                sent = event['id']
+            if events:
+                idle = 0.0
+            elif job.finished:
+                break
+            elif idle >= JOB_EVENTS_KEEPALIVE:
+                yield ": keep-alive\n\n"
+                idle = 0.0
+            await asyncio.sleep(JOB_EVENTS_POLL_INTERVAL)
+            idle += JOB_EVENTS_POLL_INTERVAL
+        if cancel_on_disconnect and job.cancel():
+            logger.info(f"Cancelled job {job.id} after its event stream disconnected")
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.post("/generate-excel")
 async def generate_excel(request: Request):
     try:
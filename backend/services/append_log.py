@@ -0,0 +1,71 @@
+import os
+import json
+import logging
+import threading
+from typing import Dict, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+
+class AppendOnlyLog:
+    """
+    A JSON-lines file of records, written one line per change.
+
+    Appending costs one short write however large the state the records
+    describe, so callers persist each change as it happens. Replaying
+    the records in order rebuilds the state; once they pile up, rewrite()
+    replaces them with a snapshot of the live ones.
+    """
+
+    def __init__(self, path: str, name: str = "log"):
+        self.path = path
+        self.name = name
+        self.lines = 0
+        self._lock = threading.Lock()
+
+    def read(self) -> List[Dict]:
+        """
+        Read every record in the file.
+
+        Returns:
+            List[Dict]: The records in the order they were written; a line
+                cut short by a crash mid-write is skipped
+        """
+        records = []
+        if not os.path.exists(self.path):
+            return records
+        with self._lock, open(self.path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping unreadable line {line_number} of {self.name} {self.path}")
+            self.lines = len(records)
+        return records
+
+    def append(self, record: Dict) -> None:
+        """Write one record to the end of the file."""
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        try:
+            with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                self.lines += 1
+        except Exception as e:
+            logger.error(f"Error appending to {self.name}: {str(e)}")
+
+    def rewrite(self, records: Iterable[Dict]) -> None:
+        """Replace the file with the given records, atomically."""
+        temp_path = f"{self.path}.tmp"
+        try:
+            with self._lock:
+                count = 0
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    for record in records:
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                        count += 1
+                os.replace(temp_path, self.path)
+                self.lines = count
+        except Exception as e:
+            logger.error(f"Error rewriting {self.name}: {str(e)}")
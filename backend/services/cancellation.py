@@ -0,0 +1,94 @@
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class OperationCancelled(Exception):
+    """Raised by work that stops because its cancellation token was cancelled."""
+
+
+class CancellationToken:
+    """
+    Thread-safe flag for cooperatively stopping work.
+
+    Work checks the token at safe points. Blocking operations can register
+    a callback that interrupts them, such as closing an open HTTP response.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        """Cancel the token and run its callbacks once."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Cancellation callback failed: {str(e)}")
+
+    def add_callback(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        Run a callback when the token is cancelled, or right away if it already is.
+
+        Returns:
+            Callable[[], None]: Function that unregisters the callback
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove_callback(callback)
+        callback()
+        return lambda: None
+
+    def _remove_callback(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def raise_if_cancelled(self) -> None:
+        """Raise OperationCancelled if the token has been cancelled."""
+        if self._event.is_set():
+            raise OperationCancelled("Operation was cancelled")
+
+    def wait(self, timeout: float) -> bool:
+        """Wait up to timeout seconds for cancellation; returns whether the token is cancelled."""
+        return self._event.wait(timeout)
+
+
+@contextmanager
+def closing_on_cancel(response, cancel_token: Optional[CancellationToken]):
+    """
+    Close a streamed HTTP response when the token is cancelled.
+
+    Closing the response from the cancelling thread unblocks a read in
+    progress; the error that read raises becomes OperationCancelled.
+    """
+    if cancel_token is None:
+        yield
+        return
+    unregister = cancel_token.add_callback(response.close)
+    try:
+        yield
+        cancel_token.raise_if_cancelled()
+    except OperationCancelled:
+        raise
+    except Exception:
+        if cancel_token.is_cancelled:
+            raise OperationCancelled("Operation was cancelled")
+        raise
+    finally:
+        unregister()
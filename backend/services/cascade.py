@@ -0,0 +1,58 @@
+import os
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from context.compiled_template import CompiledTemplate
+from services.pre_extractors import field_extractors, is_plausible_value
+
+logger = logging.getLogger(__name__)
+
+# Cheap or fast model that answers first; the requested model only gets the fields it leaves unresolved
+CASCADE_FIRST_MODEL = os.getenv('CASCADE_FIRST_MODEL') or None
+
+
+def cascade_models(model_id: str, first_model_id: Optional[str] = None) -> List[str]:
+    """
+    Get the models to try in order for one extraction.
+
+    Args:
+        model_id (str): The model requested for the extraction, used as the escalation model
+        first_model_id (str, optional): Model to try first; defaults to CASCADE_FIRST_MODEL
+
+    Returns:
+        List[str]: The first-stage model followed by the escalation model, or just model_id
+    """
+    first_model_id = first_model_id or CASCADE_FIRST_MODEL
+    if first_model_id and first_model_id != model_id:
+        return [first_model_id, model_id]
+    return [model_id]
+
+
+def is_unresolved(value) -> bool:
+    """Check whether an answer is missing or "Not found"."""
+    return value is None or (isinstance(value, str) and (not value.strip() or value.strip().lower() == 'not found'))
+
+
+def unresolved_fields(compiled: CompiledTemplate, values: Dict, field_names: Iterable[str]) -> List[str]:
+    """
+    Get the fields whose answers should be asked of a stronger model:
+    those missing, "Not found", or not shaped like the field's values.
+
+    Args:
+        compiled (CompiledTemplate): The template being extracted
+        values (Dict): Answers so far by field name
+        field_names (Iterable[str]): Fields to check
+
+    Returns:
+        List[str]: The unresolved fields, in the order given
+    """
+    extractors = field_extractors(compiled)
+    unresolved = []
+    for name in field_names:
+        value = values.get(name)
+        if is_unresolved(value):
+            unresolved.append(name)
+        elif name in extractors and not is_plausible_value(extractors[name], value):
+            logger.info(f"Answer for '{name}' does not look valid: {value!r}")
+            unresolved.append(name)
+    return unresolved
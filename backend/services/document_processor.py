@@ -7,7 +7,8 @@ import logging
 from dotenv import load_dotenv
 from services.sharepoint_service import SharePointService
 from context.template_context import TemplateContext
-from typing import List, Dict, Optional
+from context.compiled_template import CompiledTemplate, subset_template
+from typing import Any, Callable, List, Dict, Optional, Tuple
 import re
 from urllib.parse import urlparse
 from office365.runtime.auth.client_credential import ClientCredential
@@ -23,7 +24,30 @@ import threading
 from functools import partial
 import tempfile
 import uuid
-from services.openRouter import chat_with_openrouter
+import hashlib
+from services.openRouter import request_completion
+from services.structured_output import (
+    StructuredOutputError, build_json_schema, build_response_format,
+    decode_structured_response, supports_structured_output
+)
+from services.prompt_builder import FILENAME_FIELD, PROMPT_MODE, PromptParts, build_prompt
+from services.text_index import PartialMatchIndex
+from services.retrieval import RETRIEVAL_CHUNK_WORDS, RETRIEVAL_MODE, RETRIEVAL_TOP_K, select_passages
+from services.metrics import metrics
+from services.pre_extractors import PRE_EXTRACT_ENABLED, pre_extract
+from services.cancellation import CancellationToken, OperationCancelled, closing_on_cancel
+from services.hedging import hedged_call
+from services.extraction_cache import get_extraction_cache
+from services.near_duplicate import NEAR_DUPLICATE_REUSE, RevisionCheck, check_revision, get_near_duplicate_index
+from services.cascade import cascade_models, is_unresolved, unresolved_fields
+from services.smpc_sections import SMPC_DEFAULT_SECTIONS, field_sections, route_fields, section_text, segment_sections
+from services.single_flight import get_extractions_in_flight
+from services.field_groups import FIELD_GROUP_TOKEN_BUDGET, run_field_groups
+from services.jobs import ProgressCallback
+from services.scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, get_scheduler
+from services.second_pass import (
+    SECOND_PASS_ENABLED, SECOND_PASS_MAX_FIELDS, SECOND_PASS_TOP_K, TokenUsage, record_second_pass
+)
 
 # Load environment variables
 load_dotenv()
@@ -32,6 +56,21 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Settings that change what an extraction returns; results cached under other settings are not reused
+EXTRACTION_SETTINGS = ";".join([
+    f"prompt={PROMPT_MODE}",
+    f"retrieval={RETRIEVAL_MODE}/{RETRIEVAL_TOP_K}/{RETRIEVAL_CHUNK_WORDS}",
+    f"pre_extract={PRE_EXTRACT_ENABLED}",
+    f"sections={SMPC_DEFAULT_SECTIONS}",
+    f"revisions={NEAR_DUPLICATE_REUSE}",
+    f"field_groups={FIELD_GROUP_TOKEN_BUDGET}",
+    f"second_pass={SECOND_PASS_ENABLED}/{SECOND_PASS_MAX_FIELDS}/{SECOND_PASS_TOP_K}"
+])
+
+def _ignore_progress(event: str, **data) -> None:
+    """Progress reporter used when nobody is listening."""
+
+
 class DocumentProcessor:
     def __init__(self):
         # Initialize services only if credentials are available
@@ -50,6 +89,18 @@ class DocumentProcessor:
         
         # Initialize template context
         self.template_context = TemplateContext()
+        
+        # Extractions by document content, shared across jobs
+        self.extraction_cache = get_extraction_cache()
+        
+        # Earlier revisions of documents, for carrying forward fields of unchanged sections
+        self.near_duplicates = get_near_duplicate_index() if NEAR_DUPLICATE_REUSE else None
+        
+        # Extractions in flight, shared by concurrent requests for the same document
+        self.in_flight = get_extractions_in_flight()
+        
+        # Extraction slots shared by every request and job, handed out by priority
+        self.scheduler = get_scheduler()
 
         self.sharepoint_client = None
         
@@ -65,10 +116,6 @@ class DocumentProcessor:
         
 
         
-        # Initialize queues and thread pools
-        self.document_queue = Queue()
-        self.result_queue = Queue()
-        
         # Thread pool for processing
         self.process_pool = ThreadPoolExecutor(max_workers=4)
         
@@ -120,7 +167,9 @@ class DocumentProcessor:
                         
                         return [{
                             'url': file['url'],
-                            'name': file['name']
+                            'name': file['name'],
+                            'size': file.get('size'),
+                            'quick_xor_hash': file.get('quick_xor_hash')
                         } for file in files]
                     else:
                         logger.error("Invalid Graph API URL format")
@@ -144,15 +193,43 @@ class DocumentProcessor:
         else:
             return 'document'
 
-    async def process_documents(self, url: str, template_id: str,model_id:str) -> List[Dict]:
+    async def process_documents(self, url: str, template_ids: List[str], model_id: str,
+                                first_model_id: Optional[str] = None,
+                                progress: Optional[ProgressCallback] = None,
+                                cancel_token: Optional[CancellationToken] = None,
+                                priority: Optional[str] = None, refresh: bool = False) -> List[Dict]:
         """
         Process multiple documents in parallel using queues and thread pools.
+        
+        With several template IDs each document is downloaded, parsed and
+        extracted once for the union of the templates' fields; each result
+        holds the fields of every template.
+        
+        With a first_model_id (or CASCADE_FIRST_MODEL), that model answers
+        first and model_id is only asked for the fields it leaves unresolved.
+        
+        A progress callback is called, from the worker threads, with an
+        event as each document is downloaded, extracted, sent to the LLM,
+        parsed and completed.
+        
+        Cancelling cancel_token stops the job: queued documents are skipped,
+        downloads and LLM requests in flight are aborted, and the documents
+        already completed are returned.
+        
+        Documents wait for an extraction slot of their priority class
+        (PRIORITY_BATCH for a folder and PRIORITY_INTERACTIVE for a single
+        document, unless priority says otherwise), so a bulk job cannot
+        hold up interactive requests.
+        
+        With refresh, documents are extracted afresh instead of being taken
+        from the extraction cache, and the new results replace the cached ones.
         """
 
         try:
+            if isinstance(template_ids, str):
+                template_ids = [template_ids]
             url_type = self._get_url_type(url)
             all_metadata = []
-            failed_documents = []
             
             if url_type == 'sharepoint':
                 self._initialize_sharepoint(url)
@@ -161,47 +238,23 @@ class DocumentProcessor:
                     raise ValueError("No files found in the SharePoint folder")
                 
                 logger.info(f"Found {len(files)} files to process")
+                if progress:
+                    progress('files_listed', {'total': len(files)})
                 
-                # Start parallel processing
-                start_time = time.time()
-                
-                # Start worker threads
-                workers = []
-                for _ in range(4):  # 4 worker threads
-                    worker = threading.Thread(
-                        target=self._process_document_worker,
-                        args=(template_id,model_id,)
-                    )
-                    worker.start()
-                    workers.append(worker)
-                
-                # Add documents to queue
-                for file in files:
-                    self.document_queue.put(file)
-                
-                # Add None to signal end of documents
-                for _ in range(4):
-                    self.document_queue.put(None)
-                
-                # Wait for all workers to complete
-                for worker in workers:
-                    worker.join()
-                
-                # Collect results
-                while not self.result_queue.empty():
-                    result = self.result_queue.get()
-                    if isinstance(result, dict):
-                        all_metadata.append(result)
-                    else:
-                        failed_documents.append(result)
-                
-                processing_time = time.time() - start_time
-
-                logger.info(f"Processed {len(all_metadata)} documents in {processing_time:.2f} seconds")
+                # The job's threads block, so they run off the event loop to let other requests proceed
+                all_metadata = await asyncio.get_running_loop().run_in_executor(
+                    None, self._run_folder_job, files, template_ids, model_id, first_model_id, progress, cancel_token,
+                    priority or PRIORITY_BATCH, refresh
+                )
                 
             else:
                 # Single document processing
-                metadata = await self.process_document(url, template_id)
+                if progress:
+                    progress('files_listed', {'total': 1})
+                metadata = await self.process_document(
+                    url, template_ids, model_id, first_model_id, progress, cancel_token, priority or PRIORITY_INTERACTIVE,
+                    refresh
+                )
                 all_metadata.append(metadata)
             
             return all_metadata
@@ -210,134 +263,696 @@ class DocumentProcessor:
             logger.error(f"Error processing documents: {str(e)}")
             raise
 
-    def _process_document_worker(self, template_id: str,model_id:str):
+    def _run_folder_job(self, files: List[Dict], template_ids: List[str], model_id: str,
+                        first_model_id: Optional[str] = None,
+                        progress: Optional[ProgressCallback] = None,
+                        cancel_token: Optional[CancellationToken] = None,
+                        priority: str = PRIORITY_BATCH, refresh: bool = False) -> List[Dict]:
+        """
+        Extract a folder's files with worker threads.
+        
+        Each job has its own queues, so concurrent jobs never take each
+        other's files or results.
+        
+        Returns:
+            List[Dict]: Metadata of the files extracted successfully
+        """
+        all_metadata = []
+        failed_documents = []
+        document_queue = Queue()
+        result_queue = Queue()
+        
+        # Start parallel processing
+        start_time = time.time()
+        
+        # Start worker threads
+        workers = []
+        for _ in range(4):  # 4 worker threads
+            worker = threading.Thread(
+                target=self._process_document_worker,
+                args=(document_queue, result_queue, template_ids, model_id, first_model_id, progress, cancel_token, priority, refresh,)
+            )
+            worker.start()
+            workers.append(worker)
+        
+        # Copies of the same PDF are extracted once and their results fanned out
+        files, duplicates = self._collapse_duplicate_files(files)
+        
+        # Add documents to queue
+        for file in files:
+            document_queue.put(file)
+        
+        # Add None to signal end of documents
+        for _ in range(4):
+            document_queue.put(None)
+        
+        # Wait for all workers to complete
+        for worker in workers:
+            worker.join()
+        
+        # Collect results
+        while not result_queue.empty():
+            result = result_queue.get()
+            if isinstance(result, dict) and 'error' not in result:
+                all_metadata.append(result)
+                copies = duplicates.get(result.get('Document URL'), [])
+                for copy, copy_result in zip(copies, self._fan_out_result(result, copies)):
+                    all_metadata.append(copy_result)
+                    self._reporter(progress, copy)('document_completed', metadata=copy_result, copy_of=result.get('File Name'))
+            else:
+                failed_documents.append(result)
+        
+        processing_time = time.time() - start_time
+
+        if cancel_token and cancel_token.is_cancelled:
+            logger.info(f"Job cancelled; keeping the {len(all_metadata)} documents completed before it stopped")
+        logger.info(f"Processed {len(all_metadata)} documents in {processing_time:.2f} seconds")
+        return all_metadata
+
+    def _collapse_duplicate_files(self, files: List[Dict]) -> Tuple[List[Dict], Dict[str, List[Dict]]]:
+        """
+        Collapse files whose listing reports identical content.
+        
+        Returns:
+            Tuple[List[Dict], Dict[str, List[Dict]]]: The files to extract, and
+                the duplicate files of each by its URL
+        """
+        unique, duplicates, first_by_hash = [], {}, {}
+        for file in files:
+            content_key = (file.get('quick_xor_hash'), file.get('size')) if file.get('quick_xor_hash') else None
+            first = first_by_hash.get(content_key) if content_key else None
+            if first is None:
+                if content_key:
+                    first_by_hash[content_key] = file
+                unique.append(file)
+            else:
+                duplicates.setdefault(first['url'], []).append(file)
+        
+        duplicate_count = sum(len(copies) for copies in duplicates.values())
+        if duplicate_count:
+            metrics.increment("dedup.listing_duplicates", duplicate_count)
+            logger.info(f"Skipping {duplicate_count} duplicate files with identical content")
+        return unique, duplicates
+
+    def _fan_out_result(self, metadata: Dict, copies: List[Dict]) -> List[Dict]:
+        """Copy one file's extraction to the files with identical content."""
+        results = []
+        for copy in copies:
+            result = dict(metadata)
+            result[FILENAME_FIELD] = copy['name']
+            result['Document URL'] = copy.get('url')
+            result['File Name'] = copy.get('name', os.path.basename(copy.get('url', '')))
+            results.append(result)
+        return results
+
+    def _process_document_worker(self, document_queue: Queue, result_queue: Queue, template_ids: List[str], model_id: str,
+                                 first_model_id: Optional[str] = None, progress: Optional[ProgressCallback] = None,
+                                 cancel_token: Optional[CancellationToken] = None, priority: str = PRIORITY_BATCH,
+                                 refresh: bool = False):
         """
-        Worker thread for processing documents from the queue.
+        Worker thread for processing documents from a job's queue.
         """
         while True:
-            file = self.document_queue.get()
+            file = document_queue.get()
 
             if file is None:
                 break
+            
+            # A cancelled job's queued documents are skipped without being started
+            if cancel_token and cancel_token.is_cancelled:
+                result_queue.put({
+                    'error': 'Cancelled',
+                    'file': file.get('name', 'unknown')
+                })
+                continue
                 
-            temp_file_path = None
             try:
-                # Generate unique temp file path
-                temp_file_path = self._get_temp_file_path()
+                metadata = self._process_file(
+                    file, template_ids, model_id, first_model_id, progress, cancel_token, priority, refresh
+                )
                 
-                # Download document
-                self.download_document(file['url'], temp_file_path)
+                # Update document count
+                with self.token_lock:
+                    self.token_tracking['documents_processed'] += 1
                 
-                # Extract text
-                text = self.extract_text(temp_file_path,file['name'])
+                # Add result to queue
+                result_queue.put(metadata)
                 
-    
+            except OperationCancelled:
+                result_queue.put({
+                    'error': 'Cancelled',
+                    'file': file.get('name', 'unknown')
+                })
+            except Exception as e:
+                logger.error(f"Error processing document {file.get('name', 'unknown')}: {str(e)}")
+                result_queue.put({
+                    'error': str(e),
+                    'file': file.get('name', 'unknown')
+                })
 
+    async def process_document(self, url: str, template_ids: List[str], model_id: str,
+                               first_model_id: Optional[str] = None,
+                               progress: Optional[ProgressCallback] = None,
+                               cancel_token: Optional[CancellationToken] = None,
+                               priority: str = PRIORITY_INTERACTIVE, refresh: bool = False) -> Dict:
+        """
+        Process a single document URL and extract its metadata.
+        """
+        file = {'url': url, 'name': os.path.basename(url)}
+        return await asyncio.get_running_loop().run_in_executor(
+            self.process_pool, self._process_file, file, template_ids, model_id, first_model_id, progress, cancel_token,
+            priority, refresh
+        )
 
-                
-                # Generate prompt
-                template = self.template_context.get_template(template_id)
-                fields = template.get('metadataFields', [])
-                fields = [{'name': 'filename', 'description': f'Known file name: {file["name"]}'}] + fields       
+    def _reporter(self, progress: Optional[ProgressCallback], file: Dict) -> Callable[..., None]:
+        """Bind a progress callback to a file, so stages can report with report(event, **data)."""
+        if progress is None:
+            return _ignore_progress
+        
+        def report(event: str, **data) -> None:
+            try:
+                progress(event, dict(data, file=file.get('name'), url=file.get('url')))
+            except Exception as e:
+                # A failing listener must not fail the extraction
+                logger.warning(f"Progress callback failed for '{file.get('name')}': {str(e)}")
+        return report
 
+    def _process_file(self, file: Dict, template_ids: List[str], model_id: str,
+                      first_model_id: Optional[str] = None, progress: Optional[ProgressCallback] = None,
+                      cancel_token: Optional[CancellationToken] = None,
+                      priority: str = PRIORITY_INTERACTIVE, refresh: bool = False) -> Dict:
+        """
+        Download one file, extract its text and have the LLM extract the template's fields.
+        
+        Args:
+            file (Dict): File entry with 'url' and 'name'
+            template_ids (List[str]): IDs of the templates to extract
+            model_id (str): OpenRouter model ID
+            first_model_id (str, optional): Cheaper model to try before model_id
+            progress (ProgressCallback, optional): Called with each stage's event
+            cancel_token (CancellationToken, optional): Stops the download and extraction when cancelled
+            priority (str): Scheduler class whose slot the extraction waits for
+            refresh (bool): Extract afresh rather than reuse a cached extraction
+            
+        Returns:
+            Dict: Extracted metadata with 'Document URL' and 'File Name'
+        """
+        report = self._reporter(progress, file)
+        start_time = time.time()
+        try:
+            with self.scheduler.slot(priority, cancel_token) as queue_wait:
+                report('document_started', priority=priority, queue_wait=round(queue_wait, 3))
+                if cancel_token:
+                    cancel_token.raise_if_cancelled()
+                metadata, shared = self._extract_file(
+                    file, template_ids, model_id, first_model_id, report, cancel_token, refresh
+                )
+        except OperationCancelled:
+            report('document_cancelled', total_time=round(time.time() - start_time, 3))
+            raise
+        except Exception as e:
+            report('document_failed', error=str(e), total_time=round(time.time() - start_time, 3))
+            raise
+        report('document_completed', metadata=metadata, coalesced=shared, total_time=round(time.time() - start_time, 3))
+        return metadata
 
-           
-                prompt = self._generate_prompt(text, fields)
-                
+    def _extract_file(self, file: Dict, template_ids: List[str], model_id: str, first_model_id: Optional[str],
+                      report: Callable[..., None], cancel_token: Optional[CancellationToken] = None,
+                      refresh: bool = False) -> Tuple[Dict, bool]:
+        """
+        Get one file's metadata, joining an extraction of it already in flight if there is one.
+        
+        Returns:
+            Tuple[Dict, bool]: The metadata, and whether it came from another request's extraction
+        """
+        # Use the templates compiled for their current versions, merged into one field list
+        compiled = self.template_context.get_merged_template(template_ids)
+        if not compiled:
+            raise ValueError(f"No template found for template IDs: {', '.join(template_ids)}")
+        model_key = ">".join(cascade_models(model_id, first_model_id))
+        
+        # Concurrent requests for the same file share one download and extraction;
+        # a refresh only joins another refresh, never a run that may answer from the cache
+        values, shared = self.in_flight.do(
+            ('url', file['url'], compiled.schema_hash, model_key, refresh),
+            lambda: self._download_and_extract(
+                file, compiled, model_id, first_model_id, model_key, report, cancel_token, refresh
+            ),
+            cancel_token
+        )
+        if shared:
+            logger.info(f"Joined the extraction of '{file['name']}' already in flight")
+        
+        metadata = dict(values)
+        metadata[FILENAME_FIELD] = file['name']
+        metadata['Document URL'] = file.get('url')
+        metadata['File Name'] = file.get('name', os.path.basename(file.get('url', '')))
+        return metadata, shared
 
-                
-                # --- NEW: Get file size and page count ---
-                file_size = os.path.getsize(temp_file_path)
-                with open(temp_file_path, 'rb') as f:
-                    pdf_reader = PdfReader(f)
-                    page_count = len(pdf_reader.pages)
+    def _download_and_extract(self, file: Dict, compiled: CompiledTemplate, model_id: str,
+                              first_model_id: Optional[str], model_key: str,
+                              report: Callable[..., None] = _ignore_progress,
+                              cancel_token: Optional[CancellationToken] = None, refresh: bool = False) -> Dict:
+        """
+        Download a file and get its field values, from the extraction cache
+        (unless refresh is set) or from an extraction of the same content
+        already in flight if possible.
+        
+        Returns:
+            Dict: The extracted field values, without the per-file keys
+        """
+        temp_file_path = None
+        try:
+            # Generate unique temp file path
+            temp_file_path = self._get_temp_file_path()
+            
+            # Download document
+            download_start = time.time()
+            content_hash = self.download_document(file['url'], temp_file_path, cancel_token)
+            report('downloaded', download_time=round(time.time() - download_start, 3),
+                   file_size=os.path.getsize(temp_file_path))
+            
+            # The same PDF extracted before, under any name or in any job, is not extracted again
+            cached = None if refresh else self.extraction_cache.get(
+                content_hash, compiled.schema_hash, model_key, EXTRACTION_SETTINGS
+            )
+            if cached is not None:
+                metrics.increment("dedup.cache_hits")
+                logger.info(f"Reusing extraction of identical content for '{file['name']}'")
+                report('cache_hit')
+                return cached
+            
+            # Nor is it extracted twice at once under different URLs
+            values, shared = self.in_flight.do(
+                ('content', content_hash, compiled.schema_hash, model_key, refresh),
+                lambda: self._extract_content(
+                    temp_file_path, content_hash, file, compiled, model_id, first_model_id, model_key, report, cancel_token
+                ),
+                cancel_token
+            )
+            if shared:
+                logger.info(f"Joined an extraction of identical content for '{file['name']}'")
+            return values
+            
+        finally:
+            # Clean up temporary file
+            if temp_file_path and os.path.exists(temp_file_path):
+                try:
+                    os.remove(temp_file_path)
+                except Exception as e:
+                    logger.warning(f"Could not remove temporary file {temp_file_path}: {str(e)}")
+
+    def _extract_content(self, temp_file_path: str, content_hash: str, file: Dict, compiled: CompiledTemplate,
+                         model_id: str, first_model_id: Optional[str], model_key: str,
+                         report: Callable[..., None] = _ignore_progress,
+                         cancel_token: Optional[CancellationToken] = None) -> Dict:
+        """
+        Extract the text of a downloaded file and have the LLM extract the template's fields.
+        
+        Returns:
+            Dict: The extracted field values, without the per-file keys
+        """
+        # Extract text
+        extract_start = time.time()
+        pages = self.extract_pages(temp_file_path)
+        logger.info(f"Extracted text from document: {file['name']}")
+        
+        # --- NEW: Get file size and page count ---
+        file_size = os.path.getsize(temp_file_path)
+        page_count = len(pages)
+        report('text_extracted', page_count=page_count, extract_time=round(time.time() - extract_start, 3))
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
+
+        logger.info(
+            f"Processing '{file['name']}' | Size: {self._format_file_size(file_size)} | Pages: {page_count}"
+        )
 
+        # Fill mechanically recoverable fields locally and ask the LLM only for the rest
+        metadata = {FILENAME_FIELD: file['name']}
+        prefilled = pre_extract(compiled, self._format_document_text(pages, file['name']), file['name'])
+        metadata.update(prefilled)
+        metrics.increment("pre_extract.fields_filled", len(prefilled))
+        if prefilled:
+            logger.info(f"Pre-extracted {len(prefilled)} fields of '{file['name']}': {sorted(prefilled)}")
+        
+        # Carry forward the fields of sections unchanged since an earlier revision of the document
+        revision = check_revision(self.near_duplicates, compiled, pages, content_hash) if self.near_duplicates else None
+        carried = {name: value for name, value in revision.carried.items() if name not in prefilled} if revision else {}
+        metadata.update(carried)
+        
+        remaining = [name for name in compiled.field_names if name not in prefilled and name not in carried]
+        if not remaining:
+            metrics.increment("pre_extract.calls_skipped")
+            logger.info(f"All fields of '{file['name']}' filled without the LLM, skipping it")
+        
+        llm_template = subset_template(compiled, remaining) if remaining else None
+        calls = self._plan_extraction_calls(
+            pages, llm_template, file['name'],
+            # A matched revision always routes by the default sections; otherwise SMPC_DEFAULT_SECTIONS decides
+            use_default_sections=True if revision and revision.match else None
+        ) if llm_template else []
+        models = cascade_models(model_id, first_model_id)
+        usage = TokenUsage()
+        # Calls, and the field groups of wide templates, are generated concurrently
+        results = run_field_groups(calls, lambda call_template, text: self._extract_with_cascade(
+            text, compiled, call_template, models, file['name'],
+            file_size=self._format_file_size(file_size), page_count=page_count, usage=usage, report=report,
+            cancel_token=cancel_token
+        ))
+        # A call whose reply could not be parsed at all leaves a result not worth keeping
+        unparsed = [call_template for call_template, result in results
+                    if not any(name in result for name in call_template.field_names)]
+        for call_template, result in results:
+            self._merge_extraction(metadata, result, call_template.field_names)
+        
+        # Re-ask only for the fields still not found, over the passages most likely to hold them
+        missing = [name for name in remaining if is_unresolved(metadata.get(name))]
+        if missing and SECOND_PASS_ENABLED:
+            self._run_second_pass(
+                metadata, missing, pages, compiled, models[-1], file['name'], usage,
+                file_size=self._format_file_size(file_size), page_count=page_count, report=report,
+                cancel_token=cancel_token
+            )
+        
+        if unparsed:
+            metrics.increment("dedup.cache_skipped")
+            logger.warning(f"Not caching the extraction of '{file['name']}': {len(unparsed)} LLM calls returned no fields")
+        else:
+            self.extraction_cache.put(content_hash, compiled.schema_hash, model_key, metadata, EXTRACTION_SETTINGS)
+        if revision:
+            self._record_revision(revision, compiled, content_hash, metadata, file, len(carried), len(remaining))
+        return metadata
+
+    def _record_revision(self, revision: RevisionCheck, compiled: CompiledTemplate, content_hash: str,
+                         metadata: Dict, file: Dict, fields_carried: int, fields_extracted: int) -> None:
+        """Add a document to the near-duplicate index and report how it differs from its earlier revision."""
+        stored = {name: metadata.get(name) for name in compiled.field_names if name in metadata}
+        self.near_duplicates.add(
+            content_hash, compiled.schema_hash, revision.signature, revision.full_text_hash,
+            revision.section_hashes, stored, file.get('url'), file.get('name')
+        )
+        if not revision.match:
+            return
+        
+        report = {
+            'document_url': file.get('url'),
+            'file_name': file.get('name'),
+            'template_id': compiled.template_id,
+            'previous_document_url': revision.match.record.get('document_url'),
+            'previous_file_name': revision.match.record.get('file_name'),
+            'similarity': revision.match.similarity,
+            'sections_total': len(revision.section_hashes),
+            'sections_changed': revision.changed_sections,
+            'fields_carried': fields_carried,
+            'fields_extracted': fields_extracted,
+            'reported_at': datetime.now().isoformat()
+        }
+        self.near_duplicates.record_report(report)
+        metrics.increment("near_duplicate.matches")
+        metrics.increment("near_duplicate.fields_carried", fields_carried)
+        logger.info(
+            f"'{file.get('name')}' revises '{report['previous_file_name']}' (similarity {revision.match.similarity:.2f}): "
+            f"{len(revision.changed_sections)} of {report['sections_total']} sections changed, "
+            f"{fields_carried} fields carried forward, {fields_extracted} re-extracted"
+        )
+
+    def _plan_extraction_calls(self, pages: List[str], compiled: CompiledTemplate, file_name: str,
+                               use_default_sections: Optional[bool] = None) -> List[Tuple[CompiledTemplate, str]]:
+        """
+        Decide which LLM calls extract a document's fields and what text each carries.
+        
+        Fields routed to SmPC sections are asked for in one call carrying
+        only their sections. Unrouted fields, and fields whose sections the
+        document lacks, are asked for in a call carrying the whole document.
+        
+        Args:
+            use_default_sections (bool, optional): Route the standard SmPC
+                fields by their default sections; defaults to SMPC_DEFAULT_SECTIONS
+        
+        Returns:
+            List[Tuple[CompiledTemplate, str]]: The fields and document text for each call
+        """
+        if field_sections(compiled, use_default_sections):
+            sections = segment_sections(self._format_document_text(pages, file_name))
+            routed, unrouted = route_fields(compiled, sections, use_default_sections)
+            metrics.increment("sections.routed_fields", len(routed))
+            metrics.increment("sections.full_document_fields", len(unrouted))
+            if routed:
+                wanted = [section for sections_wanted in routed.values() for section in sections_wanted]
+                calls = [(
+                    subset_template(compiled, routed),
+                    f"filename: {file_name}\n\n{section_text(sections, wanted)}\n"
+                )]
                 logger.info(
-                            f"Processing '{file['name']}' | Size: {self._format_file_size(file_size)} | Pages: {page_count}"
-                        )
+                    f"Routed {len(routed)} fields of '{file_name}' to sections {sorted(set(wanted))}; "
+                    f"{len(unrouted)} fields use the full document"
+                )
+                if unrouted:
+                    unrouted_template = subset_template(compiled, unrouted)
+                    calls.append((unrouted_template, self._build_document_text(pages, unrouted_template, file_name)))
+                return calls
+        
+        return [(compiled, self._build_document_text(pages, compiled, file_name))]
 
+    def _run_second_pass(self, metadata: Dict, missing: List[str], pages: List[str], compiled: CompiledTemplate,
+                         model_id: str, file_name: str, first_pass: TokenUsage, file_size=None, page_count=None,
+                         report: Callable[..., None] = _ignore_progress,
+                         cancel_token: Optional[CancellationToken] = None) -> None:
+        """
+        Ask once more for fields the first pass left "Not found", merging any answers into metadata.
+        
+        The prompt covers only the missing fields (at most
+        SECOND_PASS_MAX_FIELDS) and carries only the passages retrieved for
+        them, or the whole document when retrieval would not shrink it.
+        
+        Args:
+            metadata (Dict): The document's metadata so far, updated in place
+            missing (List[str]): Fields still unresolved
+            first_pass (TokenUsage): Tokens spent on the document so far, for the rerun comparison
+        """
+        template = subset_template(compiled, missing[:SECOND_PASS_MAX_FIELDS])
+        retrieval = select_passages(pages, template, top_k=SECOND_PASS_TOP_K)
+        text = f"filename: {file_name}\n\n{retrieval.text}\n" if retrieval else self._format_document_text(pages, file_name)
+        
+        logger.info(f"Second pass for '{file_name}': re-asking {len(template.fields)} fields not found: {list(template.field_names)}")
+        second_pass = TokenUsage()
+        report('llm_sent', model=model_id, stage='second_pass', fields=len(template.fields))
+        llm_start = time.time()
+        try:
+            result = self._extract_with_llm(
+                self._generate_prompt(text, template, file_name), template, model_id, file_name,
+                file_size=file_size, page_count=page_count, usage=second_pass, cancel_token=cancel_token
+            )
+        except OperationCancelled:
+            raise
+        except Exception as e:
+            # The first pass's answers stand on their own
+            logger.error(f"Second pass for '{file_name}' failed: {str(e)}")
+            return
+        
+        recovered = {name: result[name] for name in template.field_names if not is_unresolved(result.get(name))}
+        report('llm_parsed', model=model_id, stage='second_pass', fields=len(template.fields),
+               fields_resolved=len(recovered), llm_time=round(time.time() - llm_start, 3))
+        metadata.update(recovered)
+        record_second_pass(len(template.fields), len(recovered), first_pass, second_pass)
+        logger.info(
+            f"Second pass for '{file_name}' recovered {len(recovered)} of {len(template.fields)} fields "
+            f"with {second_pass.total} tokens (first pass: {first_pass.total})"
+        )
 
+    def _merge_extraction(self, metadata: Dict, result: Dict, field_names: Tuple[str, ...]) -> None:
+        """Merge one call's answers into a document's metadata, preferring each call's own fields."""
+        for key, value in result.items():
+            if key in field_names or key not in metadata:
+                metadata[key] = value
 
-                # Get metadata from Gemini
-                # response = self.gemini_model.generate_content(prompt)
-                # logging.info(f"Gemini response: {response.text}")
-                logger.info(f"Sending file '{file['name']}' to LLM")
+    def _extract_with_cascade(self, text: str, compiled: CompiledTemplate, call_template: CompiledTemplate,
+                              models: List[str], file_name: str, file_size=None, page_count=None,
+                              usage: Optional[TokenUsage] = None,
+                              report: Callable[..., None] = _ignore_progress,
+                              cancel_token: Optional[CancellationToken] = None) -> Dict:
+        """
+        Extract a call's fields, escalating unresolved fields through a model cascade.
+        
+        The first model is asked for every field of the call. Each later
+        model gets a prompt for only the fields still missing, "Not found"
+        or implausible, over the same document text.
+        
+        Args:
+            text (str): The document text for this call
+            compiled (CompiledTemplate): The full template, for field validation
+            call_template (CompiledTemplate): The fields this call extracts
+            models (List[str]): Models to try in order
+            file_name (str): Name of the document
+            usage (TokenUsage, optional): Tally to add the requests' tokens to
+            report (Callable[..., None], optional): Progress reporter for the document
+            cancel_token (CancellationToken, optional): Aborts the requests when cancelled
+            
+        Returns:
+            Dict: Field values by name
+        """
+        values = {}
+        stage_template = call_template
+        for stage, stage_model in enumerate(models, 1):
+            if cancel_token:
+                cancel_token.raise_if_cancelled()
+            prompt = self._generate_prompt(text, stage_template, file_name)
+            logger.info(
+                f"Sending file '{file_name}' to LLM {stage_model} ({len(stage_template.fields)} fields, stage {stage})"
+            )
+            report('llm_sent', model=stage_model, stage=stage, fields=len(stage_template.fields))
+            llm_start = time.time()
+            result = self._extract_with_llm(
+                prompt, stage_template, stage_model, file_name,
+                file_size=file_size, page_count=page_count, stage=f"stage{stage}" if len(models) > 1 else None,
+                usage=usage, on_field=lambda key, value: report('field_parsed', field=key, value=value),
+                cancel_token=cancel_token
+            )
+            report('llm_parsed', model=stage_model, stage=stage, fields=len(stage_template.fields),
+                   fields_resolved=sum(not is_unresolved(result.get(name)) for name in stage_template.field_names),
+                   llm_time=round(time.time() - llm_start, 3))
+            if stage > 1:
+                # An escalation that also comes back empty keeps the earlier answer
+                result = {key: value for key, value in result.items() if not is_unresolved(value) or is_unresolved(values.get(key))}
+            self._merge_extraction(values, result, stage_template.field_names)
+            
+            if stage == len(models):
+                break
+            unresolved = unresolved_fields(compiled, values, stage_template.field_names)
+            if not unresolved:
+                metrics.increment("cascade.resolved_without_escalation")
+                break
+            metrics.increment("cascade.escalated_fields", len(unresolved))
+            logger.info(f"Escalating {len(unresolved)} fields of '{file_name}' to {models[stage]}: {unresolved}")
+            stage_template = subset_template(call_template, unresolved)
+        
+        return values
 
-                response=chat_with_openrouter(prompt,model_id,file["name"],file_size=self._format_file_size(file_size), page_count=page_count)  # Call OpenRouter for logging purposes
-                # logging.info(f"Received response response from LLM {response}")
-                
-                # Count response tokens
-            #     response_tokens = self._count_tokens(response)
-            #     with self.token_lock:
-            #         self._update_token_tracking(response_tokens)
-                
-            #     # Parse response
-            #     metadata = self._parse_response(response)
-            #     try:
-            #         metadata['Document URL'] = file.get('url')
-            #         metadata['File Name'] = file.get('name', os.path.basename(file.get('url', '')))
-            #     except Exception:
-            #         pass
-                
-       
-                
-                
-            #     # Update document count
-            #     with self.token_lock:
-            #         self.token_tracking['documents_processed'] += 1
-                
-            #     # Add result to queue
-            #     self.result_queue.put(metadata)
-                
-            except Exception as e:
-                logger.error(f"Error processing document {file.get('name', 'unknown')}: {str(e)}")
-                # self.result_queue.put({
-                #     'error': str(e),
-                #     'file': file.get('name', 'unknown')
-                # })
-            # finally:
-                # Clean up temporary file
-                # if temp_file_path and os.path.exists(temp_file_path):
-                #     try:
-                #         os.remove(temp_file_path)
-                #     except Exception as e:
-                #         logger.warning(f"Could not remove temporary file {temp_file_path}: {str(e)}")
-                
-                # self.document_queue.task_done()
+    def _extract_with_llm(self, prompt: PromptParts, compiled: CompiledTemplate, model_id: str,
+                          file_name: str, file_size=None, page_count=None, stage: Optional[str] = None,
+                          usage: Optional[TokenUsage] = None,
+                          on_field: Optional[Callable[[str, Any], None]] = None,
+                          cancel_token: Optional[CancellationToken] = None) -> Dict:
+        """
+        Send an extraction prompt to the LLM and decode its answer.
+        
+        With HEDGE_REQUESTS, a duplicate request is fired when the model is
+        slower than usual and the first usable answer is kept. Each field
+        is passed to on_field once, by whichever request parses it first.
+        
+        Returns:
+            Dict: Field values by name
+        """
+        if on_field is not None:
+            on_field = self._once_per_field(on_field)
+        return hedged_call(
+            lambda call_model_id, call_token: self._request_extraction(
+                prompt, compiled, call_model_id, file_name, file_size=file_size, page_count=page_count,
+                stage=stage, cancel_token=call_token, usage=usage, on_field=on_field
+            ),
+            model_id,
+            cancel_token=cancel_token
+        )
 
+    @staticmethod
+    def _once_per_field(on_field: Callable[[str, Any], None]) -> Callable[[str, Any], None]:
+        """Wrap a field callback so that repeats of a field, such as from a hedged request, are dropped."""
+        reported = set()
+        lock = threading.Lock()
+        
+        def report_once(key: str, value: Any) -> None:
+            with lock:
+                if key in reported:
+                    return
+                reported.add(key)
+            on_field(key, value)
+        return report_once
 
-                
+    def _request_extraction(self, prompt: PromptParts, compiled: CompiledTemplate, model_id: str, file_name: str,
+                            file_size=None, page_count=None, stage: Optional[str] = None,
+                            cancel_token: Optional[CancellationToken] = None,
+                            usage: Optional[TokenUsage] = None,
+                            on_field: Optional[Callable[[str, Any], None]] = None) -> Dict:
+        """
+        Make one extraction request and decode its answer.
+        
+        Models that support structured output are sent the template's JSON
+        schema and their reply is decoded and validated in one step. Other
+        models, and replies that fail validation, go through _parse_response.
+        
+        Returns:
+            Dict: Field values by name
+        """
+        schema = build_json_schema(compiled) if supports_structured_output(model_id) else None
+        result = request_completion(
+            prompt, model_id, file_name, file_size=file_size, page_count=page_count,
+            response_format=build_response_format(schema) if schema else None,
+            cancel_token=cancel_token, expected_fields=(FILENAME_FIELD,) + compiled.field_names,
+            on_field=on_field,
+            # Field groups, escalations and second passes each ask for their own field set
+            dump_label=compiled.schema_hash[:12]
+        )
+        if usage:
+            usage.add(result.prompt_tokens, result.completion_tokens)
+        if stage:
+            # Per-stage cost and latency of a model cascade
+            metrics.increment(f"cascade.{stage}.requests")
+            metrics.increment(f"cascade.{stage}.prompt_tokens", result.prompt_tokens)
+            metrics.increment(f"cascade.{stage}.completion_tokens", result.completion_tokens)
+            metrics.observe(f"cascade.{stage}.generation_time", result.generation_time)
+        
+        if schema:
+            try:
+                return decode_structured_response(result.content, schema)
+            except StructuredOutputError as e:
+                logger.warning(f"Structured response for '{file_name}' failed validation: {str(e)}")
+        
+        return self._parse_response(result.content)
 
-    def download_document(self, document_url: str, temp_file_path: str) -> None:
+    def download_document(self, document_url: str, temp_file_path: str,
+                          cancel_token: Optional[CancellationToken] = None) -> str:
         """
         Download a document from various sources (PDF URL, SharePoint).
         
         Args:
             document_url (str): URL of the document
             temp_file_path (str): Path to save the downloaded document
+            cancel_token (CancellationToken, optional): Aborts the download when cancelled
+            
+        Returns:
+            str: SHA-256 of the document's bytes, computed as they stream in
         """
         try:
+            hasher = hashlib.sha256()
             if "sharepoint.com" in document_url:
                 # Handle SharePoint URL
                 if not self.sharepoint_service:
                     raise ValueError("SharePoint service not configured")
-                self.sharepoint_service.download_file(document_url, temp_file_path)
+                self.sharepoint_service.download_file(document_url, temp_file_path, hasher=hasher, cancel_token=cancel_token)
             else:
                 # Handle regular PDF URL
                 response = requests.get(document_url, stream=True)
                 response.raise_for_status()
                 
-                with open(temp_file_path, 'wb') as f:
+                with closing_on_cancel(response, cancel_token), open(temp_file_path, 'wb') as f:
                     for chunk in response.iter_content(chunk_size=8192):
+                        if cancel_token:
+                            cancel_token.raise_if_cancelled()
                         f.write(chunk)
+                        hasher.update(chunk)
+            
+            return hasher.hexdigest()
                 
+        except OperationCancelled:
+            raise
         except Exception as e:
             logger.error(f"Error downloading document: {str(e)}")
             raise
 
-    def extract_text(self, file_path: str, original_name: str = None) -> str:
+    def extract_pages(self, file_path: str) -> List[str]:
         """
-        Extract text from a PDF file.
+        Extract the text of each page of a PDF file.
         """
         try:
             if not os.path.exists(file_path):
@@ -346,181 +961,70 @@ class DocumentProcessor:
             if not file_path.lower().endswith('.pdf'):
                 raise ValueError("Only PDF files are supported")
                 
-            text = ""
             with open(file_path, 'rb') as file:
                 pdf_reader = PdfReader(file)
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
+                pages = [page.extract_text() or "" for page in pdf_reader.pages]
             
-            if not text.strip():
+            if not any(page.strip() for page in pages):
                 raise ValueError("No text could be extracted from the PDF")
                 
-            filename = original_name
-            logger.info(f"Extracted text from document: {filename }")
-            return f"filename: {filename}\n\n{text}"
+            return pages
         except Exception as e:
             logger.error(f"Failed to extract text from document: {str(e)}")
             raise
 
-    def _generate_prompt(self, text: str, fields: List[Dict],) -> str:
+    def extract_text(self, file_path: str, original_name: str = None) -> str:
+        """
+        Extract text from a PDF file.
+        """
+        pages = self.extract_pages(file_path)
+        filename = original_name
+        logger.info(f"Extracted text from document: {filename }")
+        return self._format_document_text(pages, filename)
+
+    def _format_document_text(self, pages: List[str], file_name: str) -> str:
+        """Join page texts into the document text given to the LLM."""
+        text = "".join(page + "\n" for page in pages)
+        return f"filename: {file_name}\n\n{text}"
+
+    def _build_document_text(self, pages: List[str], compiled: CompiledTemplate, file_name: str) -> str:
+        """
+        Build the document text for an extraction prompt.
+        
+        In 'bm25' retrieval mode only the passages relevant to the
+        template's fields are kept; otherwise, or when retrieval would not
+        shrink the document, the full text is used.
+        """
+        if RETRIEVAL_MODE == 'bm25':
+            start_time = time.time()
+            retrieval = select_passages(pages, compiled)
+            metrics.observe("retrieval.time", time.time() - start_time)
+            if retrieval:
+                metrics.increment("retrieval.passages_selected", retrieval.passages_selected)
+                metrics.increment("retrieval.passages_total", retrieval.passages_total)
+                logger.info(
+                    f"Retrieval kept {retrieval.passages_selected} of {retrieval.passages_total} passages for '{file_name}'"
+                )
+                return f"filename: {file_name}\n\n{retrieval.text}\n"
+        return self._format_document_text(pages, file_name)
+
+    def _generate_prompt(self, text: str, compiled: CompiledTemplate, file_name: str) -> PromptParts:
         """
         Generate a prompt for the LLM to extract specific fields from the text.
         
+        All template-specific instructions form a stable prefix and the
+        document is appended last, so providers can reuse a cached prefix
+        across documents that share a template.
+        
         Args:
             text (str): The document text to analyze
-            fields (List[Dict]): List of fields to extract from the template
+            compiled (CompiledTemplate): The template to extract fields for
+            file_name (str): Name of the document, given as the known 'filename' field
             
         Returns:
-            str: Formatted prompt for the LLM
-        """
-        # Create field descriptions for the prompt
-        field_descriptions = "\n".join([
-            f"- {field['name']}: {field['description']}"
-            for field in fields
-        ])
-
-        # Create field-specific search instructions
-        field_search_instructions = "\n".join([
-            f"For '{field['name']}':\n" +
-            f"1. Look for exact matches of '{field['name']}'\n" +
-            f"2. Look for variations (e.g., '{field['name'].lower()}', '{field['name'].replace('/', ' or ')}')\n" +
-            f"3. Look for related terms and synonyms\n" +
-            f"4. Check nearby paragraphs and sections\n" +
-            f"5. Extract ALL relevant information found\n" +
-            f"6. Look for information in tables, lists, and formatted sections\n" +
-            f"7. Check for information in headers and footers\n" +
-            f"8. Look for information in any part of the document\n" +
-            f"9. Consider context and surrounding information\n" +
-            f"10. Extract partial information when available"
-            for field in fields
-        ])
-
-        prompt = f"""You are a metadata extractor. Your task is to thoroughly analyze the given text and extract ALL relevant information for each specified field.
-
-IMPORTANT: You must extract ALL information that is present in the text. Do not mark fields as "Not found" unless you have thoroughly searched the entire document and are absolutely certain the information is not present.
-
-FIELD-SPECIFIC SEARCH INSTRUCTIONS:
-{field_search_instructions}
-
-For each field, you must:
-1. Search the ENTIRE text carefully, including:
-   - Headers and footers
-   - Tables and lists
-   - Formatted sections
-   - Unstructured text
-   - Any location in the document
-2. Look for variations of field names and related terms
-3. Consider context and surrounding information
-4. Extract the most specific and complete value found
-5. If you find partial information, include it rather than marking as "Not found"
-6. For dates, look for any date format
-7. For names and organizations, look for full names, abbreviations, and variations
-8. For IDs and numbers, look for any numeric identifiers or codes
-9. If a field has multiple values, include all relevant values separated by semicolons
-10. Look for information in tables, lists, and formatted sections
-11. Consider information that might be spread across multiple locations
-12. Look for information in both structured and unstructured parts
-13. Check for information in bullet points and lists
-14. Look for information in parentheses or brackets
-15. Check for information after colons or semicolons
-16. Look for information in headers and subheaders
-17. Check for information in footnotes or references
-18. Look for information in appendices or supplementary sections
-19. Check for information in any part of the document
-20. Consider variations in how information might be presented
-21. Extract partial information when available
-22. Look for related terms and synonyms
-23. Consider context and surrounding information
-24. For dates, extract any date format you find
-25. For names and organizations, include all variations you find
-26. For IDs and numbers, capture all numeric identifiers
-27. If you find multiple values, include them all
-28. Only use "Not found" if you are absolutely certain the information is not present after thorough searching
-
-Fields to extract:
-{field_descriptions}
-
-Text to analyze:
-{text}
-
-Return the results in JSON format with the field names as keys and the extracted values as values.
-Example format:
-{{
-  "filename": "exact and extract filename from given text  ( example:product-information_en.pdf)",
-  "Study Title": "Exact title from text",
-  "Study Phase": "Phase value from text",
-  "Study Type": "Type value from text",
-  "Study Status": "Status value from text",
-  "Start Date": "Date value from text",
-  "Completion Date": "Date value from text",
-  "Sponsor": "Sponsor name from text",
-  "Principal Investigator": "Investigator name from text"
-}}
-
-CRITICAL INSTRUCTIONS:
-1. You MUST extract ALL information that is present in the text
-2. Do not mark fields as "Not found" unless you have thoroughly searched the entire document
-3. For each field:
-   - Look for exact matches
-   - Look for variations and related terms
-   - Check nearby paragraphs and sections
-   - Extract ALL relevant information
-4. Consider variations in how information might be presented
-5. Extract partial information when available
-6. Look for related terms and synonyms
-7. Consider context and surrounding information
-8. For dates, extract any date format you find
-9. For names and organizations, include all variations you find
-10. For IDs and numbers, capture all numeric identifiers
-11. If you find multiple values, include them all
-12. Only use "Not found" if you are absolutely certain the information is not present after thorough searching
-13. For fields like "Pregnancy/Lactation":
-    - Look for information about pregnancy
-    - Look for information about lactation
-    - Look for information about both
-    - Check sections about patient eligibility
-    - Check sections about study population
-    - Extract ALL relevant information found
-14. For all fields:
-    - Look in ALL parts of the document
-    - Consider variations in wording
-    - Extract partial information
-    - Include all relevant details
-    - Only use "Not found" if absolutely certain
-15. Additional search strategies:
-    - Look for information in bullet points and lists
-    - Check for information in parentheses or brackets
-    - Look for information after colons or semicolons
-    - Check for information in tables and formatted sections
-    - Look for information in headers and subheaders
-    - Check for information in footnotes or references
-    - Look for information in appendices or supplementary sections
-    - Check for information in any part of the document
-16. When searching for information:
-    - Read the entire document carefully
-    - Look for information in any format
-    - Consider all possible locations
-    - Extract all relevant details
-    - Include partial information
-    - Never assume information is not present
-    - Always double-check before marking as "Not found"
-17. If you find any information that might be related to a field, include it
-18. Look for information in any format or structure
-19. Consider all possible ways the information might be presented
-20. Extract any information that might be relevant
-21. Include all variations and forms of the information
-22. Look for information in any part of the document
-23. Consider all possible locations and formats
-24. Extract all relevant details and variations
-25. Include partial information when available
-26. Never assume information is not present
-27. Always double-check before marking as "Not found"
-28. Look for information in any way it might be presented
-29. Consider all possible variations and forms
-30. Extract all relevant information found
-31. Include filename  and extract filename from given text
-"""
-        return prompt
+            PromptParts: Static prefix and per-document suffix of the prompt
+        """
+        return build_prompt(compiled, text, file_name)
 
     def _parse_response(self, response: str) -> dict:
         """Parse the Gemini response into a dictionary."""
@@ -528,16 +1032,22 @@ CRITICAL INSTRUCTIONS:
             # Clean the response string
             response = response.strip()
 
-            def clean_dict(data: dict, raw_response: str) -> dict:
-                """Helper to clean values in parsed dict safely."""
+            def clean_dict(data: dict) -> dict:
+                """
+                Helper to clean values in parsed dict safely.
+                
+                A field the model answered "Not found" stays "Not found": the
+                reply itself always mentions the field, so searching it would
+                only turn the answer's own JSON line into the value, hiding
+                the field from the cascade and the second pass.
+                """
                 cleaned = {}
                 for key, value in data.items():
                     if isinstance(value, str):
                         if value.strip() and value.lower() != "not found":
                             cleaned[key] = value.strip()
                         else:
-                            partial_matches = self._find_partial_matches(key, raw_response)
-                            cleaned[key] = partial_matches if partial_matches else "Not found"
+                            cleaned[key] = "Not found"
                     elif isinstance(value, (list, dict)):
                         # Keep lists and dicts as-is
                         cleaned[key] = value
@@ -545,15 +1055,14 @@ CRITICAL INSTRUCTIONS:
                         # Numbers, booleans, etc.
                         cleaned[key] = value
                     else:
-                        partial_matches = self._find_partial_matches(key, raw_response)
-                        cleaned[key] = partial_matches if partial_matches else "Not found"
+                        cleaned[key] = "Not found"
                 return cleaned
 
             # 1. Try to parse as JSON directly
             try:
                 data = json.loads(response)
                 if isinstance(data, dict):
-                    cleaned_data = clean_dict(data, response)
+                    cleaned_data = clean_dict(data)
                     # logging.info(f"Cleaned data: {cleaned_data}")
                     return cleaned_data
             except json.JSONDecodeError:
@@ -567,13 +1076,14 @@ CRITICAL INSTRUCTIONS:
                 try:
                     data = json.loads(json_str)
                     if isinstance(data, dict):
-                        cleaned_data = clean_dict(data, response)
+                        cleaned_data = clean_dict(data)
                         return cleaned_data
                 except json.JSONDecodeError:
                     pass
 
             # 3. Manual parsing (fallback)
             metadata = {}
+            missing = []
             lines = response.split('\n')
             for line in lines:
                 line = line.strip()
@@ -581,16 +1091,23 @@ CRITICAL INSTRUCTIONS:
                     try:
                         key, value = line.split(':', 1)
                         key = key.strip().strip('"\'')
-                        value = value.strip().strip('"\'')
+                        value = value.strip().rstrip(',').strip().strip('"\'')
                         if key and value:
                             if value.lower() != "not found":
                                 metadata[key] = value
                             else:
-                                partial_matches = self._find_partial_matches(key, response)
-                                metadata[key] = partial_matches if partial_matches else "Not found"
+                                metadata[key] = "Not found"
+                                missing.append(key)
                     except Exception:
                         continue
 
+            partial_matches = self._find_all_partial_matches(missing, response)
+            for key in missing:
+                match = partial_matches[key]
+                # The line answering "Not found" is itself a match, and not an answer
+                if metadata[key] == "Not found" and match and "not found" not in match.lower():
+                    metadata[key] = match
+
             return metadata
 
         except Exception as e:
@@ -599,42 +1116,17 @@ CRITICAL INSTRUCTIONS:
             return {}
     def _find_partial_matches(self, field_name: str, text: str) -> str:
         """Find partial matches for a field in the text."""
+        return self._find_all_partial_matches([field_name], text).get(field_name)
+
+    def _find_all_partial_matches(self, field_names: List[str], text: str) -> Dict[str, Optional[str]]:
+        """Find partial matches for several fields with a single scan of the text."""
+        if not field_names:
+            return {}
         try:
-            # Convert field name to lowercase for case-insensitive matching
-            field_lower = field_name.lower()
-            
-            # Look for variations of the field name
-            variations = [
-                field_lower,
-                field_lower.replace('/', ' or '),
-                field_lower.replace('_', ' '),
-                field_lower.replace('-', ' '),
-                field_lower.replace(' and ', ' & '),
-                field_lower.replace(' & ', ' and ')
-            ]
-            
-            # Look for the field name and its variations in the text
-            for variation in variations:
-                if variation in text.lower():
-                    # Find the context around the match
-                    start_idx = text.lower().find(variation)
-                    if start_idx != -1:
-                        # Get some context before and after the match
-                        context_start = max(0, start_idx - 100)
-                        context_end = min(len(text), start_idx + len(variation) + 100)
-                        context = text[context_start:context_end]
-                        
-                        # Extract the most relevant part
-                        lines = context.split('\n')
-                        for line in lines:
-                            if variation in line.lower():
-                                return line.strip()
-            
-            return None
-            
+            return PartialMatchIndex(text).find_all(field_names)
         except Exception as e:
             logger.error(f"Error finding partial matches: {str(e)}")
-            return None
+            return {name: None for name in field_names}
 
     def get_files_to_process(self, url: str) -> list:
         """
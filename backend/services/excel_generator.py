@@ -1,65 +1,42 @@
 import os
 import pandas as pd
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
 import logging
 from datetime import datetime
 import re
 import time
-from services.metadata_storage import MetadataStorage
+from context.compiled_template import REQUIRED_COLUMNS, CompiledTemplate, sanitize_column_name
+from context.template_context import TemplateContext
+from services.metadata_index import get_metadata_index
+from services.row_schema import RowSchema
+from services.upload_ledger import get_upload_ledger, hash_row, hash_workbook_content
 import openpyxl
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Fraction of blanked (deleted) rows in a workbook above which it is rebuilt
+TOMBSTONE_COMPACT_RATIO = 0.25
+
 class ExcelGenerator:
-    def __init__(self, output_dir: str = "output"):
+    def __init__(self, output_dir: str = "output", row_delta: Optional[bool] = None):
         self.output_dir = output_dir
         os.makedirs(output_dir, exist_ok=True)
         self.logger = logging.getLogger(__name__)
-        self.metadata_storage = MetadataStorage()
+        self.template_context = TemplateContext()
+        self.metadata_index = get_metadata_index()
+        self.metadata_storage = self.metadata_index.storage
         self.template_excel_files = {}  # Store Excel paths for each template
-        self._load_existing_data()
-
-    def _load_existing_data(self):
-        """Load existing data from both Excel and metadata storage"""
-        try:
-            # Initialize lists
-            self.metadata_list = []
-            self.document_urls = []
-            
-            # Load from metadata storage
-            stored_metadata = self.metadata_storage.get_metadata()
-            if stored_metadata:
-                for doc in stored_metadata:
-                    if 'File Name' in doc and 'Template ID' in doc:
-                        template_id = doc['Template ID']
-                        if template_id not in self.template_excel_files:
-                            self.template_excel_files[template_id] = os.path.join(
-                                self.output_dir, 
-                                f"extracted_data_{template_id}.xlsx"
-                            )
-                        self.metadata_list.append(doc)
-                        self.document_urls.append(doc['File Name'])
-                # self.logger.info(f"Loaded {len(self.metadata_list)} documents from metadata storage")
-                return
-
-            # Fallback to Excel if no stored metadata
-            for template_id, excel_path in self.template_excel_files.items():
-                if os.path.exists(excel_path):
-                    df = pd.read_excel(excel_path)
-                    if not df.empty:
-                        for _, row in df.iterrows():
-                            doc = row.to_dict()
-                            doc['Template ID'] = template_id
-                            self.metadata_list.append(doc)
-                            self.document_urls.append(doc.get('File Name', ''))
-                        # self.logger.info(f"Loaded {len(df)} documents from Excel for template {template_id}")
-        except Exception as e:
-            self.logger.error(f"Error loading existing data: {e}")
-            # Initialize empty lists if there's an error
-            self.metadata_list = []
-            self.document_urls = []
+        self.upload_ledger = get_upload_ledger()
+        # Push only new rows to an already uploaded workbook instead of replacing it
+        if row_delta is None:
+            row_delta = os.getenv('SHAREPOINT_ROW_DELTA', 'false').lower() == 'true'
+        self.row_delta = row_delta
+        # Worksheet row holding each document, per template: {template_id: {document_url: row}}
+        self._row_locations = {}
+        # Number of blanked rows per template workbook awaiting compaction
+        self._tombstones = {}
 
     def _get_excel_path(self, template_id: str) -> str:
         """Get the Excel file path for a specific template"""
@@ -178,23 +155,11 @@ class ExcelGenerator:
                 else:
                     file_name = os.path.basename(document_url)
             
-            # Get template fields from template context
-            from context.template_context import TemplateContext
-            template_context = TemplateContext()
-            template = template_context.get_template(template_id)
-            if not template:
-                logger.error(f"No template found for template ID: {template_id}")
-                raise ValueError(f"No template found for template ID: {template_id}")
-            
-            template_fields = template.get('metadataFields', [])
-            if not template_fields:
-                logger.error(f"No template fields found for template ID: {template_id}")
-                raise ValueError(f"No template fields found for template ID: {template_id}")
+            compiled = self._get_compiled_template(template_id)
             
             # Create a new metadata dict with only template fields
             cleaned_metadata = {}
-            for field in template_fields:
-                field_name = field.get('name')
+            for field_name in compiled.field_names:
                 if field_name in metadata:
                     # Clean the value for Excel
                     cleaned_value = self._clean_metadata_value(metadata[field_name])
@@ -203,17 +168,19 @@ class ExcelGenerator:
                     cleaned_metadata[field_name] = "Not found"
             
             # Add required fields
+            # Key the record by the document's own URL when the worker supplied one,
+            # keeping the requested (folder) URL to locate the upload target
+            record_url = metadata.get('Document URL') or document_url
             cleaned_metadata['File Name'] = file_name
             cleaned_metadata['Template ID'] = template_id
-            cleaned_metadata['Document URL'] = document_url 
-            
-            # Add to metadata storage
-            self.metadata_storage.add_metadata(cleaned_metadata, document_url)
+            cleaned_metadata['Document URL'] = record_url
+            cleaned_metadata['Source URL'] = document_url
             
-            # Always append new metadata
-            self.metadata_list.append(cleaned_metadata)
-            self.document_urls.append(file_name)
-            logger.info(f"Added new metadata for file: {file_name}")
+            # Add to the metadata index, replacing any earlier record for this document
+            if self.metadata_index.upsert(template_id, record_url, cleaned_metadata):
+                logger.info(f"Added new metadata for file: {file_name}")
+            else:
+                logger.info(f"Updated metadata for file: {file_name}")
 
             # Generate Excel with all accumulated metadata for this template
             return self.generate_excel(template_id)
@@ -222,53 +189,20 @@ class ExcelGenerator:
             logger.error(f"Error adding metadata: {str(e)}")
             raise
 
+    def _get_compiled_template(self, template_id: str) -> CompiledTemplate:
+        """Get a template's compiled form, failing if it is missing or has no fields."""
+        compiled = self.template_context.get_compiled_template(template_id)
+        if not compiled:
+            logger.error(f"No template found for template ID: {template_id}")
+            raise ValueError(f"No template found for template ID: {template_id}")
+        if not compiled.field_names:
+            logger.error(f"No template fields found for template ID: {template_id}")
+            raise ValueError(f"No template fields found for template ID: {template_id}")
+        return compiled
+
     def _sanitize_column_name(self, column_name: str) -> str:
         """Sanitize column name to be valid for Excel."""
-        try:
-            # Handle None or empty values
-            if not column_name:
-                return "Column"
-                
-            # Convert to string if not already
-            column_name = str(column_name)
-            
-            # First, handle special cases for template-specific columns
-            if '[' in column_name or ']' in column_name:
-                # Extract content between square brackets if it exists
-                import re
-                bracket_content = re.findall(r'\[(.*?)\]', column_name)
-                if bracket_content:
-                    column_name = '_'.join(bracket_content)
-                else:
-                    # Remove brackets if no content between them
-                    column_name = column_name.replace('[', '').replace(']', '')
-            
-            # Remove any characters that are not letters, numbers, or spaces
-            sanitized = ''.join(c for c in column_name if c.isalnum() or c.isspace())
-            
-            # Replace multiple spaces with single space
-            sanitized = ' '.join(sanitized.split())
-            
-            # Replace spaces with underscores
-            sanitized = sanitized.replace(' ', '_')
-            
-            # Ensure the name starts with a letter
-            if sanitized and not sanitized[0].isalpha():
-                sanitized = 'C_' + sanitized
-            
-            # Ensure the name is not empty
-            if not sanitized:
-                sanitized = 'Column'
-                
-            # Ensure the name is not too long (Excel has a limit)
-            if len(sanitized) > 31:
-                sanitized = sanitized[:31]
-                
-            return sanitized
-            
-        except Exception as e:
-            logger.error(f"Error sanitizing column name '{column_name}': {str(e)}")
-            return "Column"  # Return a safe default value
+        return sanitize_column_name(column_name)
 
     def generate_excel(self, template_id: str) -> Dict[str, str]:
         """Generate Excel file with all metadata for a specific template."""
@@ -279,39 +213,27 @@ class ExcelGenerator:
             # Get template-specific Excel path
             excel_path = self._get_excel_path(template_id)
             
-            # Get template fields from template context
-            from context.template_context import TemplateContext
-            template_context = TemplateContext()
-            template = template_context.get_template(template_id)
-            if not template:
-                logger.error(f"No template found for template ID: {template_id}")
-                raise ValueError(f"No template found for template ID: {template_id}")
-            
-            template_fields = template.get('metadataFields', [])
-            if not template_fields:
-                logger.error(f"No template fields found for template ID: {template_id}")
-                raise ValueError(f"No template fields found for template ID: {template_id}")
+            compiled = self._get_compiled_template(template_id)
             
             # Filter metadata for this template
-            template_metadata = [doc for doc in self.metadata_list if doc.get('Template ID') == template_id]
-            
-            # Create DataFrame with only template fields
-            df_data = []
-            for doc in template_metadata:
-                row = {}
-                for field in template_fields:
-                    field_name = field.get('name')
-                    row[field_name] = doc.get(field_name, "Not found")
-                # Add required fields
-                row['File Name'] = doc.get('File Name', '')
-                row['Template ID'] = doc.get('Template ID', '')
-                df_data.append(row)
-            
-            # Create DataFrame
-            df = pd.DataFrame(df_data)
+            schema, template_rows = self.metadata_index.rows(template_id)
+            
+            # Create DataFrame with only template fields, read straight from the stored rows
+            column_names = compiled.column_names
+            defaults = ["Not found"] * len(compiled.field_names) + [''] * len(REQUIRED_COLUMNS)
+            df_data = [
+                [schema.get(row, name, default) for name, default in zip(column_names, defaults)]
+                for _, row in template_rows
+            ]
+            
+            # Record the worksheet row of each document (row 1 is the header)
+            self._row_locations[template_id] = {
+                document_url: index + 2 for index, (document_url, _) in enumerate(template_rows)
+            }
+            self._tombstones[template_id] = 0
             
-            # Sanitize column names
-            df.columns = [self._sanitize_column_name(col) for col in df.columns]
+            # Create DataFrame with the precomputed Excel-safe header
+            df = pd.DataFrame(df_data, columns=list(compiled.sanitized_columns))
             
             # Create Excel writer
             with pd.ExcelWriter(excel_path, engine='openpyxl') as writer:
@@ -325,7 +247,7 @@ class ExcelGenerator:
                 # Set column widths and enable text wrapping
                 for idx, col in enumerate(df.columns):
                     # Set column width
-                    worksheet.column_dimensions[chr(65 + idx)].width = 30
+                    worksheet.column_dimensions[compiled.column_letters[idx]].width = 30
                     
                     # Enable text wrapping for all cells in this column
                     for row in range(2, len(df) + 2):  # Start from row 2 (after header)
@@ -344,63 +266,10 @@ class ExcelGenerator:
             # logger.info(f"Excel file generated successfully: {excel_path}")
             
             # Upload Excel file to SharePoint and get URL
-            sharepoint_url = None
-            try:
-                from services.sharepoint_service import SharePointService
-                sharepoint_service = SharePointService()
-                
-                # Get the folder path from the first document's URL
-                doc_url = None
-                if template_metadata and 'Document URL' in template_metadata[0]:
-                    doc_url = template_metadata[0]['Document URL']
-                elif template_metadata and 'webUrl' in template_metadata[0]:
-                    doc_url = template_metadata[0]['webUrl']
-                else:
-                    for doc in template_metadata:
-                        for key in doc:
-                            if isinstance(doc[key], str) and 'graph.microsoft.com' in doc[key]:
-                                doc_url = doc[key]
-                                break
-                        if doc_url:
-                            break
-                if doc_url:
-                    # logger.info(f"Processing document URL: {doc_url}")
-                    if 'graph.microsoft.com' in doc_url and '/drive/root:/' in doc_url:
-                        try:
-                            full_path = doc_url.split('/drive/root:/')[1]
-                            folder_path = full_path.split(':/')[0]
-                            folder_path = folder_path.rstrip('/')
-                            folder_path = folder_path.replace('%20', ' ')
-                            if not folder_path:
-                                raise ValueError("Empty folder path extracted from URL")
-                            with open(excel_path, 'rb') as file:
-                                file_content = file.read()
-                                file_name = os.path.basename(excel_path)
-                                if not file_content:
-                                    logger.error("Excel file content is empty")
-                                else:
-                                    try:
-                                        sharepoint_url = sharepoint_service.upload_file(file_content, file_name, folder_path)
-                                        if sharepoint_url:
-                                            logger.info(f"Excel file uploaded successfully to SharePoint: {sharepoint_url}")
-                                        else:
-                                            logger.error("Failed to get SharePoint URL after upload")
-                                    except Exception as upload_error:
-                                        logger.error(f"Error during SharePoint upload: {str(upload_error)}")
-                                        logger.error(f"Upload URL: {doc_url}")
-                                        logger.error(f"Target folder: {folder_path}")
-                                        logger.error(f"File name: {file_name}")
-                                        logger.error(f"File size: {len(file_content)} bytes")
-                        except Exception as path_error:
-                            logger.error(f"Error extracting folder path from URL: {str(path_error)}")
-                            logger.error(f"Original URL: {doc_url}")
-                    else:
-                        logger.error(f"Invalid Graph API URL: {doc_url}")
-                else:
-                    logger.error("No document URL found in template metadata")
-            except Exception as e:
-                logger.error(f"Error uploading Excel to SharePoint: {str(e)}")
-                # Continue even if upload fails
+            sharepoint_url = self._upload_to_sharepoint(
+                template_id, excel_path, (schema, template_rows),
+                [str(col) for col in df.columns], df.fillna('').astype(str).values.tolist()
+            )
             
             return {
                 'local_path': excel_path,
@@ -411,9 +280,194 @@ class ExcelGenerator:
             logger.error(f"Error generating Excel file: {str(e)}")
             raise
 
+    def _get_upload_folder(self, template_metadata: Tuple[RowSchema, List[Tuple[str, Tuple]]]) -> Optional[str]:
+        """Get the SharePoint folder the workbook belongs in from the documents' URLs."""
+        schema, template_rows = template_metadata
+        first_row = template_rows[0][1] if template_rows else ()
+        doc_url = None
+        for key in ('Source URL', 'Document URL', 'webUrl'):
+            doc_url = schema.get(first_row, key)
+            if doc_url:
+                break
+        else:
+            for _, row in template_rows:
+                for value in row:
+                    if isinstance(value, str) and 'graph.microsoft.com' in value:
+                        doc_url = value
+                        break
+                if doc_url:
+                    break
+        if not doc_url:
+            logger.error("No document URL found in template metadata")
+            return None
+        if 'graph.microsoft.com' not in doc_url or '/drive/root:/' not in doc_url:
+            logger.error(f"Invalid Graph API URL: {doc_url}")
+            return None
+        try:
+            full_path = doc_url.split('/drive/root:/')[1]
+            folder_path = full_path.split(':/')[0]
+            folder_path = folder_path.rstrip('/')
+            folder_path = folder_path.replace('%20', ' ')
+            if not folder_path:
+                raise ValueError("Empty folder path extracted from URL")
+            return folder_path
+        except Exception as path_error:
+            logger.error(f"Error extracting folder path from URL: {str(path_error)}")
+            logger.error(f"Original URL: {doc_url}")
+            return None
+
+    def _upload_to_sharepoint(self, template_id: str, excel_path: str,
+                              template_metadata: Tuple[RowSchema, List[Tuple[str, Tuple]]],
+                              columns: List[str], rows: List[List[str]]) -> Optional[str]:
+        """
+        Upload the rendered workbook to SharePoint unless the ledger shows the
+        same content is already there.
+
+        In row-delta mode, a render that only adds rows to the uploaded one is
+        pushed as the new rows through the Graph workbook API instead of
+        replacing the remote file.
+
+        Returns:
+            Optional[str]: SharePoint URL of the workbook, None if not uploaded
+        """
+        try:
+            folder_path = self._get_upload_folder(template_metadata)
+            if not folder_path:
+                return None
+
+            file_name = os.path.basename(excel_path)
+            row_hashes = [hash_row(row) for row in rows]
+            content_hash = hash_workbook_content(columns, row_hashes)
+
+            if self.upload_ledger.is_unchanged(template_id, folder_path, content_hash):
+                entry = self.upload_ledger.get_entry(template_id, folder_path)
+                logger.info(f"Workbook for template {template_id} unchanged, skipping SharePoint upload")
+                return entry['sharepoint_url']
+
+            from services.sharepoint_service import SharePointService
+            sharepoint_service = SharePointService()
+
+            if self.row_delta:
+                uploaded_rows = self.upload_ledger.get_appended_rows(template_id, folder_path, columns, row_hashes)
+                if uploaded_rows is not None:
+                    try:
+                        # Row 1 is the header, so the first new row follows the uploaded ones
+                        sharepoint_service.append_rows(
+                            file_name, folder_path, 'Metadata', uploaded_rows + 2, rows[uploaded_rows:]
+                        )
+                        sharepoint_url = self.upload_ledger.get_entry(template_id, folder_path)['sharepoint_url']
+                        self.upload_ledger.record_upload(
+                            template_id, folder_path, file_name, columns, row_hashes, content_hash, sharepoint_url
+                        )
+                        logger.info(f"Appended {len(rows) - uploaded_rows} row(s) to SharePoint workbook: {sharepoint_url}")
+                        return sharepoint_url
+                    except Exception as delta_error:
+                        logger.warning(f"Row append failed, uploading full workbook: {str(delta_error)}")
+
+            with open(excel_path, 'rb') as file:
+                file_content = file.read()
+            if not file_content:
+                logger.error("Excel file content is empty")
+                return None
+
+            try:
+                sharepoint_url = sharepoint_service.upload_file(file_content, file_name, folder_path)
+            except Exception as upload_error:
+                logger.error(f"Error during SharePoint upload: {str(upload_error)}")
+                logger.error(f"Target folder: {folder_path}")
+                logger.error(f"File name: {file_name}")
+                logger.error(f"File size: {len(file_content)} bytes")
+                return None
+
+            if sharepoint_url:
+                self.upload_ledger.record_upload(
+                    template_id, folder_path, file_name, columns, row_hashes, content_hash, sharepoint_url
+                )
+                logger.info(f"Excel file uploaded successfully to SharePoint: {sharepoint_url}")
+            else:
+                logger.error("Failed to get SharePoint URL after upload")
+            return sharepoint_url
+
+        except Exception as e:
+            logger.error(f"Error uploading Excel to SharePoint: {str(e)}")
+            # Continue even if upload fails
+            return None
+
     def get_current_excel_path(self, template_id: str) -> str:
         return self._get_excel_path(template_id)
 
+    def delete_metadata(self, document_url: str, template_id: str) -> Optional[Dict[str, str]]:
+        """
+        Delete a document from the metadata index and its template workbooks.
+
+        Rows are blanked in place and left as tombstones, so the rest of the
+        worksheet does not move. A workbook is rebuilt once tombstones exceed
+        TOMBSTONE_COMPACT_RATIO of its rows.
+
+        Args:
+            document_url (str): URL of the document to delete
+            template_id (str): ID of the template the delete was requested for
+
+        Returns:
+            Optional[Dict[str, str]]: Local path and SharePoint URL of the
+            requested template's workbook, None if it was removed
+        """
+        try:
+            # Remove from every template that held the document, as storage does
+            affected_templates = set(self.metadata_index.remove(document_url)) | {template_id}
+
+            result = None
+            for affected_id in affected_templates:
+                updated = self._delete_rows(document_url, affected_id)
+                if affected_id == template_id:
+                    result = updated
+            return result
+
+        except Exception as e:
+            logger.error(f"Error deleting metadata: {str(e)}")
+            raise
+
+    def _delete_rows(self, document_url: str, template_id: str) -> Optional[Dict[str, str]]:
+        """Blank a document's rows in a template workbook, compacting when needed."""
+        excel_path = self._get_excel_path(template_id)
+        template_metadata = self.metadata_index.rows(template_id)
+
+        # If no metadata left for this template, remove the Excel file
+        if not template_metadata[1]:
+            self._row_locations.pop(template_id, None)
+            self._tombstones.pop(template_id, None)
+            if os.path.exists(excel_path):
+                os.remove(excel_path)
+            return None
+
+        # Without a known row layout (e.g. workbook rendered by another process), rebuild
+        row_locations = self._row_locations.get(template_id)
+        if row_locations is None or not os.path.exists(excel_path):
+            return self.generate_excel(template_id)
+
+        row = row_locations.pop(document_url, None)
+        if row is None:
+            return {'local_path': excel_path, 'sharepoint_url': None}
+
+        tombstones = self._tombstones.get(template_id, 0) + 1
+        if tombstones > (len(template_metadata[1]) + tombstones) * TOMBSTONE_COMPACT_RATIO:
+            return self.generate_excel(template_id)
+        self._tombstones[template_id] = tombstones
+
+        workbook = openpyxl.load_workbook(excel_path)
+        worksheet = workbook['Metadata']
+        for cell in worksheet[row]:
+            cell.value = None
+        workbook.save(excel_path)
+
+        columns = [str(cell.value) for cell in worksheet[1]]
+        sheet_rows = [
+            ['' if value is None else str(value) for value in row]
+            for row in worksheet.iter_rows(min_row=2, max_col=len(columns), values_only=True)
+        ]
+        sharepoint_url = self._upload_to_sharepoint(template_id, excel_path, template_metadata, columns, sheet_rows)
+        return {'local_path': excel_path, 'sharepoint_url': sharepoint_url}
+
     # def clear_data(self, template_id: str = None) -> None:
     #     if template_id:
     #         # Clear data for specific template
@@ -432,44 +486,3 @@ class ExcelGenerator:
     #         self.template_excel_files = {}
     #     self.metadata_storage._save_metadata()
     #     logger.info("Cleared stored data")
-
-    # def delete_metadata(self, document_url: str, template_id: str) -> str:
-    #     """
-    #     Delete metadata for a specific document from the Excel file.
-        
-    #     Args:
-    #         document_url (str): URL of the document to delete
-    #         template_id (str): ID of the template
-            
-    #     Returns:
-    #         str: Path to the updated Excel file
-    #     """
-    #     try:
-    #         # Extract file name from URL
-    #         if 'sharepoint.com' in document_url.lower():
-    #             try:
-    #                 file_name = document_url.split('Documents/')[-1]
-    #                 file_name = file_name.replace('%20', ' ')
-    #             except:
-    #                 file_name = os.path.basename(document_url)
-    #         else:
-    #             file_name = os.path.basename(document_url)
-            
-    #         # Remove from metadata list and document URLs
-    #         self.metadata_list = [doc for doc in self.metadata_list if doc.get('File Name') != file_name]
-    #         self.document_urls = [url for url in self.document_urls if url != file_name]
-            
-    #         # If no metadata left for this template, remove the Excel file
-    #         template_metadata = [doc for doc in self.metadata_list if doc.get('Template ID') == template_id]
-    #         if not template_metadata:
-    #             excel_path = self._get_excel_path(template_id)
-    #             if os.path.exists(excel_path):
-    #                 os.remove(excel_path)
-    #             return excel_path
-            
-    #         # Generate updated Excel file with remaining metadata
-    #         return self.generate_excel(template_id)
-            
-    #     except Exception as e:
-    #         logger.error(f"Error deleting metadata: {str(e)}")
-    #         raise
@@ -0,0 +1,132 @@
+import os
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+from services.append_log import AppendOnlyLog
+
+logger = logging.getLogger(__name__)
+
+# Most extractions kept; the oldest are dropped first
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv('EXTRACTION_CACHE_MAX_ENTRIES', '5000'))
+
+# Keys every extraction result gets per file, which are not part of the cached content
+PER_FILE_KEYS = ('Document URL', 'File Name')
+
+
+class ExtractionCache:
+    """
+    Remembers extraction results by document content, so a PDF that was
+    already extracted under another name, in another folder or in an
+    earlier job is not sent to the LLM again.
+
+    Entries are keyed by the SHA-256 of the PDF bytes, the template's
+    schema hash, the model(s) used and the extraction settings. Each
+    change is appended to a JSON-lines file, which is compacted once it
+    holds more than twice max_entries records.
+    """
+
+    def __init__(self, storage_file: str = "extraction_cache.jsonl", max_entries: int = None):
+        self.storage_file = storage_file
+        self.max_entries = max_entries or EXTRACTION_CACHE_MAX_ENTRIES
+        self.entries = {}
+        self._log = AppendOnlyLog(storage_file, "extraction cache")
+        self._lock = threading.Lock()
+        self._load_cache()
+
+    @staticmethod
+    def _key(content_hash: str, schema_hash: str, model_key: str, settings: str) -> str:
+        return f"{content_hash}::{schema_hash}::{model_key}::{settings}"
+
+    def _load_cache(self) -> None:
+        """Load the cache by replaying the storage file."""
+        try:
+            self.entries = {}
+            for record in self._log.read():
+                if record.get('deleted'):
+                    self.entries.pop(record['key'], None)
+                    continue
+                self.entries[record['key']] = {'metadata': record['metadata'], 'cached_at': record['cached_at']}
+                self._evict()
+        except Exception as e:
+            logger.error(f"Error loading extraction cache: {str(e)}")
+            self.entries = {}
+
+    def _evict(self) -> None:
+        # Entries are kept in insertion order, so the first ones are the oldest
+        while len(self.entries) > self.max_entries:
+            self.entries.pop(next(iter(self.entries)))
+
+    def _compact_cache(self) -> None:
+        """Rewrite the storage file with only the live entries."""
+        self._log.rewrite({'key': key, **entry} for key, entry in self.entries.items())
+
+    def get(self, content_hash: str, schema_hash: str, model_key: str, settings: str = "") -> Optional[Dict]:
+        """
+        Get a cached extraction.
+
+        Args:
+            content_hash (str): SHA-256 of the document bytes
+            schema_hash (str): Schema hash of the template
+            model_key (str): The model, or cascade of models, that extracted it
+            settings (str, optional): The extraction settings it was made with
+
+        Returns:
+            Optional[Dict]: A copy of the cached field values, None when not cached
+        """
+        with self._lock:
+            entry = self.entries.get(self._key(content_hash, schema_hash, model_key, settings))
+            return dict(entry['metadata']) if entry else None
+
+    def put(self, content_hash: str, schema_hash: str, model_key: str, metadata: Dict, settings: str = "") -> None:
+        """Cache an extraction, leaving out the keys that belong to a particular file."""
+        key = self._key(content_hash, schema_hash, model_key, settings)
+        entry = {
+            'metadata': {name: value for name, value in metadata.items() if name not in PER_FILE_KEYS},
+            'cached_at': datetime.now().isoformat()
+        }
+        with self._lock:
+            self.entries.pop(key, None)
+            self.entries[key] = entry
+            self._evict()
+            if self._log.lines >= 2 * self.max_entries:
+                self._compact_cache()
+            else:
+                self._log.append({'key': key, **entry})
+
+    def invalidate(self, content_hash: Optional[str] = None) -> int:
+        """
+        Drop cached extractions, so their documents are extracted afresh.
+
+        Args:
+            content_hash (str, optional): Only drop this document's extractions; drops all when omitted
+
+        Returns:
+            int: The number of extractions dropped
+        """
+        with self._lock:
+            if content_hash is None:
+                dropped = len(self.entries)
+                self.entries = {}
+                self._compact_cache()
+                return dropped
+            keys = [key for key in self.entries if key.startswith(f"{content_hash}::")]
+            for key in keys:
+                del self.entries[key]
+                self._log.append({'key': key, 'deleted': True})
+            return len(keys)
+
+
+_extraction_cache = None
+_extraction_cache_lock = threading.Lock()
+
+
+def get_extraction_cache() -> ExtractionCache:
+    """Get the process-wide extraction cache."""
+    global _extraction_cache
+    if _extraction_cache is None:
+        with _extraction_cache_lock:
+            if _extraction_cache is None:
+                _extraction_cache = ExtractionCache()
+    return _extraction_cache
@@ -0,0 +1,99 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from context.compiled_template import (
+    CompiledTemplate, render_field_description, render_field_search_instructions, subset_template
+)
+from services.metrics import metrics
+from services.scheduler import PRIORITY_BATCH, PRIORITY_CLASSES, PRIORITY_INTERACTIVE, current_priority
+
+logger = logging.getLogger(__name__)
+
+# Estimated prompt and answer tokens per group of fields; 0 sends each call's fields in one request
+FIELD_GROUP_TOKEN_BUDGET = int(os.getenv('FIELD_GROUP_TOKEN_BUDGET', '0'))
+# Estimated answer tokens per field, added to its share of the prompt
+FIELD_GROUP_ANSWER_TOKENS = int(os.getenv('FIELD_GROUP_ANSWER_TOKENS', '60'))
+# Field-group requests in flight at once per priority class, across all documents
+FIELD_GROUP_MAX_WORKERS = int(os.getenv('FIELD_GROUP_MAX_WORKERS', '8'))
+
+# Characters per token, for estimates without a tokenizer
+CHARS_PER_TOKEN = 4
+
+# One pool per priority class, so interactive groups never queue behind bulk ones
+_field_group_pools = {cls: ThreadPoolExecutor(max_workers=FIELD_GROUP_MAX_WORKERS) for cls in PRIORITY_CLASSES}
+
+
+def estimate_field_tokens(name: str, description: str) -> int:
+    """Estimate the tokens a field adds to a request: its prompt lines plus its answer."""
+    prompt = render_field_description(name, description) + render_field_search_instructions(name)
+    return len(prompt) // CHARS_PER_TOKEN + FIELD_GROUP_ANSWER_TOKENS
+
+
+def split_field_groups(compiled: CompiledTemplate, token_budget: Optional[int] = None) -> List[CompiledTemplate]:
+    """
+    Split a template's fields into groups that each fit a token budget.
+
+    The groups are about equal in size, keep template order, and hold at
+    least one field each, so a field over the budget gets a group of its own.
+
+    Args:
+        compiled (CompiledTemplate): The fields to split
+        token_budget (int, optional): Estimated tokens per group; defaults to FIELD_GROUP_TOKEN_BUDGET
+
+    Returns:
+        List[CompiledTemplate]: The groups, or just compiled when it fits or grouping is off
+    """
+    token_budget = FIELD_GROUP_TOKEN_BUDGET if token_budget is None else token_budget
+    costs = [estimate_field_tokens(name, description) for name, description in compiled.fields]
+    total = sum(costs)
+    if token_budget <= 0 or total <= token_budget or len(costs) < 2:
+        return [compiled]
+
+    # Aim for equal groups rather than filling each to the budget and leaving a small remainder
+    group_count = min(-(-total // token_budget), len(costs))
+    target = total / group_count
+    groups, current, current_cost = [], [], 0
+    for (name, _), cost in zip(compiled.fields, costs):
+        if current and (current_cost + cost > token_budget or current_cost + cost / 2 > target):
+            groups.append(current)
+            current, current_cost = [], 0
+        current.append(name)
+        current_cost += cost
+    groups.append(current)
+    return [subset_template(compiled, names) for names in groups]
+
+
+def run_field_groups(calls: Sequence[Tuple[CompiledTemplate, str]],
+                     extract: Callable[[CompiledTemplate, str], Dict]) -> List[Tuple[CompiledTemplate, Dict]]:
+    """
+    Run a document's extraction calls, split into field groups, concurrently.
+
+    Args:
+        calls (Sequence[Tuple[CompiledTemplate, str]]): The fields and document text of each call
+        extract (Callable[[CompiledTemplate, str], Dict]): Extracts one group's fields from a text
+
+    Returns:
+        List[Tuple[CompiledTemplate, Dict]]: Each group and its field values, in call and template order
+
+    Raises:
+        Exception: The first failing group's error, once every group has finished
+    """
+    groups = [(group, text) for call_template, text in calls for group in split_field_groups(call_template)]
+    if len(groups) == 1:
+        group, text = groups[0]
+        return [(group, extract(group, text))]
+
+    if len(groups) > len(calls):
+        metrics.increment("field_groups.split_calls")
+        metrics.increment("field_groups.groups", len(groups))
+        logger.info(f"Extracting {len(groups)} field groups concurrently: {[len(group.fields) for group, _ in groups]}")
+    pool = _field_group_pools[PRIORITY_INTERACTIVE if current_priority() == PRIORITY_INTERACTIVE else PRIORITY_BATCH]
+    futures = [pool.submit(extract, group, text) for group, text in groups]
+    # Wait for every group before failing, so no request is left running unobserved
+    errors = [future.exception() for future in futures]
+    for error in errors:
+        if error is not None:
+            raise error
+    return [(group, future.result()) for (group, _), future in zip(groups, futures)]
@@ -0,0 +1,184 @@
+import os
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+
+from services.cancellation import CancellationToken, OperationCancelled
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Set to 'true' to fire a duplicate LLM request when the first one is slow
+HEDGE_REQUESTS = os.getenv('HEDGE_REQUESTS', 'false').lower() == 'true'
+# Percentile of the model's recent generation times after which the duplicate is fired
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', '95'))
+# Recent generations needed before hedging a model, and the shortest wait before a hedge
+HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', '20'))
+HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', '5'))
+# Comma-separated model=alternate pairs; the duplicate goes to the alternate model when one is given
+HEDGE_ALTERNATE_MODELS = dict(
+    pair.split('=', 1) for pair in os.getenv('HEDGE_ALTERNATE_MODELS', '').split(',') if '=' in pair
+)
+
+# Runs hedged requests; the original request runs on its caller's thread
+_hedge_pool = ThreadPoolExecutor(max_workers=int(os.getenv('HEDGE_MAX_WORKERS', '8')))
+
+T = TypeVar('T')
+
+
+def hedge_delay(model_id: str) -> Optional[float]:
+    """
+    Get how long to wait for a model before hedging, or None when there is
+    not enough latency history for the model yet.
+    """
+    delay = metrics.percentile(f"llm.{model_id}.generation_time", HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+    if delay is None:
+        return None
+    return max(delay, HEDGE_MIN_DELAY)
+
+
+def hedged_call(call: Callable[[str, Optional[CancellationToken]], T], model_id: str,
+                is_valid: Callable[[T], bool] = bool, cancel_token: Optional[CancellationToken] = None) -> T:
+    """
+    Run a model call, firing a duplicate if it is slower than usual.
+
+    The call runs with model_id on the calling thread. If it has not
+    finished within hedge_delay(model_id) of starting, the same call is
+    started in the hedge pool against the model's alternate (or the same
+    model). The first valid result wins and the other call is cancelled
+    through its token.
+
+    Args:
+        call (Callable[[str, Optional[CancellationToken]], T]): The call, given a model ID and a
+            cancellation token; the token is cancel_token when the call is not hedged
+        model_id (str): The model to call first
+        is_valid (Callable[[T], bool]): Whether a result can win
+        cancel_token (CancellationToken, optional): Cancels the call, and its hedge if one was fired
+
+    Returns:
+        T: The winning result; if neither result is valid, the original call's
+
+    Raises:
+        Exception: The original call's error, when neither call succeeds
+    """
+    delay = hedge_delay(model_id) if HEDGE_REQUESTS else None
+    if delay is None:
+        return call(model_id, cancel_token)
+
+    metrics.increment("hedge.calls")
+    unlinks = []
+    try:
+        primary_token = _linked_token(cancel_token, unlinks)
+        hedge = _Hedge(call, HEDGE_ALTERNATE_MODELS.get(model_id, model_id), _linked_token(cancel_token, unlinks),
+                       primary_token, is_valid)
+        # The delay runs from the call's start, so time the caller spent queued is not taken for slowness
+        timer = threading.Timer(delay, hedge.fire, args=(model_id, delay))
+        timer.daemon = True
+        timer.start()
+        result, error = None, None
+        try:
+            result = call(model_id, primary_token)
+        except OperationCancelled as e:
+            # Cancelled by the caller, or by the hedge winning
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            error = e
+        except Exception as e:
+            error = e
+        finally:
+            timer.cancel()
+            fired = hedge.close()
+
+        if fired and error is None and is_valid(result):
+            hedge.token.cancel()
+            metrics.increment("hedge.original_wins")
+        if not fired or (error is None and is_valid(result)):
+            if error is not None:
+                raise error
+            return result
+        if not isinstance(error, OperationCancelled):
+            logger.warning(f"Original request failed: {str(error)}" if error else "Original request had no valid result")
+
+        hedged = hedge.result()
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        if hedged is not None:
+            metrics.increment("hedge.wins")
+            return hedged[0]
+        # Neither call produced a valid result; report the original call's outcome
+        if error is not None:
+            raise error
+        return result
+    finally:
+        for unlink in unlinks:
+            unlink()
+
+
+def _linked_token(parent: Optional[CancellationToken], unlinks: List[Callable[[], None]]) -> CancellationToken:
+    """Create a token that is also cancelled when the parent token is."""
+    token = CancellationToken()
+    if parent is not None:
+        unlinks.append(parent.add_callback(token.cancel))
+    return token
+
+
+class _Hedge:
+    """The duplicate of a call, fired by a timer while the original runs on its caller's thread."""
+
+    def __init__(self, call: Callable[[str, Optional[CancellationToken]], T], model_id: str,
+                 token: CancellationToken, primary_token: CancellationToken, is_valid: Callable[[T], bool]):
+        self.call = call
+        self.model_id = model_id
+        self.token = token
+        self.future: Optional[Future] = None
+        self._primary_token = primary_token
+        self._is_valid = is_valid
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def fire(self, original_model_id: str, delay: float) -> None:
+        """Start the duplicate, unless the original has finished."""
+        with self._lock:
+            if self._closed:
+                return
+            logger.info(f"No reply from {original_model_id} after {delay:.1f}s, hedging with {self.model_id}")
+            metrics.increment("hedge.fired")
+            self.future = _hedge_pool.submit(self.call, self.model_id, self.token)
+            self.future.add_done_callback(self._on_done)
+
+    def _on_done(self, future: Future) -> None:
+        # A valid duplicate wins, so the original is cancelled
+        if future.exception() is None and self._is_valid(future.result()):
+            self._primary_token.cancel()
+
+    def close(self) -> bool:
+        """Stop the duplicate from being fired, returning whether it already was."""
+        with self._lock:
+            self._closed = True
+            return self.future is not None
+
+    def result(self) -> Optional[Tuple[T]]:
+        """Wait for the fired duplicate, getting its result in a 1-tuple when it is valid."""
+        try:
+            result = self.future.result()
+        except OperationCancelled:
+            return None
+        except Exception as e:
+            logger.warning(f"Hedged request failed: {str(e)}")
+            return None
+        return (result,) if self._is_valid(result) else None
+
+
+def hedge_stats() -> Dict:
+    """Get how often calls are hedged and how often the hedge wins."""
+    calls = metrics.counter("hedge.calls")
+    fired = metrics.counter("hedge.fired")
+    wins = metrics.counter("hedge.wins")
+    return {
+        'enabled': HEDGE_REQUESTS,
+        'calls': calls,
+        'fired': fired,
+        'hedge_rate': round(fired / calls, 4) if calls else None,
+        'hedge_win_rate': round(wins / fired, 4) if fired else None
+    }
@@ -0,0 +1,153 @@
+import json
+import logging
+from typing import Any, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Parser states
+_BEFORE_OBJECT = 0  # Skipping anything ahead of the first '{', such as a ```json fence
+_BEFORE_KEY = 1
+_IN_KEY = 2
+_BEFORE_COLON = 3
+_BEFORE_VALUE = 4
+_IN_VALUE = 5
+_AFTER_VALUE = 6
+_DONE = 7
+
+_WHITESPACE = ' \t\r\n'
+
+
+class IncrementalJsonParser:
+    """
+    Parses the top-level fields of a JSON object as its text arrives in chunks.
+
+    Each field is returned by feed() as soon as its value closes, so a
+    streamed reply can be used before it ends. Nested objects and arrays
+    are returned whole once closed. Text ahead of the object is skipped
+    and text after it is ignored. A field whose value does not parse is
+    skipped; the complete reply can still be parsed as a whole afterwards.
+    """
+
+    def __init__(self):
+        self._state = _BEFORE_OBJECT
+        self._key = []
+        self._value = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self.fields = {}
+
+    @property
+    def complete(self) -> bool:
+        """Whether the top-level object has closed."""
+        return self._state == _DONE
+
+    @property
+    def in_field(self) -> bool:
+        """Whether the parser is inside a field that has not closed yet, such as one following a comma."""
+        return self._state in (_BEFORE_KEY, _IN_KEY, _BEFORE_COLON, _BEFORE_VALUE, _IN_VALUE)
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """
+        Parse the next chunk of text.
+
+        Args:
+            chunk (str): The text following the previous chunk
+
+        Returns:
+            List[Tuple[str, Any]]: The fields whose values closed in this chunk, in order
+        """
+        closed = []
+        for char in chunk:
+            state = self._state
+            if state == _DONE:
+                break
+            if state == _IN_VALUE:
+                if self._in_string:
+                    self._value.append(char)
+                    if self._escaped:
+                        self._escaped = False
+                    elif char == '\\':
+                        self._escaped = True
+                    elif char == '"':
+                        self._in_string = False
+                        if self._depth == 0:
+                            self._close_value(closed)
+                    continue
+                if char == '"':
+                    self._in_string = True
+                    self._value.append(char)
+                elif char in '{[':
+                    self._depth += 1
+                    self._value.append(char)
+                elif char in '}]' and self._depth > 0:
+                    self._depth -= 1
+                    self._value.append(char)
+                    if self._depth == 0:
+                        self._close_value(closed)
+                elif self._depth == 0 and (char in ',}' or char in _WHITESPACE):
+                    # The end of a number or literal
+                    self._close_value(closed)
+                    self._after_value(char)
+                else:
+                    self._value.append(char)
+            elif state == _IN_KEY:
+                if self._escaped:
+                    self._key.append(char)
+                    self._escaped = False
+                elif char == '\\':
+                    self._key.append(char)
+                    self._escaped = True
+                elif char == '"':
+                    self._state = _BEFORE_COLON
+                else:
+                    self._key.append(char)
+            elif state == _BEFORE_OBJECT:
+                if char == '{':
+                    self._state = _BEFORE_KEY
+            elif state == _BEFORE_KEY:
+                if char == '"':
+                    self._key = []
+                    self._state = _IN_KEY
+                elif char == '}':
+                    self._state = _DONE
+            elif state == _BEFORE_COLON:
+                if char == ':':
+                    self._state = _BEFORE_VALUE
+            elif state == _BEFORE_VALUE:
+                if char in _WHITESPACE:
+                    continue
+                self._value = []
+                self._depth = 0
+                self._state = _IN_VALUE
+                if char == '"':
+                    self._in_string = True
+                    self._value.append(char)
+                elif char in '{[':
+                    self._depth = 1
+                    self._value.append(char)
+                else:
+                    self._value.append(char)
+            else:
+                self._after_value(char)
+        return closed
+
+    def _after_value(self, char: str) -> None:
+        if char == ',':
+            self._state = _BEFORE_KEY
+        elif char == '}':
+            self._state = _DONE
+
+    def _close_value(self, closed: List[Tuple[str, Any]]) -> None:
+        self._state = _AFTER_VALUE
+        key_text = ''.join(self._key)
+        value_text = ''.join(self._value)
+        try:
+            # Models sometimes put raw newlines in strings, which strict parsing rejects
+            key = json.loads(f'"{key_text}"', strict=False)
+            value = json.loads(value_text, strict=False)
+        except json.JSONDecodeError:
+            logger.debug(f"Skipping unparsable streamed field '{key_text}': {value_text[:80]}")
+            return
+        self.fields[key] = value
+        closed.append((key, value))
@@ -0,0 +1,173 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from services.cancellation import CancellationToken
+
+logger = logging.getLogger(__name__)
+
+# Jobs remembered for status and event replay; the oldest finished jobs are dropped first
+JOB_HISTORY = int(os.getenv('JOB_HISTORY', '100'))
+
+# Called with an event type and its data as a job's documents move through the pipeline
+ProgressCallback = Callable[[str, Dict], None]
+
+
+class Job:
+    """
+    A folder or document extraction running in the background, with the
+    events it has produced so far.
+
+    Events are numbered from 1 and kept for the job's lifetime, so a client
+    that connects late, or reconnects, can replay them from any point.
+    Cancelling the job cancels its token, which its work checks and which
+    aborts its downloads and LLM requests in flight.
+    """
+
+    def __init__(self, job_id: str, params: Dict):
+        self.id = job_id
+        self.params = params
+        self.status = 'running'
+        self.error = None
+        self.results: List[Dict] = []
+        self.failures: List[Dict] = []
+        self.events: List[Dict] = []
+        self.created_at = datetime.now().isoformat()
+        self.finished_at = None
+        self.cancel_token = CancellationToken()
+        self._start_time = time.time()
+        self._condition = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status != 'running'
+
+    def emit(self, event: str, data: Optional[Dict] = None) -> Dict:
+        """
+        Record an event and wake anyone waiting for it.
+
+        Args:
+            event (str): The event type, such as 'downloaded' or 'document_completed'
+            data (Dict, optional): The event's details
+
+        Returns:
+            Dict: The event, with its ID and the seconds since the job started
+        """
+        with self._condition:
+            record = {
+                'id': len(self.events) + 1,
+                'event': event,
+                'data': dict(data or {}, elapsed=round(time.time() - self._start_time, 3))
+            }
+            self.events.append(record)
+            self._condition.notify_all()
+        return record
+
+    def cancel(self) -> bool:
+        """
+        Ask the job to stop.
+
+        Returns:
+            bool: Whether the job was running and not already cancelled
+        """
+        if self.finished or self.cancel_token.is_cancelled:
+            return False
+        self.emit('job_cancelling')
+        self.cancel_token.cancel()
+        return True
+
+    def add_result(self, metadata: Dict) -> None:
+        with self._condition:
+            self.results.append(metadata)
+
+    def add_failure(self, failure: Dict) -> None:
+        with self._condition:
+            self.failures.append(failure)
+
+    def finish(self, status: str, error: Optional[str] = None) -> None:
+        """Mark the job finished and emit its final event."""
+        with self._condition:
+            self.status = status
+            self.error = error
+            self.finished_at = datetime.now().isoformat()
+        self.emit(f"job_{status}", {
+            'documents_completed': len(self.results),
+            'documents_failed': len(self.failures),
+            'error': error
+        })
+
+    def events_after(self, last_event_id: int, timeout: float) -> List[Dict]:
+        """
+        Get the events after an ID, waiting up to timeout seconds for one if there are none yet.
+
+        Returns:
+            List[Dict]: The new events; empty on timeout or when the job has finished
+        """
+        with self._condition:
+            if len(self.events) <= last_event_id and not self.finished:
+                self._condition.wait(timeout)
+            return self.events[last_event_id:]
+
+    def summary(self) -> Dict:
+        """Get the job's status and counts, without its events."""
+        with self._condition:
+            return {
+                'job_id': self.id,
+                'status': self.status,
+                'error': self.error,
+                'params': self.params,
+                'created_at': self.created_at,
+                'finished_at': self.finished_at,
+                'documents_completed': len(self.results),
+                'documents_failed': len(self.failures),
+                'events': len(self.events)
+            }
+
+
+class JobRegistry:
+    """In-memory registry of background jobs."""
+
+    def __init__(self, max_jobs: int = None):
+        self.max_jobs = max_jobs or JOB_HISTORY
+        self.jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def create(self, params: Dict) -> Job:
+        """Register a new running job."""
+        job = Job(uuid.uuid4().hex, params)
+        with self._lock:
+            self.jobs[job.id] = job
+            # Drop the oldest finished jobs; running ones are kept whatever the count
+            for job_id in [job_id for job_id, old in self.jobs.items() if old.finished]:
+                if len(self.jobs) <= self.max_jobs:
+                    break
+                del self.jobs[job_id]
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list(self) -> List[Dict]:
+        """Get the summaries of all remembered jobs, newest first."""
+        with self._lock:
+            jobs = list(self.jobs.values())
+        return [job.summary() for job in reversed(jobs)]
+
+
+_job_registry = None
+_job_registry_lock = threading.Lock()
+
+
+def get_job_registry() -> JobRegistry:
+    """Get the process-wide job registry."""
+    global _job_registry
+    if _job_registry is None:
+        with _job_registry_lock:
+            if _job_registry is None:
+                _job_registry = JobRegistry()
+    return _job_registry
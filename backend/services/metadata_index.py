@@ -0,0 +1,132 @@
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from services.metadata_storage import MetadataStorage
+from services.row_schema import RowSchema
+
+logger = logging.getLogger(__name__)
+
+
+class MetadataIndex:
+    """
+    In-memory index of extracted metadata, partitioned by template ID and
+    then by document URL.
+
+    Each document has one row per template. Upserting an existing document
+    replaces its row in place and keeps its position, so reprocessing a
+    folder does not grow memory. Partitions are the compact row tables held
+    by MetadataStorage, so records are kept in memory once, as rows; dicts
+    are only built for callers that ask for them.
+    """
+
+    def __init__(self, storage: MetadataStorage):
+        self.storage = storage
+        self._partitions = storage.tables  # {template_id: RowTable}
+        self._templates_by_url = {}  # {document_url: {template_id, ...}}
+        self._lock = threading.RLock()
+        self._load()
+        storage.add_clear_callback(self._reset)
+
+    def _load(self) -> None:
+        """Index the documents held in metadata storage."""
+        try:
+            for template_id, table in self._partitions.items():
+                for document_url in table.rows:
+                    self._templates_by_url.setdefault(document_url, set()).add(template_id)
+            # logger.info(f"Indexed {len(self)} documents from metadata storage")
+        except Exception as e:
+            logger.error(f"Error loading metadata index: {str(e)}")
+
+    def _reset(self) -> None:
+        """Forget every indexed document once storage has been cleared."""
+        with self._lock:
+            self._templates_by_url.clear()
+
+    def upsert(self, template_id: str, document_url: str, record: Dict) -> bool:
+        """
+        Add or replace a document's record for a template and persist it.
+
+        Args:
+            template_id (str): The ID of the template
+            document_url (str): URL identifying the document
+            record (Dict): The cleaned metadata record
+
+        Returns:
+            bool: True if the document was new to the template
+        """
+        with self._lock:
+            table = self._partitions.get(template_id)
+            is_new = table is None or document_url not in table.rows
+            self.storage.add_metadata({**record, 'Template ID': template_id}, document_url)
+            self._templates_by_url.setdefault(document_url, set()).add(template_id)
+            return is_new
+
+    def remove(self, document_url: str, template_id: Optional[str] = None) -> List[str]:
+        """
+        Remove a document's records and delete them from storage.
+
+        Args:
+            document_url (str): URL identifying the document
+            template_id (str, optional): Only remove the record for this template
+
+        Returns:
+            List[str]: IDs of the templates the document was removed from
+        """
+        with self._lock:
+            template_ids = self._templates_by_url.get(document_url, set())
+            removed = [tid for tid in template_ids if template_id is None or tid == template_id]
+            template_ids.difference_update(removed)
+            if not template_ids:
+                self._templates_by_url.pop(document_url, None)
+            if removed:
+                self.storage.delete_metadata(document_url, template_id)
+            return removed
+
+    def get(self, template_id: str, document_url: str) -> Optional[Dict]:
+        """Get a document's record for a template as a dict."""
+        with self._lock:
+            table = self._partitions.get(template_id)
+            return table.get_dict(document_url) if table is not None else None
+
+    def rows(self, template_id: str) -> Tuple[RowSchema, List[Tuple[str, Tuple]]]:
+        """Get a template's schema and a snapshot of its (document_url, row) pairs in insertion order."""
+        with self._lock:
+            table = self._partitions.get(template_id)
+            if table is None:
+                return RowSchema(), []
+            return table.schema, list(table.rows.items())
+
+    def records(self, template_id: str) -> List[Dict]:
+        """Get a snapshot of a template's records as dicts, in insertion order."""
+        schema, rows = self.rows(template_id)
+        return [schema.to_dict(row) for _, row in rows]
+
+    def document_urls(self, template_id: str) -> List[str]:
+        """Get a snapshot of a template's document URLs in insertion order."""
+        with self._lock:
+            table = self._partitions.get(template_id)
+            return list(table.rows.keys()) if table is not None else []
+
+    def template_ids(self) -> List[str]:
+        """Get the IDs of all templates that have records."""
+        with self._lock:
+            return list(self._partitions.keys())
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(table) for table in self._partitions.values())
+
+
+_metadata_index = None
+_metadata_index_lock = threading.Lock()
+
+
+def get_metadata_index() -> MetadataIndex:
+    """Get the process-wide metadata index, loading it from storage on first use."""
+    global _metadata_index
+    if _metadata_index is None:
+        with _metadata_index_lock:
+            if _metadata_index is None:
+                _metadata_index = MetadataIndex(MetadataStorage())
+    return _metadata_index
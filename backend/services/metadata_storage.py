@@ -1,14 +1,34 @@
 import json
 import os
 import logging
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
+from services.append_log import AppendOnlyLog
+from services.row_schema import RowTable
 
 logger = logging.getLogger(__name__)
 
+# Version of the compact, template-partitioned storage layout
+STORAGE_VERSION = 2
+
+# Logged changes below which the change log is never folded into the storage file
+METADATA_COMPACT_MIN_CHANGES = int(os.getenv('METADATA_COMPACT_MIN_CHANGES', '1000'))
+
 class MetadataStorage:
+    """
+    Extracted metadata, held as one compact row table per template.
+
+    The storage file is a snapshot; each change made since is appended to
+    a JSON-lines change log next to it, so an upsert costs one short write
+    however many documents are stored. Loading replays the log over the
+    snapshot, and once the log holds more changes than there are rows it
+    is folded into a fresh snapshot.
+    """
+
     def __init__(self, storage_file: str = "metadata_storage.json"):
         self.storage_file = storage_file
-        self.metadata = {}
+        self.tables = {}  # {template_id: RowTable}
+        self._log = AppendOnlyLog(f"{os.path.splitext(storage_file)[0]}.changes.jsonl", "metadata change log")
+        self._clear_callbacks = []
         self._load_metadata()
 
     def _load_metadata(self) -> None:
@@ -16,29 +36,87 @@ class MetadataStorage:
         try:
             if os.path.exists(self.storage_file):
                 with open(self.storage_file, 'r') as f:
-                    self.metadata = json.load(f)
+                    data = json.load(f)
+                if isinstance(data, dict) and data.get('version') == STORAGE_VERSION:
+                    self.tables = {
+                        template_id: RowTable.from_json(table)
+                        for template_id, table in data.get('templates', {}).items()
+                    }
+                else:
+                    # Legacy layout: one dict per document URL
+                    self.tables = {}
+                    for document_url, record in data.items():
+                        self._table(record.get('Template ID', '')).upsert(document_url, record)
                 # logger.info(f"Loaded metadata from {self.storage_file}")
             else:
-                self.metadata = {}
+                self.tables = {}
                 logger.info("No existing metadata file found, starting with empty storage")
+            for change in self._log.read():
+                self._apply(change)
         except Exception as e:
             logger.error(f"Error loading metadata: {str(e)}")
-            self.metadata = {}
+            self.tables = {}
 
     def _save_metadata(self) -> None:
         """Save metadata to the storage file."""
+        temp_file = f"{self.storage_file}.tmp"
         try:
-            with open(self.storage_file, 'w') as f:
-                json.dump(self.metadata, f, indent=2)
+            data = {
+                'version': STORAGE_VERSION,
+                'templates': {template_id: table.to_json() for template_id, table in self.tables.items()}
+            }
+            with open(temp_file, 'w') as f:
+                json.dump(data, f, indent=2)
+            os.replace(temp_file, self.storage_file)
             # logger.info(f"Saved metadata to {self.storage_file}")
         except Exception as e:
             logger.error(f"Error saving metadata: {str(e)}")
 
+    def _compact_metadata(self) -> None:
+        """Fold the change log into a fresh snapshot of the storage file."""
+        # Replaying a change the snapshot already holds is harmless, so a
+        # crash between these two writes loses nothing
+        self._save_metadata()
+        self._log.rewrite([])
+
+    def _record_change(self, change: Dict) -> None:
+        """Persist one change, compacting the log once it outgrows the stored rows."""
+        if self._log.lines >= max(METADATA_COMPACT_MIN_CHANGES, sum(len(table) for table in self.tables.values())):
+            self._compact_metadata()
+        else:
+            self._log.append(change)
+
+    def _apply(self, change: Dict) -> bool:
+        """Apply a logged change to the tables; returns True if anything changed."""
+        if change.get('deleted'):
+            return self._remove(change['url'], change.get('template_id'))
+        self._table(change['metadata'].get('Template ID', '')).upsert(change['url'], change['metadata'])
+        return True
+
+    def _remove(self, document_url: str, template_id: Optional[str]) -> bool:
+        """Remove a document's rows, dropping tables left empty; returns True if any were removed."""
+        removed = False
+        for table_id, table in list(self.tables.items()):
+            if template_id is None or table_id == template_id:
+                if table.remove(document_url):
+                    removed = True
+                    if not table:
+                        del self.tables[table_id]
+        return removed
+
+    def _table(self, template_id: str) -> RowTable:
+        """Get or create the row table for a template."""
+        table = self.tables.get(template_id)
+        if table is None:
+            table = self.tables[template_id] = RowTable()
+        return table
+
     def add_metadata(self, metadata: Dict, document_url: str) -> None:
         """Add or update metadata for a document."""
         try:
-            self.metadata[document_url] = metadata
-            self._save_metadata()
+            change = {'url': document_url, 'metadata': metadata}
+            self._apply(change)
+            self._record_change(change)
             # logger.info(f"Added/updated metadata for document: {document_url}")
         except Exception as e:
             logger.error(f"Error adding metadata: {str(e)}")
@@ -46,29 +124,43 @@ class MetadataStorage:
 
     def get_metadata(self) -> List[Dict]:
         """Get all stored metadata."""
-        return [{"Document URL": url, **data} for url, data in self.metadata.items()]
+        return [
+            {"Document URL": url, **data}
+            for table in self.tables.values()
+            for url, data in table.iter_dicts()
+        ]
 
     def get_metadata_by_url(self, document_url: str) -> Optional[Dict]:
         """Get metadata for a specific document."""
-        return self.metadata.get(document_url)
+        for table in self.tables.values():
+            if document_url in table.rows:
+                return table.get_dict(document_url)
+        return None
 
-    def delete_metadata(self, document_url: str) -> None:
-        """Delete metadata for a specific document."""
+    def delete_metadata(self, document_url: str, template_id: Optional[str] = None) -> None:
+        """Delete metadata for a specific document, optionally for one template only."""
         try:
-            if document_url in self.metadata:
-                del self.metadata[document_url]
-                self._save_metadata()
+            change = {'url': document_url, 'template_id': template_id, 'deleted': True}
+            if self._apply(change):
+                self._record_change(change)
                 # logger.info(f"Deleted metadata for document: {document_url}")
         except Exception as e:
             logger.error(f"Error deleting metadata: {str(e)}")
             raise
 
+    def add_clear_callback(self, callback: Callable[[], None]) -> None:
+        """Register a callback to run after all metadata is cleared."""
+        self._clear_callbacks.append(callback)
+
     def clear_metadata(self) -> None:
         """Clear all stored metadata."""
         try:
-            self.metadata = {}
-            self._save_metadata()
+            # Clear in place; the metadata index shares these tables
+            self.tables.clear()
+            self._compact_metadata()
+            for callback in self._clear_callbacks:
+                callback()
             logger.info("Cleared all metadata")
         except Exception as e:
             logger.error(f"Error clearing metadata: {str(e)}")
-            raise 
\ No newline at end of file
+            raise
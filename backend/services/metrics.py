@@ -0,0 +1,90 @@
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+# Number of recent observations kept per timing for percentiles
+WINDOW_SIZE = 500
+
+
+class _Timing:
+    __slots__ = ('count', 'total', 'recent')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.recent = deque(maxlen=WINDOW_SIZE)
+
+
+class Metrics:
+    """
+    Thread-safe, in-process counters and timings.
+
+    Counters are running totals. Timings keep a count and sum plus a
+    window of recent observations for percentiles.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._timings = {}
+
+    def increment(self, name: str, value: float = 1) -> None:
+        """Add to a counter."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float) -> None:
+        """Record one observation of a timing or size."""
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = _Timing()
+            timing.count += 1
+            timing.total += value
+            timing.recent.append(value)
+
+    def counter(self, name: str) -> float:
+        """Get a counter's current value."""
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def percentile(self, name: str, percentile: float, min_samples: int = 1) -> Optional[float]:
+        """
+        Get a percentile of a timing's recent observations.
+
+        Args:
+            name (str): The timing name
+            percentile (float): Percentile between 0 and 100
+            min_samples (int): Return None when fewer observations are recorded
+
+        Returns:
+            Optional[float]: The percentile value, None without enough samples
+        """
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None or len(timing.recent) < max(min_samples, 1):
+                return None
+            values = sorted(timing.recent)
+        index = min(len(values) - 1, int(round(percentile / 100 * (len(values) - 1))))
+        return values[index]
+
+    def snapshot(self) -> Dict:
+        """Get all counters and timing summaries."""
+        with self._lock:
+            counters = dict(self._counters)
+            timings = {name: (timing.count, timing.total, sorted(timing.recent)) for name, timing in self._timings.items()}
+
+        summaries = {}
+        for name, (count, total, values) in timings.items():
+            summaries[name] = {
+                'count': count,
+                'mean': round(total / count, 4) if count else None,
+                'p50': values[int(0.50 * (len(values) - 1))] if values else None,
+                'p95': values[int(0.95 * (len(values) - 1))] if values else None,
+                'max': values[-1] if values else None
+            }
+        return {'counters': counters, 'timings': summaries}
+
+
+# Process-wide metrics shared by all services
+metrics = Metrics()
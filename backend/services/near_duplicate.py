@@ -0,0 +1,323 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from context.compiled_template import CompiledTemplate
+from services.append_log import AppendOnlyLog
+from services.cascade import is_unresolved
+from services.smpc_sections import field_sections, segment_sections
+
+logger = logging.getLogger(__name__)
+
+# Set to 'true' to carry fields forward from a previously extracted revision of a document
+NEAR_DUPLICATE_REUSE = os.getenv('NEAR_DUPLICATE_REUSE', 'false').lower() == 'true'
+# Lowest estimated text similarity for a stored document to count as an earlier revision
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', '0.8'))
+# Documents remembered; the oldest are dropped first
+NEAR_DUPLICATE_MAX_DOCUMENTS = int(os.getenv('NEAR_DUPLICATE_MAX_DOCUMENTS', '5000'))
+
+# MinHash signature size and its split into LSH bands. 16 bands of 8 rows
+# make documents above roughly 70% similarity likely to share a bucket.
+NUM_HASHES = 128
+LSH_BANDS = 16
+LSH_ROWS = NUM_HASHES // LSH_BANDS
+# Words per shingle
+SHINGLE_WORDS = 5
+# Diff reports kept for /revision-diffs
+MAX_REPORTS = 200
+
+_MAX_HASH = (1 << 64) - 1
+_WORD_PATTERN = re.compile(r'\w+')
+
+
+def _hash64(value: str) -> int:
+    """Stable 64-bit hash; Python's hash() changes between processes."""
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def minhash_signature(text: str) -> List[int]:
+    """
+    Compute a MinHash signature of a text's word shingles.
+
+    Uses one-permutation hashing: each shingle is hashed once and the
+    hash range is split into NUM_HASHES bins, keeping the minimum of each.
+    Empty bins borrow from the next filled bin, which keeps the signature
+    usable for LSH on short texts.
+
+    Args:
+        text (str): The document text
+
+    Returns:
+        List[int]: The signature, NUM_HASHES values
+    """
+    words = _WORD_PATTERN.findall(text.lower())
+    shingles = {' '.join(words[i:i + SHINGLE_WORDS]) for i in range(max(len(words) - SHINGLE_WORDS + 1, 1))}
+    signature = [_MAX_HASH] * NUM_HASHES
+    for shingle in shingles:
+        value = _hash64(shingle)
+        bin_index, bin_value = value % NUM_HASHES, value // NUM_HASHES
+        if bin_value < signature[bin_index]:
+            signature[bin_index] = bin_value
+
+    # Densify: an empty bin takes the value of the next filled bin, offset by the distance
+    if any(value != _MAX_HASH for value in signature):
+        filled = [value != _MAX_HASH for value in signature]
+        for index in range(NUM_HASHES):
+            if not filled[index]:
+                distance = 1
+                while not filled[(index + distance) % NUM_HASHES]:
+                    distance += 1
+                signature[index] = signature[(index + distance) % NUM_HASHES] + distance * 0x9E3779B97F4A7C15
+    return signature
+
+
+def estimate_similarity(signature: List[int], other: List[int]) -> float:
+    """Estimate the Jaccard similarity of two documents from their signatures."""
+    return sum(a == b for a, b in zip(signature, other)) / NUM_HASHES
+
+
+def text_hash(text: str) -> str:
+    """Hash a text, ignoring differences in whitespace."""
+    return hashlib.sha256(' '.join(text.split()).encode('utf-8')).hexdigest()[:16]
+
+
+def section_hashes(sections: Dict[str, str]) -> Dict[str, str]:
+    """Hash each section's text, ignoring differences in whitespace."""
+    return {section: text_hash(text) for section, text in sections.items()}
+
+
+def _band_keys(schema_hash: str, signature: List[int]) -> List[str]:
+    return [
+        f"{schema_hash}:{band}:{_hash64(','.join(map(str, signature[band * LSH_ROWS:(band + 1) * LSH_ROWS])))}"
+        for band in range(LSH_BANDS)
+    ]
+
+
+class NearDuplicateMatch:
+    """A stored document similar to the one being extracted."""
+
+    __slots__ = ('document_id', 'record', 'similarity')
+
+    def __init__(self, document_id: str, record: Dict, similarity: float):
+        self.document_id = document_id
+        self.record = record
+        self.similarity = similarity
+
+
+class NearDuplicateIndex:
+    """
+    MinHash/LSH index of extracted documents.
+
+    Each document keeps its signature, per-section hashes and extracted
+    fields, so a later revision of it can carry forward the fields of
+    unchanged sections. Each added document and diff report is appended
+    to a JSON-lines file, which is compacted once it holds more than
+    twice the records kept.
+    """
+
+    def __init__(self, storage_file: str = "near_duplicate_index.jsonl", max_documents: int = None):
+        self.storage_file = storage_file
+        self.max_documents = max_documents or NEAR_DUPLICATE_MAX_DOCUMENTS
+        self.documents = {}
+        self.reports = []
+        self._buckets = {}  # {band key: set of document IDs}, rebuilt from the signatures on load
+        self._log = AppendOnlyLog(storage_file, "near-duplicate index")
+        self._lock = threading.Lock()
+        self._load_index()
+
+    def _load_index(self) -> None:
+        """Load the index by replaying the storage file."""
+        try:
+            self.documents, self.reports = {}, []
+            for entry in self._log.read():
+                if 'report' in entry:
+                    self.reports.append(entry['report'])
+                else:
+                    self.documents.pop(entry['id'], None)
+                    self.documents[entry['id']] = entry['record']
+            self._trim()
+            for document_id, record in self.documents.items():
+                self._add_to_buckets(document_id, record)
+        except Exception as e:
+            logger.error(f"Error loading near-duplicate index: {str(e)}")
+            self.documents, self.reports, self._buckets = {}, [], {}
+
+    def _trim(self) -> None:
+        """Drop the oldest documents and reports beyond the limits."""
+        while len(self.documents) > self.max_documents:
+            oldest_id = next(iter(self.documents))
+            self._remove_from_buckets(oldest_id, self.documents.pop(oldest_id))
+        del self.reports[:-MAX_REPORTS]
+
+    def _save_entry(self, entry: Dict) -> None:
+        """Append a change to the storage file, compacting it when it has grown too long."""
+        if self._log.lines >= 2 * (self.max_documents + MAX_REPORTS):
+            self._log.rewrite(
+                [{'id': document_id, 'record': record} for document_id, record in self.documents.items()]
+                + [{'report': report} for report in self.reports]
+            )
+        else:
+            self._log.append(entry)
+
+    def _add_to_buckets(self, document_id: str, record: Dict) -> None:
+        for key in _band_keys(record['schema_hash'], record['signature']):
+            self._buckets.setdefault(key, set()).add(document_id)
+
+    def _remove_from_buckets(self, document_id: str, record: Dict) -> None:
+        for key in _band_keys(record['schema_hash'], record['signature']):
+            bucket = self._buckets.get(key)
+            if bucket:
+                bucket.discard(document_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def find(self, signature: List[int], schema_hash: str, exclude: Optional[str] = None) -> Optional[NearDuplicateMatch]:
+        """
+        Find the most similar stored document extracted with the same schema.
+
+        Args:
+            signature (List[int]): Signature of the new document
+            schema_hash (str): Schema hash of the template
+            exclude (str, optional): Document ID to ignore, such as the new document's own
+
+        Returns:
+            Optional[NearDuplicateMatch]: The best match at or above NEAR_DUPLICATE_THRESHOLD
+        """
+        with self._lock:
+            candidates = set()
+            for key in _band_keys(schema_hash, signature):
+                candidates |= self._buckets.get(key, set())
+            candidates.discard(exclude)
+
+            best = None
+            for document_id in candidates:
+                record = self.documents[document_id]
+                similarity = estimate_similarity(signature, record['signature'])
+                if similarity >= NEAR_DUPLICATE_THRESHOLD and (best is None or similarity > best.similarity):
+                    best = NearDuplicateMatch(document_id, dict(record), similarity)
+            return best
+
+    def add(self, document_id: str, schema_hash: str, signature: List[int], full_text_hash: str,
+            hashes: Dict[str, str], metadata: Dict, document_url: str, file_name: str) -> None:
+        """Store an extracted document, replacing any earlier entry with the same ID."""
+        record = {
+            'schema_hash': schema_hash,
+            'signature': signature,
+            'text_hash': full_text_hash,
+            'section_hashes': hashes,
+            'metadata': metadata,
+            'document_url': document_url,
+            'file_name': file_name,
+            'added_at': datetime.now().isoformat()
+        }
+        with self._lock:
+            previous = self.documents.pop(document_id, None)
+            if previous:
+                self._remove_from_buckets(document_id, previous)
+            self.documents[document_id] = record
+            self._add_to_buckets(document_id, record)
+            self._trim()
+            self._save_entry({'id': document_id, 'record': record})
+
+    def record_report(self, report: Dict) -> None:
+        """Keep a document's diff statistics for /revision-diffs."""
+        with self._lock:
+            self.reports.append(report)
+            self._trim()
+            self._save_entry({'report': report})
+
+    def get_reports(self, limit: int = 50) -> List[Dict]:
+        """Get the most recent diff reports, newest first."""
+        with self._lock:
+            return list(reversed(self.reports[-limit:]))
+
+
+def carry_forward_fields(compiled: CompiledTemplate, match: NearDuplicateMatch, full_text_hash: str,
+                         hashes: Dict[str, str]) -> Tuple[Dict[str, str], List[str]]:
+    """
+    Work out which stored fields still hold for a new revision.
+
+    A field is carried forward when every section it is read from is
+    unchanged and the earlier extraction found a value for it. Fields not
+    tied to sections are re-extracted, unless the whole text is unchanged.
+
+    Args:
+        compiled (CompiledTemplate): The template being extracted
+        match (NearDuplicateMatch): The earlier revision
+        full_text_hash (str): Text hash of the new revision
+        hashes (Dict[str, str]): Section hashes of the new revision
+
+    Returns:
+        Tuple[Dict[str, str], List[str]]: The carried values by field, and the changed sections
+    """
+    previous = match.record['section_hashes']
+    changed = [section for section in dict.fromkeys(list(hashes) + list(previous)) if hashes.get(section) != previous.get(section)]
+    stored = match.record['metadata']
+
+    if match.record.get('text_hash') == full_text_hash:
+        return {name: stored[name] for name in compiled.field_names if not is_unresolved(stored.get(name))}, changed
+
+    carried = {}
+    for name, sections in field_sections(compiled, use_defaults=True).items():
+        value = stored.get(name)
+        if is_unresolved(value):
+            continue
+        if all(section in hashes and section not in changed for section in sections):
+            carried[name] = value
+    return carried, changed
+
+
+_near_duplicate_index = None
+_near_duplicate_index_lock = threading.Lock()
+
+
+def get_near_duplicate_index() -> NearDuplicateIndex:
+    """Get the process-wide near-duplicate index."""
+    global _near_duplicate_index
+    if _near_duplicate_index is None:
+        with _near_duplicate_index_lock:
+            if _near_duplicate_index is None:
+                _near_duplicate_index = NearDuplicateIndex()
+    return _near_duplicate_index
+
+
+class RevisionCheck:
+    """A document's fingerprints and, when it revises a stored document, what can be carried forward."""
+
+    __slots__ = ('signature', 'full_text_hash', 'section_hashes', 'match', 'carried', 'changed_sections')
+
+    def __init__(self, signature: List[int], full_text_hash: str, hashes: Dict[str, str]):
+        self.signature = signature
+        self.full_text_hash = full_text_hash
+        self.section_hashes = hashes
+        self.match: Optional[NearDuplicateMatch] = None
+        self.carried: Dict[str, str] = {}
+        self.changed_sections: List[str] = []
+
+
+def check_revision(index: NearDuplicateIndex, compiled: CompiledTemplate, pages: List[str],
+                   document_id: Optional[str] = None) -> RevisionCheck:
+    """
+    Fingerprint a document and look for an earlier revision of it.
+
+    Args:
+        index (NearDuplicateIndex): The index of extracted documents
+        compiled (CompiledTemplate): The template being extracted
+        pages (List[str]): Text of each page
+        document_id (str, optional): The document's own ID, never matched against itself
+
+    Returns:
+        RevisionCheck: The fingerprints, plus the match and carried fields if one was found
+    """
+    text = "".join(page + "\n" for page in pages)
+    check = RevisionCheck(minhash_signature(text), text_hash(text), section_hashes(segment_sections(text)))
+    check.match = index.find(check.signature, compiled.schema_hash, exclude=document_id)
+    if check.match:
+        check.carried, check.changed_sections = carry_forward_fields(
+            compiled, check.match, check.full_text_hash, check.section_hashes
+        )
+    return check
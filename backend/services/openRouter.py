@@ -5,6 +5,14 @@ import logging
 import time
 import json
 import re
+import uuid
+import threading
+from concurrent.futures import Future, TimeoutError
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+from services.cancellation import CancellationToken, OperationCancelled, closing_on_cancel
+from services.incremental_json import IncrementalJsonParser
+from services.metrics import metrics
+from services.prompt_builder import PromptParts
 
 load_dotenv()
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
@@ -12,7 +20,228 @@ OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def chat_with_openrouter(prompt: str, model_id: str,input_filename: str, file_size=None, page_count=None) -> str:
+# Providers that only cache a prompt prefix marked with an explicit cache_control breakpoint;
+# the others served through OpenRouter cache repeated prefixes automatically
+CACHE_CONTROL_MODEL_PREFIXES = ('anthropic/', 'google/gemini')
+
+# Set to 'true' to stream completions and parse their fields as they arrive
+LLM_STREAMING = os.getenv('LLM_STREAMING', 'false').lower() == 'true'
+
+# Characters per token, for estimating the usage of a stream closed before its usage was sent
+CHARS_PER_TOKEN = 4
+
+OPENROUTER_CHAT_URL = "https://openrouter.ai/api/v1/chat/completions"
+# Seconds to wait for a connection to OpenRouter, and for each read of its reply
+# (a non-streamed reply sends nothing until the whole generation is done)
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', '10'))
+LLM_READ_TIMEOUT = float(os.getenv('LLM_READ_TIMEOUT', '180'))
+
+# Seconds between a waiting request's checks of its cancellation token
+CANCEL_POLL_INTERVAL = 0.5
+
+
+class CompletionResult:
+    """The assistant's reply to a chat completion along with its usage."""
+
+    __slots__ = ('content', 'model_id', 'usage', 'generation_time')
+
+    def __init__(self, content: str, model_id: str, usage: Optional[Dict], generation_time: float):
+        self.content = content
+        self.model_id = model_id
+        self.usage = usage or {}
+        self.generation_time = generation_time
+
+    @property
+    def prompt_tokens(self) -> int:
+        return self.usage.get('prompt_tokens') or 0
+
+    @property
+    def completion_tokens(self) -> int:
+        return self.usage.get('completion_tokens') or 0
+
+    @property
+    def cached_tokens(self) -> int:
+        return (self.usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+
+
+def _build_messages(prompt: Union[str, PromptParts], model_id: str) -> List[Dict]:
+    """Build the chat messages, marking the static prompt prefix as cacheable where needed."""
+    if isinstance(prompt, PromptParts) and model_id.startswith(CACHE_CONTROL_MODEL_PREFIXES):
+        return [{
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt.prefix, "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": prompt.suffix}
+            ]
+        }]
+    return [{"role": "user", "content": str(prompt)}]
+
+
+def _record_usage(result: CompletionResult) -> None:
+    """Add a completion's token usage and latency to the process metrics."""
+    prefix = f"llm.{result.model_id}"
+    metrics.increment(f"{prefix}.requests")
+    metrics.increment(f"{prefix}.prompt_tokens", result.prompt_tokens)
+    metrics.increment(f"{prefix}.cached_tokens", result.cached_tokens)
+    metrics.increment(f"{prefix}.completion_tokens", result.completion_tokens)
+    metrics.observe(f"{prefix}.generation_time", result.generation_time)
+
+
+def _post(headers: Dict, data: Dict, stream: bool, cancel_token: Optional[CancellationToken]) -> requests.Response:
+    """
+    Send a chat completion request, with connect and read timeouts.
+
+    With a cancel token the request is sent from a helper thread and the
+    caller waits on the token as well, so a cancellation releases it even
+    while OpenRouter is still generating a non-streamed reply. A response
+    arriving after the cancellation is closed.
+
+    Raises:
+        OperationCancelled: If cancel_token is cancelled before the response headers arrive
+    """
+    def send() -> requests.Response:
+        return requests.post(
+            OPENROUTER_CHAT_URL, headers=headers, json=data, stream=stream,
+            timeout=(LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT)
+        )
+
+    if cancel_token is None:
+        return send()
+    cancel_token.raise_if_cancelled()
+
+    future = Future()
+    def run() -> None:
+        try:
+            future.set_result(send())
+        except BaseException as e:
+            future.set_exception(e)
+    threading.Thread(target=run, name="openrouter-request", daemon=True).start()
+
+    def close_late_response(done: Future) -> None:
+        if done.exception() is None:
+            done.result().close()
+
+    while True:
+        if cancel_token.is_cancelled:
+            future.add_done_callback(close_late_response)
+            raise OperationCancelled("Operation was cancelled")
+        try:
+            return future.result(timeout=CANCEL_POLL_INTERVAL)
+        except TimeoutError:
+            continue
+
+
+def _read_body(response: requests.Response, cancel_token: Optional[CancellationToken]) -> str:
+    """Read a streamed response body, stopping early if the token is cancelled."""
+    if cancel_token is None:
+        return response.text
+    try:
+        with closing_on_cancel(response, cancel_token):
+            chunks = []
+            for chunk in response.iter_content(chunk_size=16384):
+                cancel_token.raise_if_cancelled()
+                chunks.append(chunk)
+        return b"".join(chunks).decode(response.encoding or "utf-8")
+    finally:
+        response.close()
+
+
+def _read_stream(response: requests.Response, prompt: Union[str, PromptParts], model_id: str, start_time: float,
+                 cancel_token: Optional[CancellationToken], expected_fields: Optional[Iterable[str]],
+                 on_field: Optional[Callable[[str, Any], None]]) -> Tuple[str, Optional[Dict]]:
+    """
+    Read a streamed completion, parsing its JSON fields as they arrive.
+
+    Once every expected field has arrived and the model starts another,
+    the stream is closed, which stops the generation of anything the model
+    would add after them. Its usage is then estimated from the prompt and
+    reply lengths, since OpenRouter only sends usage at the end of a
+    stream. Otherwise the stream is read to its end, for its usage, and
+    the reply is returned as sent.
+
+    Returns:
+        Tuple[str, Optional[Dict]]: The assistant content and the token usage
+    """
+    parser = IncrementalJsonParser()
+    wanted = set(expected_fields or ())
+    content, usage, stopped_early, first_field_time = [], None, False, None
+    try:
+        with closing_on_cancel(response, cancel_token):
+            for line in response.iter_lines(decode_unicode=True):
+                if cancel_token:
+                    cancel_token.raise_if_cancelled()
+                # Skip keep-alive comments such as ": OPENROUTER PROCESSING"
+                if not line or not line.startswith('data:'):
+                    continue
+                payload = line[len('data:'):].strip()
+                if payload == '[DONE]':
+                    break
+                event = json.loads(payload)
+                if event.get('error'):
+                    raise ValueError(f"OpenRouter stream error: {event['error']}")
+                if event.get('usage'):
+                    usage = event['usage']
+                for choice in event.get('choices') or []:
+                    delta = (choice.get('delta') or {}).get('content')
+                    if not delta:
+                        continue
+                    content.append(delta)
+                    for key, value in parser.feed(delta):
+                        if first_field_time is None:
+                            first_field_time = time.time() - start_time
+                            metrics.observe(f"llm.{model_id}.time_to_first_field", first_field_time)
+                        if on_field:
+                            on_field(key, value)
+                if wanted and parser.in_field and wanted <= parser.fields.keys():
+                    stopped_early = True
+                    break
+    finally:
+        response.close()
+
+    content = "".join(content)
+    if stopped_early:
+        metrics.increment(f"llm.{model_id}.stream_early_stops")
+        # The reply was cut off after its last field, so it is rebuilt as a complete object
+        content = json.dumps(parser.fields, ensure_ascii=False)
+        if usage is None:
+            usage = {
+                'prompt_tokens': len(str(prompt)) // CHARS_PER_TOKEN,
+                'completion_tokens': len(content) // CHARS_PER_TOKEN,
+                'estimated': True
+            }
+    return content, usage
+
+
+def request_completion(prompt: Union[str, PromptParts], model_id: str, input_filename: str,
+                       file_size=None, page_count=None, response_format: Optional[Dict] = None,
+                       cancel_token: Optional[CancellationToken] = None, stream: Optional[bool] = None,
+                       expected_fields: Optional[Iterable[str]] = None,
+                       on_field: Optional[Callable[[str, Any], None]] = None,
+                       dump_label: Optional[str] = None) -> CompletionResult:
+    """
+    Send a prompt to OpenRouter and return the reply with its usage.
+
+    Args:
+        prompt (Union[str, PromptParts]): The prompt, split into prefix and
+            document suffix when it should be prefix-cached
+        model_id (str): OpenRouter model ID
+        input_filename (str): Name of the document, used for logging and the response dump
+        file_size (str, optional): Human-readable document size for logging
+        page_count (int, optional): Document page count for logging
+        response_format (Dict, optional): Structured output format to request
+        cancel_token (CancellationToken, optional): Abandons the request when cancelled
+        stream (bool, optional): Stream the reply; defaults to LLM_STREAMING
+        expected_fields (Iterable[str], optional): When streaming, close the stream once these fields arrive
+        on_field (Callable[[str, Any], None], optional): When streaming, called with each field as it arrives
+        dump_label (str, optional): Added to the response dump's file name, so the
+            several requests made for one document keep separate dumps
+
+    Returns:
+        CompletionResult: The assistant content, token usage and generation time
+        
+    Raises:
+        OperationCancelled: If cancel_token is cancelled before the reply is read
+    """
     logging.info(f"Model ID: {model_id}")
 
     headers = {
@@ -24,48 +253,70 @@ def chat_with_openrouter(prompt: str, model_id: str,input_filename: str, file_si
 
     data = {
         "model": model_id,
-        "messages": [
-            {"role": "user", "content": prompt}
-        ],
-        "reasoning": { "enabled": False }
+        "messages": _build_messages(prompt, model_id),
+        "reasoning": { "enabled": False },
+        # Ask for full usage accounting, including cached prompt tokens
+        "usage": { "include": True }
     }
+    if response_format:
+        data["response_format"] = response_format
+    stream = LLM_STREAMING if stream is None else stream
+    if stream:
+        data["stream"] = True
 
     start_time = time.time()
 
-    response = requests.post(
-        "https://openrouter.ai/api/v1/chat/completions",
-        headers=headers,
-        json=data
-    )
-    # logger.info(f"OpenRouter raw text : {response.text}")
-    
+    response = _post(headers, data, stream or cancel_token is not None, cancel_token)
+    if stream:
+        response.raise_for_status()
+        content, usage = _read_stream(response, prompt, model_id, start_time, cancel_token, expected_fields, on_field)
+        # Dumped in the shape of a non-streamed reply
+        response_text = json.dumps({"choices": [{"message": {"role": "assistant", "content": content}}], "usage": usage})
+    else:
+        response_text = _read_body(response, cancel_token)
+    # logger.info(f"OpenRouter raw text : {response_text}")
+
     # Create directory based on model_id
     model_dir = os.path.join(os.path.dirname(__file__), model_id)
     os.makedirs(model_dir, exist_ok=True)
 
-    file_path = os.path.join(model_dir, f"{input_filename}.json")
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write(response.text)
+    file_path = os.path.join(model_dir, f"{input_filename}.{dump_label}.json" if dump_label else f"{input_filename}.json")
+    # Written whole and moved into place, so concurrent requests never interleave their dumps
+    temp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(response_text)
+    os.replace(temp_path, file_path)
 
-    # Use JSON-parsed response
-    resp_json = response.json()
-    usage = resp_json.get("usage")
+    if not stream:
+        # Use JSON-parsed response
+        resp_json = json.loads(response_text)
+        usage = resp_json.get("usage")
+        content = resp_json.get("choices", [])[0].get("message", {}).get("content", "")
 
-   
     generation_time = round(time.time() - start_time, 2)
+    result = CompletionResult(content, model_id, usage, generation_time)
+    _record_usage(result)
+
     log_dict = {
         "filename": input_filename,
         "model_id": model_id,
         "file_size": file_size,
         "page_count": page_count,
         "usage": usage,
+        "cached_tokens": result.cached_tokens,
         "generation_time": generation_time
     }
     logging.info(f"OpenRouter generation info: {log_dict}")
 
-    # logging.debug(f"Returning assistant content: {response.json().get('choices', [])[0].get('message', {}).get('content', '')}")
+    return result
+
 
-    return response.json().get("choices", [])[0].get("message", {}).get("content", "")
+def chat_with_openrouter(prompt: Union[str, PromptParts], model_id: str, input_filename: str,
+                         file_size=None, page_count=None, stream: Optional[bool] = None) -> str:
+    """Send a prompt to OpenRouter and return the assistant's reply text."""
+    return request_completion(
+        prompt, model_id, input_filename, file_size=file_size, page_count=page_count, stream=stream
+    ).content
 
 
 
@@ -86,4 +337,4 @@ def chat_with_openrouter(prompt: str, model_id: str,input_filename: str, file_si
     #     filename = inner_data.get("filename", "unknown")
     # except json.JSONDecodeError:
     #     match = re.search(r'"filename"\s*:\s*"([^"]+)"', assistant_content)
-    #     filename = match.group(1) if match else "unknown"
\ No newline at end of file
+    #     filename = match.group(1) if match else "unknown"
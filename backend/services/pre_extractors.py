@@ -0,0 +1,169 @@
+import os
+import re
+import logging
+from typing import Callable, Dict, List, Optional
+
+from context.compiled_template import CompiledTemplate
+
+logger = logging.getLogger(__name__)
+
+# Set to 'false' to send every field to the LLM
+PRE_EXTRACT_ENABLED = os.getenv('PRE_EXTRACT', 'true').lower() == 'true'
+# Local values below this confidence are left for the LLM
+PRE_EXTRACT_MIN_CONFIDENCE = float(os.getenv('PRE_EXTRACT_MIN_CONFIDENCE', '0.9'))
+
+
+class Extraction:
+    """A field value found without the LLM, with how sure the extractor is of it."""
+
+    __slots__ = ('value', 'confidence')
+
+    def __init__(self, value: str, confidence: float):
+        self.value = value
+        self.confidence = confidence
+
+
+# An extractor gets the document text, the field it is bound to and the file name
+Extractor = Callable[[str, str, str], Optional[Extraction]]
+
+_extractors: Dict[str, Extractor] = {}
+
+# Extractors used for fields of these names when the template binds none
+DEFAULT_FIELD_EXTRACTORS = {
+    'ATC Code': 'atc_code',
+    'Marketing Authorisation Number': 'eu_ma_number',
+    'Date of First Authorisation': 'labelled_date',
+    'Date of Latest Renewal': 'labelled_date',
+}
+
+
+def register_extractor(name: str):
+    """
+    Register a function as a pre-extractor under a name that template
+    fields can bind to with their 'extractor' entry.
+    """
+    def decorator(extractor: Extractor) -> Extractor:
+        _extractors[name] = extractor
+        return extractor
+    return decorator
+
+
+def get_extractor(name: str) -> Optional[Extractor]:
+    """Get a registered pre-extractor by name."""
+    return _extractors.get(name)
+
+
+def _distinct(values: List[str]) -> List[str]:
+    return list(dict.fromkeys(values))
+
+
+@register_extractor('filename')
+def extract_filename(text: str, field_name: str, file_name: str) -> Optional[Extraction]:
+    """The document's file name, which is always known."""
+    return Extraction(file_name, 1.0) if file_name else None
+
+
+_ATC_CODE = re.compile(r'\b[A-Z]\d{2}[A-Z]{2}\d{2}\b')
+_ATC_LABEL = re.compile(r'(?i:ATC\s*code)\s*:?\s*([A-Z]\d{2}[A-Z]{2}\d{2}(?:\s*(?:,|;|/|and)\s*[A-Z]\d{2}[A-Z]{2}\d{2})*)')
+
+
+@register_extractor('atc_code')
+def extract_atc_code(text: str, field_name: str, file_name: str) -> Optional[Extraction]:
+    """ATC codes, trusted when they follow an 'ATC code' label."""
+    labelled = _distinct([code for match in _ATC_LABEL.finditer(text) for code in _ATC_CODE.findall(match.group(1))])
+    if labelled:
+        return Extraction("; ".join(labelled), 0.95)
+    codes = _distinct(_ATC_CODE.findall(text))
+    if len(codes) == 1:
+        # An unlabelled code-shaped token could be anything, e.g. a batch number
+        return Extraction(codes[0], 0.6)
+    return None
+
+
+_EU_MA_NUMBER = re.compile(r'\bEU/\d/\d{2}/\d{3,4}/\d{3}\b')
+
+
+@register_extractor('eu_ma_number')
+def extract_eu_ma_number(text: str, field_name: str, file_name: str) -> Optional[Extraction]:
+    """EU marketing authorisation numbers (EU/1/10/123/001), all of them in order."""
+    numbers = _distinct(_EU_MA_NUMBER.findall(text))
+    if numbers:
+        return Extraction("; ".join(numbers), 0.95)
+    return None
+
+
+_MONTHS = r'(?:January|February|March|April|May|June|July|August|September|October|November|December)'
+_DATE = re.compile(
+    r'\d{1,2}\s+' + _MONTHS + r'\s+\d{4}'   # 12 March 2010
+    r'|\d{1,2}[./-]\d{1,2}[./-]\d{4}'        # 12/03/2010
+    r'|\d{4}-\d{2}-\d{2}'                    # 2010-03-12
+    r'|' + _MONTHS + r'\s+\d{4}',            # March 2010
+    re.IGNORECASE
+)
+
+
+@register_extractor('labelled_date')
+def extract_labelled_date(text: str, field_name: str, file_name: str) -> Optional[Extraction]:
+    """
+    The date written right after the field's own name, as in
+    'Date of first authorisation: 12 March 2010'.
+    """
+    label = re.escape(field_name).replace(r'\ ', r'\s+')
+    match = re.search(label + r'\s*[:\-]?\s*(' + _DATE.pattern + r')', text, re.IGNORECASE)
+    if match:
+        return Extraction(' '.join(match.group(1).split()), 0.95)
+    return None
+
+
+def field_extractors(compiled: CompiledTemplate) -> Dict[str, str]:
+    """Get the extractor bound to each field: the template's own binding, else the default for its name."""
+    bindings = {name: DEFAULT_FIELD_EXTRACTORS[name] for name in compiled.field_names if name in DEFAULT_FIELD_EXTRACTORS}
+    bindings.update(dict(compiled.field_extractors))
+    return bindings
+
+
+def pre_extract(compiled: CompiledTemplate, text: str, file_name: str,
+                min_confidence: Optional[float] = None) -> Dict[str, str]:
+    """
+    Fill the fields that bound extractors can answer with enough confidence.
+
+    Args:
+        compiled (CompiledTemplate): The template being extracted
+        text (str): The document text
+        file_name (str): Name of the document
+        min_confidence (float, optional): Lowest confidence to accept; defaults to PRE_EXTRACT_MIN_CONFIDENCE
+
+    Returns:
+        Dict[str, str]: Values by field name for the fields filled locally
+    """
+    if not PRE_EXTRACT_ENABLED:
+        return {}
+    min_confidence = PRE_EXTRACT_MIN_CONFIDENCE if min_confidence is None else min_confidence
+
+    filled = {}
+    for name, extractor_name in field_extractors(compiled).items():
+        extractor = _extractors.get(extractor_name)
+        if extractor is None:
+            logger.warning(f"Unknown extractor '{extractor_name}' for field '{name}'")
+            continue
+        try:
+            extraction = extractor(text, name, file_name)
+        except Exception as e:
+            logger.error(f"Extractor '{extractor_name}' failed for field '{name}': {str(e)}")
+            continue
+        if extraction and extraction.value and extraction.confidence >= min_confidence:
+            filled[name] = extraction.value
+    return filled
+
+
+# Shape an answer must have for fields bound to these extractors, whoever produced it
+VALUE_PATTERNS = {
+    'atc_code': _ATC_CODE,
+    'labelled_date': _DATE,
+}
+
+
+def is_plausible_value(extractor_name: str, value: str) -> bool:
+    """Check an answer against the value shape of the field's extractor, if it has one."""
+    pattern = VALUE_PATTERNS.get(extractor_name)
+    return pattern is None or bool(pattern.search(str(value)))
@@ -0,0 +1,246 @@
+import os
+import logging
+import threading
+from typing import Optional
+
+from context.compiled_template import CompiledTemplate, render_field_description, render_field_search_instructions
+
+logger = logging.getLogger(__name__)
+
+# Pseudo-field carrying the document's file name, extracted alongside the template fields
+FILENAME_FIELD = 'filename'
+FILENAME_DESCRIPTION = 'Known file name, given with the document below'
+FILENAME_SEARCH_INSTRUCTIONS = render_field_search_instructions(FILENAME_FIELD)
+
+# Prompt styles: 'verbose' repeats search guidance per field, 'compact' states shared rules once
+PROMPT_MODES = ('verbose', 'compact')
+PROMPT_MODE = os.getenv('PROMPT_MODE', 'verbose')
+
+# Instructions ahead of the field list; formatted with field_search_instructions
+EXTRACTION_INSTRUCTIONS = """You are a metadata extractor. Your task is to thoroughly analyze the given text and extract ALL relevant information for each specified field.
+
+IMPORTANT: You must extract ALL information that is present in the text. Do not mark fields as "Not found" unless you have thoroughly searched the entire document and are absolutely certain the information is not present.
+
+FIELD-SPECIFIC SEARCH INSTRUCTIONS:
+{field_search_instructions}
+
+For each field, you must:
+1. Search the ENTIRE text carefully, including:
+   - Headers and footers
+   - Tables and lists
+   - Formatted sections
+   - Unstructured text
+   - Any location in the document
+2. Look for variations of field names and related terms
+3. Consider context and surrounding information
+4. Extract the most specific and complete value found
+5. If you find partial information, include it rather than marking as "Not found"
+6. For dates, look for any date format
+7. For names and organizations, look for full names, abbreviations, and variations
+8. For IDs and numbers, look for any numeric identifiers or codes
+9. If a field has multiple values, include all relevant values separated by semicolons
+10. Look for information in tables, lists, and formatted sections
+11. Consider information that might be spread across multiple locations
+12. Look for information in both structured and unstructured parts
+13. Check for information in bullet points and lists
+14. Look for information in parentheses or brackets
+15. Check for information after colons or semicolons
+16. Look for information in headers and subheaders
+17. Check for information in footnotes or references
+18. Look for information in appendices or supplementary sections
+19. Check for information in any part of the document
+20. Consider variations in how information might be presented
+21. Extract partial information when available
+22. Look for related terms and synonyms
+23. Consider context and surrounding information
+24. For dates, extract any date format you find
+25. For names and organizations, include all variations you find
+26. For IDs and numbers, capture all numeric identifiers
+27. If you find multiple values, include them all
+28. Only use "Not found" if you are absolutely certain the information is not present after thorough searching
+
+"""
+
+# Output format and final instructions, which follow the field list
+OUTPUT_INSTRUCTIONS = """Return the results in JSON format with the field names as keys and the extracted values as values.
+Example format:
+{{
+  "filename": "exact and extract filename from given text  ( example:product-information_en.pdf)",
+  "Study Title": "Exact title from text",
+  "Study Phase": "Phase value from text",
+  "Study Type": "Type value from text",
+  "Study Status": "Status value from text",
+  "Start Date": "Date value from text",
+  "Completion Date": "Date value from text",
+  "Sponsor": "Sponsor name from text",
+  "Principal Investigator": "Investigator name from text"
+}}
+
+CRITICAL INSTRUCTIONS:
+1. You MUST extract ALL information that is present in the text
+2. Do not mark fields as "Not found" unless you have thoroughly searched the entire document
+3. For each field:
+   - Look for exact matches
+   - Look for variations and related terms
+   - Check nearby paragraphs and sections
+   - Extract ALL relevant information
+4. Consider variations in how information might be presented
+5. Extract partial information when available
+6. Look for related terms and synonyms
+7. Consider context and surrounding information
+8. For dates, extract any date format you find
+9. For names and organizations, include all variations you find
+10. For IDs and numbers, capture all numeric identifiers
+11. If you find multiple values, include them all
+12. Only use "Not found" if you are absolutely certain the information is not present after thorough searching
+13. For fields like "Pregnancy/Lactation":
+    - Look for information about pregnancy
+    - Look for information about lactation
+    - Look for information about both
+    - Check sections about patient eligibility
+    - Check sections about study population
+    - Extract ALL relevant information found
+14. For all fields:
+    - Look in ALL parts of the document
+    - Consider variations in wording
+    - Extract partial information
+    - Include all relevant details
+    - Only use "Not found" if absolutely certain
+15. Additional search strategies:
+    - Look for information in bullet points and lists
+    - Check for information in parentheses or brackets
+    - Look for information after colons or semicolons
+    - Check for information in tables and formatted sections
+    - Look for information in headers and subheaders
+    - Check for information in footnotes or references
+    - Look for information in appendices or supplementary sections
+    - Check for information in any part of the document
+16. When searching for information:
+    - Read the entire document carefully
+    - Look for information in any format
+    - Consider all possible locations
+    - Extract all relevant details
+    - Include partial information
+    - Never assume information is not present
+    - Always double-check before marking as "Not found"
+17. If you find any information that might be related to a field, include it
+18. Look for information in any format or structure
+19. Consider all possible ways the information might be presented
+20. Extract any information that might be relevant
+21. Include all variations and forms of the information
+22. Look for information in any part of the document
+23. Consider all possible locations and formats
+24. Extract all relevant details and variations
+25. Include partial information when available
+26. Never assume information is not present
+27. Always double-check before marking as "Not found"
+28. Look for information in any way it might be presented
+29. Consider all possible variations and forms
+30. Extract all relevant information found
+31. Include filename  and extract filename from given text
+"""
+
+# Compact prompt: the shared rules of the verbose prompt, stated once
+COMPACT_INSTRUCTIONS = """You are a metadata extractor. Extract every field listed below from the document that follows.
+
+Rules:
+- Search the whole document: body text, tables, lists, headers, footers, footnotes, brackets and appendices.
+- Match field names, their variations, abbreviations and synonyms; information may be spread over several places.
+- Give the most specific and complete value found. Prefer partial information over "Not found".
+- Separate multiple values with semicolons. Keep dates, names, organisations and identifiers as written, including all variations.
+- Use "Not found" only if the information is absent from the entire document.
+
+Fields (name: what to extract):
+"""
+
+COMPACT_OUTPUT_INSTRUCTIONS = """
+Return only a JSON object with exactly the field names above as keys and the extracted values as strings.
+"""
+
+
+class PromptParts:
+    """
+    A prompt split into a static prefix and a per-document suffix.
+
+    The prefix holds everything determined by the template alone, so every
+    document extracted with the same template sends a byte-identical
+    prefix that providers can serve from their prompt cache. The document
+    comes last, in the suffix.
+    """
+
+    __slots__ = ('prefix', 'suffix')
+
+    def __init__(self, prefix: str, suffix: str):
+        self.prefix = prefix
+        self.suffix = suffix
+
+    def __str__(self) -> str:
+        return self.prefix + self.suffix
+
+
+# Prompts are built for per-document field subsets too, so the cache is bounded
+PREFIX_CACHE_SIZE = 1024
+_prefix_cache = {}  # {(template_id, schema_hash, mode): prefix}
+_prefix_cache_lock = threading.Lock()
+
+
+def _resolve_mode(mode: Optional[str]) -> str:
+    mode = mode or PROMPT_MODE
+    if mode not in PROMPT_MODES:
+        raise ValueError(f"Unknown prompt mode '{mode}', expected one of {PROMPT_MODES}")
+    return mode
+
+
+def build_prefix(compiled: CompiledTemplate, mode: Optional[str] = None) -> str:
+    """
+    Build the static, template-specific part of the extraction prompt.
+
+    Args:
+        compiled (CompiledTemplate): The template to extract fields for
+        mode (str, optional): 'verbose' or 'compact'; defaults to PROMPT_MODE
+
+    Returns:
+        str: The prompt prefix, cached per template version and mode
+    """
+    mode = _resolve_mode(mode)
+    key = (compiled.template_id, compiled.schema_hash, mode)
+    prefix = _prefix_cache.get(key)
+    if prefix is not None:
+        return prefix
+
+    field_descriptions = render_field_description(FILENAME_FIELD, FILENAME_DESCRIPTION) + "\n" + compiled.field_descriptions
+    if mode == 'compact':
+        prefix = COMPACT_INSTRUCTIONS + field_descriptions + "\n" + COMPACT_OUTPUT_INSTRUCTIONS
+    else:
+        field_search_instructions = FILENAME_SEARCH_INSTRUCTIONS + "\n" + compiled.search_instructions
+        prefix = (
+            EXTRACTION_INSTRUCTIONS.format(field_search_instructions=field_search_instructions) +
+            f"Fields to extract:\n{field_descriptions}\n\n" +
+            OUTPUT_INSTRUCTIONS.format()
+        )
+    with _prefix_cache_lock:
+        if len(_prefix_cache) >= PREFIX_CACHE_SIZE:
+            _prefix_cache.clear()
+        _prefix_cache[key] = prefix
+    return prefix
+
+
+def build_suffix(text: str, file_name: str) -> str:
+    """Build the per-document part of the extraction prompt."""
+    return f"\nKnown file name: {file_name}\n\nText to analyze:\n{text}\n"
+
+
+def build_prompt(compiled: CompiledTemplate, text: str, file_name: str, mode: Optional[str] = None) -> PromptParts:
+    """
+    Build an extraction prompt with all static content ahead of the document.
+
+    Args:
+        compiled (CompiledTemplate): The template to extract fields for
+        text (str): The document text to analyze
+        file_name (str): Name of the document
+        mode (str, optional): 'verbose' or 'compact'; defaults to PROMPT_MODE
+
+    Returns:
+        PromptParts: The cacheable prefix and the document suffix
+    """
+    return PromptParts(build_prefix(compiled, mode), build_suffix(text, file_name))
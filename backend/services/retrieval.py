@@ -0,0 +1,195 @@
+import os
+import math
+import re
+import logging
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from context.compiled_template import CompiledTemplate
+
+logger = logging.getLogger(__name__)
+
+# How the document is given to the LLM: 'full' sends all text, 'bm25' only the passages relevant to the fields
+RETRIEVAL_MODES = ('full', 'bm25')
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'full')
+# Passages kept per field query
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '3'))
+# Approximate passage size in words, and how much consecutive passages overlap
+RETRIEVAL_CHUNK_WORDS = int(os.getenv('RETRIEVAL_CHUNK_WORDS', '200'))
+RETRIEVAL_OVERLAP_WORDS = 40
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_PATTERN = re.compile(r'\w+')
+_STOPWORDS = frozenset(
+    'a an and are as at be by for from has have in is it its of on or that the this to was were which with '
+    'any all if not no should be found document text value values field e g eg etc'.split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase terms, dropping stopwords."""
+    return [token for token in _TOKEN_PATTERN.findall(text.lower()) if token not in _STOPWORDS]
+
+
+class Passage:
+    """A run of consecutive lines on one page."""
+
+    __slots__ = ('page', 'start', 'end', 'text')
+
+    def __init__(self, page: int, start: int, end: int, text: str):
+        self.page = page    # 0-based page index
+        self.start = start  # First line index on the page
+        self.end = end      # One past the last line index
+        self.text = text
+
+
+def chunk_pages(pages: List[str], chunk_words: int = None, overlap_words: int = None) -> List[Passage]:
+    """
+    Split page texts into passages of roughly chunk_words words, keeping
+    whole lines so tables and lists stay readable.
+
+    Args:
+        pages (List[str]): Text of each page
+        chunk_words (int, optional): Target passage size in words
+        overlap_words (int, optional): Words repeated from the end of the previous passage
+
+    Returns:
+        List[Passage]: Passages in document order
+    """
+    chunk_words = chunk_words or RETRIEVAL_CHUNK_WORDS
+    overlap_words = RETRIEVAL_OVERLAP_WORDS if overlap_words is None else overlap_words
+
+    passages = []
+    for page_index, page_text in enumerate(pages):
+        lines = page_text.split('\n')
+        word_counts = [len(line.split()) for line in lines]
+        start = 0
+        while start < len(lines):
+            end, words = start, 0
+            while end < len(lines) and (words < chunk_words or end == start):
+                words += word_counts[end]
+                end += 1
+            text = '\n'.join(lines[start:end]).strip()
+            if text:
+                passages.append(Passage(page_index, start, end, text))
+            if end >= len(lines):
+                break
+            # Step back over the last lines so facts on a boundary appear whole in one passage
+            next_start, overlap = end, 0
+            while next_start - 1 > start and overlap < overlap_words:
+                next_start -= 1
+                overlap += word_counts[next_start]
+            start = next_start
+    return passages
+
+
+class BM25Index:
+    """In-memory Okapi BM25 index over the passages of one document."""
+
+    def __init__(self, passages: List[Passage], k1: float = BM25_K1, b: float = BM25_B):
+        self.passages = passages
+        self.k1 = k1
+        self.b = b
+        self._term_counts = [Counter(tokenize(passage.text)) for passage in passages]
+        self._lengths = [sum(counts.values()) for counts in self._term_counts]
+        self._average_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+
+        document_frequency = Counter()
+        for counts in self._term_counts:
+            document_frequency.update(counts.keys())
+        total = len(passages)
+        self._idf = {
+            term: math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequency.items()
+        }
+
+    def scores(self, query: str) -> List[float]:
+        """Score every passage against a query."""
+        terms = [term for term in set(tokenize(query)) if term in self._idf]
+        scores = [0.0] * len(self.passages)
+        if not terms or not self._average_length:
+            return scores
+        for index, counts in enumerate(self._term_counts):
+            norm = self.k1 * (1 - self.b + self.b * self._lengths[index] / self._average_length)
+            score = 0.0
+            for term in terms:
+                frequency = counts.get(term)
+                if frequency:
+                    score += self._idf[term] * frequency * (self.k1 + 1) / (frequency + norm)
+            scores[index] = score
+        return scores
+
+    def top_k(self, query: str, k: int) -> List[int]:
+        """Get the indexes of the k best passages for a query, leaving out passages with no matching terms."""
+        scores = self.scores(query)
+        ranked = sorted(range(len(scores)), key=lambda index: scores[index], reverse=True)
+        return [index for index in ranked[:k] if scores[index] > 0]
+
+
+def field_queries(compiled: CompiledTemplate) -> Dict[str, str]:
+    """Build a retrieval query per field from its name and description."""
+    return {name: f"{name} {description}" for name, description in compiled.fields}
+
+
+def _merge_passages(pages: List[str], passages: List[Passage]) -> List[Tuple[int, str]]:
+    """Join selected passages that overlap or touch on the same page, in document order."""
+    spans = []
+    for passage in sorted(passages, key=lambda p: (p.page, p.start)):
+        if spans and spans[-1][0] == passage.page and passage.start <= spans[-1][2]:
+            spans[-1][2] = max(spans[-1][2], passage.end)
+        else:
+            spans.append([passage.page, passage.start, passage.end])
+    return [
+        (page, '\n'.join(pages[page].split('\n')[start:end]).strip())
+        for page, start, end in spans
+    ]
+
+
+class RetrievalResult:
+    """The passages selected for a document along with what they cost."""
+
+    __slots__ = ('text', 'passages_selected', 'passages_total', 'field_passages')
+
+    def __init__(self, text: str, passages_selected: int, passages_total: int, field_passages: Dict[str, List[int]]):
+        self.text = text
+        self.passages_selected = passages_selected
+        self.passages_total = passages_total
+        self.field_passages = field_passages  # Passage indexes retrieved for each field
+
+
+def select_passages(pages: List[str], compiled: CompiledTemplate, top_k: int = None,
+                    chunk_words: int = None) -> Optional[RetrievalResult]:
+    """
+    Select the passages of a document relevant to a template's fields.
+
+    Each field's name and description is run as a BM25 query over the
+    document's passages. The union of every field's top-k passages is
+    returned in document order, each with its page number.
+
+    Args:
+        pages (List[str]): Text of each page
+        compiled (CompiledTemplate): The template whose fields are queried
+        top_k (int, optional): Passages kept per field
+        chunk_words (int, optional): Target passage size in words
+
+    Returns:
+        Optional[RetrievalResult]: The selected passages, or None when they
+            would not be meaningfully smaller than the full document
+    """
+    top_k = top_k or RETRIEVAL_TOP_K
+    passages = chunk_pages(pages, chunk_words)
+    if not passages:
+        return None
+
+    index = BM25Index(passages)
+    field_passages = {name: index.top_k(query, top_k) for name, query in field_queries(compiled).items()}
+    selected = sorted({passage_index for indexes in field_passages.values() for passage_index in indexes})
+    if not selected or len(selected) >= len(passages):
+        return None
+
+    sections = _merge_passages(pages, [passages[passage_index] for passage_index in selected])
+    text = "\n\n".join(f"[Page {page + 1}]\n{section}" for page, section in sections)
+    return RetrievalResult(text, len(selected), len(passages), field_passages)
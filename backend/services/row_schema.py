@@ -0,0 +1,94 @@
+import sys
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+
+class RowSchema:
+    """
+    Ordered column names shared by every row of one template.
+
+    Column names are interned and stored once per template, so a row only
+    holds its values. Columns are only ever appended, which keeps the
+    positions of existing rows valid; rows written before a column was
+    added are simply shorter.
+    """
+
+    __slots__ = ('columns', 'positions')
+
+    def __init__(self, columns: Iterable[str] = ()):
+        self.columns = []
+        self.positions = {}
+        self.extend(columns)
+
+    def extend(self, names: Iterable[str]) -> None:
+        """Append any column names the schema does not have yet."""
+        for name in names:
+            if name not in self.positions:
+                name = sys.intern(str(name))
+                self.positions[name] = len(self.columns)
+                self.columns.append(name)
+
+    def to_row(self, record: Dict) -> Tuple:
+        """Convert a record dict to a row, extending the schema with new keys."""
+        self.extend(record.keys())
+        values = [None] * len(self.columns)
+        for name, value in record.items():
+            values[self.positions[name]] = value
+        return tuple(values)
+
+    def to_dict(self, row: Tuple) -> Dict:
+        """Convert a row back to a record dict, omitting absent columns."""
+        return {name: value for name, value in zip(self.columns, row) if value is not None}
+
+    def get(self, row: Tuple, name: str, default=None):
+        """Get a single column value from a row."""
+        position = self.positions.get(name)
+        if position is None or position >= len(row) or row[position] is None:
+            return default
+        return row[position]
+
+
+class RowTable:
+    """One template's rows keyed by document URL, in insertion order."""
+
+    __slots__ = ('schema', 'rows')
+
+    def __init__(self, schema: Optional[RowSchema] = None):
+        self.schema = schema or RowSchema()
+        self.rows = {}  # {document_url: row}
+
+    def upsert(self, document_url: str, record: Dict) -> bool:
+        """Add or replace a document's row; returns True if it was new."""
+        is_new = document_url not in self.rows
+        self.rows[document_url] = self.schema.to_row(record)
+        return is_new
+
+    def remove(self, document_url: str) -> bool:
+        """Remove a document's row; returns True if it was present."""
+        return self.rows.pop(document_url, None) is not None
+
+    def get_dict(self, document_url: str) -> Optional[Dict]:
+        """Get a document's row as a record dict."""
+        row = self.rows.get(document_url)
+        return self.schema.to_dict(row) if row is not None else None
+
+    def iter_dicts(self) -> Iterator[Tuple[str, Dict]]:
+        """Iterate (document_url, record dict) pairs."""
+        for document_url, row in self.rows.items():
+            yield document_url, self.schema.to_dict(row)
+
+    def to_json(self) -> Dict:
+        """Serialize the table in its compact column/row form."""
+        return {
+            'columns': list(self.schema.columns),
+            'rows': {document_url: list(row) for document_url, row in self.rows.items()}
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict) -> 'RowTable':
+        """Load a table serialized by to_json."""
+        table = cls(RowSchema(data.get('columns', [])))
+        table.rows = {document_url: tuple(row) for document_url, row in data.get('rows', {}).items()}
+        return table
+
+    def __len__(self) -> int:
+        return len(self.rows)
@@ -0,0 +1,161 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from services.cancellation import CancellationToken
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, highest first
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BATCH = 'batch'
+PRIORITY_CLASSES = (PRIORITY_INTERACTIVE, PRIORITY_BATCH)
+
+# Documents extracted at once across all requests and jobs
+SCHEDULER_MAX_CONCURRENCY = int(os.getenv('SCHEDULER_MAX_CONCURRENCY', '8'))
+# Slots only interactive requests can use, so a bulk job never fills every slot
+SCHEDULER_INTERACTIVE_RESERVED = int(os.getenv('SCHEDULER_INTERACTIVE_RESERVED', '2'))
+
+# Seconds between a waiting request's checks of its cancellation token
+CANCEL_POLL_INTERVAL = 0.5
+
+_current = threading.local()
+
+
+def current_priority() -> Optional[str]:
+    """Get the priority class of the slot the calling thread holds, if any."""
+    return getattr(_current, 'priority', None)
+
+
+class PriorityScheduler:
+    """
+    Admits documents for extraction by priority class.
+
+    At most max_concurrency documents run at once. Each class can have
+    slots reserved for it, which other classes never take. A free slot
+    goes to the highest-priority class waiting for one, so interactive
+    requests start ahead of any queued bulk documents; a bulk document
+    already running is never interrupted.
+    """
+
+    def __init__(self, max_concurrency: int = None, reserved: Optional[Dict[str, int]] = None):
+        self.max_concurrency = max(max_concurrency or SCHEDULER_MAX_CONCURRENCY, 1)
+        if reserved is None:
+            reserved = {PRIORITY_INTERACTIVE: SCHEDULER_INTERACTIVE_RESERVED}
+        # Leave at least one slot for the lowest class
+        self.reserved = {cls: max(reserved.get(cls, 0), 0) for cls in PRIORITY_CLASSES}
+        self.reserved[PRIORITY_INTERACTIVE] = min(self.reserved[PRIORITY_INTERACTIVE], self.max_concurrency - 1)
+        self.running = {cls: 0 for cls in PRIORITY_CLASSES}
+        self.waiting = {cls: 0 for cls in PRIORITY_CLASSES}
+        self._condition = threading.Condition()
+
+    def _can_start(self, priority: str) -> bool:
+        free = self.max_concurrency - sum(self.running.values())
+        held_for_others = sum(
+            max(self.reserved[cls] - self.running[cls], 0) for cls in PRIORITY_CLASSES if cls != priority
+        )
+        if free <= held_for_others:
+            return False
+        # Higher classes waiting for a slot get it first
+        for cls in PRIORITY_CLASSES:
+            if cls == priority:
+                return True
+            if self.waiting[cls]:
+                return False
+        return True
+
+    def acquire(self, priority: str, cancel_token: Optional[CancellationToken] = None) -> float:
+        """
+        Wait for a slot in a priority class.
+
+        Args:
+            priority (str): One of PRIORITY_CLASSES
+            cancel_token (CancellationToken, optional): Stops waiting when cancelled
+
+        Returns:
+            float: Seconds spent waiting for the slot
+
+        Raises:
+            OperationCancelled: If cancel_token is cancelled while waiting
+        """
+        if priority not in self.running:
+            raise ValueError(f"Unknown priority class: {priority}")
+        start_time = time.time()
+        with self._condition:
+            self.waiting[priority] += 1
+            try:
+                while True:
+                    if cancel_token:
+                        cancel_token.raise_if_cancelled()
+                    if self._can_start(priority):
+                        break
+                    self._condition.wait(CANCEL_POLL_INTERVAL if cancel_token else None)
+            finally:
+                self.waiting[priority] -= 1
+                # A class that stopped waiting may unblock lower ones
+                self._condition.notify_all()
+            self.running[priority] += 1
+        queue_wait = time.time() - start_time
+        metrics.observe(f"scheduler.{priority}.queue_wait", queue_wait)
+        return queue_wait
+
+    def release(self, priority: str) -> None:
+        """Free a slot taken with acquire."""
+        with self._condition:
+            self.running[priority] -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, priority: str, cancel_token: Optional[CancellationToken] = None):
+        """
+        Hold a slot for the duration of a with block, recording the
+        block's latency including its wait for the slot. The block gets
+        the seconds spent waiting.
+        """
+        start_time = time.time()
+        queue_wait = self.acquire(priority, cancel_token)
+        previous = current_priority()
+        _current.priority = priority
+        try:
+            yield queue_wait
+        finally:
+            _current.priority = previous
+            self.release(priority)
+            metrics.observe(f"scheduler.{priority}.latency", time.time() - start_time)
+
+    def stats(self) -> Dict:
+        """Get each class's slots in use, queue length and recent queue wait and latency."""
+        with self._condition:
+            running, waiting = dict(self.running), dict(self.waiting)
+        return {
+            'max_concurrency': self.max_concurrency,
+            'classes': {
+                cls: {
+                    'running': running[cls],
+                    'waiting': waiting[cls],
+                    'reserved': self.reserved[cls],
+                    'queue_wait_p50': metrics.percentile(f"scheduler.{cls}.queue_wait", 50),
+                    'queue_wait_p95': metrics.percentile(f"scheduler.{cls}.queue_wait", 95),
+                    'latency_p95': metrics.percentile(f"scheduler.{cls}.latency", 95)
+                }
+                for cls in PRIORITY_CLASSES
+            }
+        }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> PriorityScheduler:
+    """Get the process-wide document scheduler."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = PriorityScheduler()
+    return _scheduler
@@ -6,6 +6,8 @@ from typing import Optional, List, Dict
 from office365.runtime.auth.client_credential import ClientCredential
 from office365.sharepoint.client_context import ClientContext
 import time
+from context.compiled_template import column_letter
+from services.cancellation import CancellationToken, OperationCancelled, closing_on_cancel
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -159,7 +161,9 @@ class SharePointService:
                         'url': f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/items/{file['id']}/content",
                         'name': file['name'],
                         'size': file.get('size', 0),
-                        'last_modified': file.get('lastModifiedDateTime')
+                        'last_modified': file.get('lastModifiedDateTime'),
+                        # Content hash SharePoint computes for every file; equal hashes mean equal bytes
+                        'quick_xor_hash': (file.get('file') or {}).get('hashes', {}).get('quickXorHash')
                     }
                     for file in files if file['name'].lower().endswith('.pdf')
                 ])
@@ -175,13 +179,16 @@ class SharePointService:
             logger.error(f"Error getting SharePoint files: {str(e)}")
             raise
 
-    def download_file(self, file_url: str, local_path: Optional[str] = None) -> str:
+    def download_file(self, file_url: str, local_path: Optional[str] = None, hasher=None,
+                      cancel_token: Optional[CancellationToken] = None) -> str:
         """
         Download a file from SharePoint.
         
         Args:
             file_url (str): URL of the file.
             local_path (str, optional): Local path to save the file.
+            hasher (optional): hashlib object updated with the file's bytes as they arrive.
+            cancel_token (CancellationToken, optional): Aborts the download when cancelled.
             
         Returns:
             str: Path to downloaded file.
@@ -200,13 +207,19 @@ class SharePointService:
             response = requests.get(file_url, headers=headers, stream=True)
             response.raise_for_status()
             
-            with open(local_path, 'wb') as f:
+            with closing_on_cancel(response, cancel_token), open(local_path, 'wb') as f:
                 for chunk in response.iter_content(chunk_size=8192):
+                    if cancel_token:
+                        cancel_token.raise_if_cancelled()
                     f.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
             
             # logger.info(f"File downloaded successfully: {local_path}")
             return local_path
             
+        except OperationCancelled:
+            raise
         except Exception as e:
             logger.error(f"Error downloading SharePoint file: {str(e)}")
             raise
@@ -369,4 +382,58 @@ class SharePointService:
         except Exception as e:
             error_msg = f"Error uploading file to SharePoint: {str(e)}"
             logger.error(error_msg)
-            raise
\ No newline at end of file
+            raise
+
+    def append_rows(self, file_name: str, folder_path: str, sheet_name: str, start_row: int,
+                    rows: List[List[str]]) -> None:
+        """
+        Write rows into an existing workbook through the Graph workbook API,
+        without replacing the remote file. The rows get the wrapped,
+        top-aligned cells a full workbook upload writes.
+
+        Args:
+            file_name (str): Name of the workbook in the folder
+            folder_path (str): Path to the SharePoint folder
+            sheet_name (str): Worksheet to write to
+            start_row (int): 1-based worksheet row of the first new row
+            rows (List[List[str]]): Row values, all of the same width
+        """
+        try:
+            if not rows:
+                return
+            width = len(rows[0])
+            if any(len(row) != width for row in rows):
+                raise ValueError("All rows must have the same number of columns")
+
+            access_token = self._get_access_token()
+            site_id = self._get_site_id()
+
+            headers = {
+                'Authorization': f'Bearer {access_token}',
+                'Content-Type': 'application/json'
+            }
+
+            end_row = start_row + len(rows) - 1
+            address = f"A{start_row}:{column_letter(width)}{end_row}"
+            range_url = (
+                f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/root:/{folder_path}/{file_name}:"
+                f"/workbook/worksheets('{sheet_name}')/range(address='{address}')"
+            )
+
+            response = requests.patch(range_url, headers=headers, json={'values': rows})
+            if response.status_code != 200:
+                error_msg = f"Row append failed with status {response.status_code}: {response.text}"
+                logger.error(error_msg)
+                raise requests.exceptions.HTTPError(error_msg)
+
+            response = requests.patch(
+                f"{range_url}/format", headers=headers, json={'wrapText': True, 'verticalAlignment': 'Top'}
+            )
+            if response.status_code != 200:
+                error_msg = f"Formatting appended rows failed with status {response.status_code}: {response.text}"
+                logger.error(error_msg)
+                raise requests.exceptions.HTTPError(error_msg)
+
+        except Exception as e:
+            logger.error(f"Error appending rows to SharePoint workbook: {str(e)}")
+            raise
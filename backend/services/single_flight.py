@@ -0,0 +1,115 @@
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError
+from typing import Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+from services.cancellation import CancellationToken, OperationCancelled
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Seconds between a waiting caller's checks of its own cancellation token
+CANCEL_POLL_INTERVAL = 0.5
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one.
+
+    The first caller for a key runs the work; callers arriving while it
+    is in flight wait for its outcome instead of running it again. The key
+    is forgotten as soon as the work finishes, so later calls run afresh
+    (and find whatever the work cached).
+
+    A run that was cancelled is not a result: callers waiting on it run
+    the work again themselves, unless they have been cancelled too.
+    """
+
+    def __init__(self, name: str = "single_flight"):
+        self.name = name
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, work: Callable[[], T],
+           cancel_token: Optional[CancellationToken] = None) -> Tuple[T, bool]:
+        """
+        Run work for a key, or wait for the run already in flight.
+
+        Args:
+            key (Hashable): What identifies identical work
+            work (Callable[[], T]): The work to run
+            cancel_token (CancellationToken, optional): Stops waiting for another caller's run
+
+        Returns:
+            Tuple[T, bool]: The result, and whether it came from another caller's run
+
+        Raises:
+            Exception: The work's error, raised to every waiting caller
+            OperationCancelled: If cancel_token is cancelled while waiting
+        """
+        while True:
+            with self._lock:
+                future = self._calls.get(key)
+                leader = future is None
+                if leader:
+                    future = Future()
+                    self._calls[key] = future
+            if leader:
+                break
+
+            metrics.increment(f"{self.name}.coalesced")
+            try:
+                return self._wait(future, cancel_token), True
+            except OperationCancelled:
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                # The run was cancelled by its own caller; take over
+                continue
+
+        # The key is forgotten before the outcome is published, so a caller
+        # retrying after a cancelled run never finds the same run again
+        try:
+            result = work()
+        except BaseException as e:
+            self._forget(key)
+            future.set_exception(e)
+            raise
+        self._forget(key)
+        future.set_result(result)
+        return result, False
+
+    def _forget(self, key: Hashable) -> None:
+        with self._lock:
+            self._calls.pop(key, None)
+
+    @staticmethod
+    def _wait(future: Future, cancel_token: Optional[CancellationToken]):
+        if cancel_token is None:
+            return future.result()
+        while True:
+            cancel_token.raise_if_cancelled()
+            try:
+                return future.result(timeout=CANCEL_POLL_INTERVAL)
+            except TimeoutError:
+                continue
+
+    def in_flight(self) -> int:
+        """Get the number of keys currently in flight."""
+        with self._lock:
+            return len(self._calls)
+
+
+_extractions_in_flight = None
+_extractions_in_flight_lock = threading.Lock()
+
+
+def get_extractions_in_flight() -> SingleFlight:
+    """Get the process-wide coalescer of document extractions."""
+    global _extractions_in_flight
+    if _extractions_in_flight is None:
+        with _extractions_in_flight_lock:
+            if _extractions_in_flight is None:
+                _extractions_in_flight = SingleFlight("single_flight")
+    return _extractions_in_flight
@@ -0,0 +1,205 @@
+import os
+import re
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from context.compiled_template import CompiledTemplate
+
+logger = logging.getLogger(__name__)
+
+# Set to 'true' to route the standard SmPC fields by DEFAULT_FIELD_SECTIONS when a template gives no sections
+SMPC_DEFAULT_SECTIONS = os.getenv('SMPC_DEFAULT_SECTIONS', 'false').lower() == 'true'
+
+# Section holding the text ahead of the first heading: title page and annex title
+PREAMBLE_SECTION = '0'
+
+# Where the standard SmPC fields are found. Numbered sections are Annex I
+# (the SmPC itself); lettered 'II.x' sections are Annex II.
+DEFAULT_FIELD_SECTIONS = {
+    'Document Type': [PREAMBLE_SECTION, '1'],
+    'Product Name': ['1'],
+    'Active Substance(s)': ['2'],
+    'Strength': ['1', '2'],
+    'Pharmaceutical Form': ['3'],
+    'Route of Administration': ['4.2'],
+    'Indications': ['4.1'],
+    'Posology': ['4.2'],
+    'Contraindications': ['4.3'],
+    'Special Warnings and Precautions': ['4.4'],
+    'ATC Code': ['5.1'],
+    'Excipients': ['6.1'],
+    'Shelf Life': ['6.3'],
+    'Storage Conditions': ['6.4'],
+    'Package Description': ['6.5'],
+    'Marketing Authorisation Holder': ['7'],
+    'Marketing Authorisation Number': ['8'],
+    'Date of First Authorisation': ['9'],
+    'Date of Latest Renewal': ['9'],
+    'Manufacturers': ['II.A'],
+    'Legal Category': ['II.B'],
+}
+
+# "4.", "4.1", "4.1." or "10." followed by a heading title
+_NUMBERED_HEADING = re.compile(r'^\s*(\d{1,2})(?:\.(\d{1,2}))?\.?\s+([A-Z][^\n]{2,})$', re.MULTILINE)
+# "A." to "E." followed by an upper-case Annex II heading
+_LETTERED_HEADING = re.compile(r'^\s*([A-E])\.\s+([A-Z][A-Z0-9 ,()\'/&-]{3,})$', re.MULTILINE)
+_ANNEX_HEADING = re.compile(r'^\s*ANNEX\s+(I{1,3}|IV)\s*$', re.MULTILINE)
+
+# Highest major section number of an SmPC
+_MAX_SECTION = 12
+
+
+def _annex_regions(text: str) -> Dict[str, Tuple[int, int]]:
+    """Get the span of each annex, keyed by its roman numeral. Empty when the text has no annex headings."""
+    runs = []  # [numeral, first heading offset, last heading offset]
+    for match in _ANNEX_HEADING.finditer(text):
+        numeral = match.group(1)
+        # An annex's table of contents repeats its heading; its text starts from the last repeat
+        if runs and runs[-1][0] == numeral:
+            runs[-1][2] = match.start()
+        else:
+            runs.append([numeral, match.start(), match.start()])
+    regions = {}
+    for index, (numeral, _, start) in enumerate(runs):
+        end = runs[index + 1][1] if index + 1 < len(runs) else len(text)
+        regions.setdefault(numeral, (start, end))
+    return regions
+
+
+def _numbered_headings(text: str, start: int, end: int) -> List[Tuple[str, int]]:
+    """
+    Find the numbered section headings between two offsets.
+
+    Headings must appear in increasing order, which keeps numbered list
+    items and cross-references in the body from being read as headings.
+    """
+    headings = []
+    last_key = (0, -1)
+    for match in _NUMBERED_HEADING.finditer(text, start, end):
+        major = int(match.group(1))
+        minor = int(match.group(2)) if match.group(2) else 0
+        if not 1 <= major <= _MAX_SECTION or (major, minor) <= last_key:
+            continue
+        # A new major section starts at "n." or its first subsection; a subsection continues the current one
+        if major != last_key[0] and minor > 1:
+            continue
+        last_key = (major, minor)
+        section = f"{major}.{minor}" if match.group(2) else str(major)
+        headings.append((section, match.start()))
+    return headings
+
+
+def _lettered_headings(text: str, start: int, end: int, prefix: str) -> List[Tuple[str, int]]:
+    """Find lettered Annex headings between two offsets, in order."""
+    headings = []
+    last_letter = ''
+    for match in _LETTERED_HEADING.finditer(text, start, end):
+        letter = match.group(1)
+        if letter <= last_letter:
+            # The annex's table of contents lists the headings once before the sections themselves
+            if letter == 'A':
+                headings = []
+                last_letter = ''
+            else:
+                continue
+        last_letter = letter
+        headings.append((f"{prefix}.{letter}", match.start()))
+    return headings
+
+
+def _is_within(section: str, parent: str) -> bool:
+    return section == parent or section.startswith(parent + '.')
+
+
+def segment_sections(text: str) -> Dict[str, str]:
+    """
+    Split SmPC text into its sections by heading.
+
+    Numbered headings (4, 4.1, 4.2, ...) are read from Annex I, or from the
+    whole text when it has no annex headings; lettered Annex II headings
+    become sections 'II.A', 'II.B', and so on. A major section's text
+    includes its subsections. Text before the first heading is section '0'.
+
+    Args:
+        text (str): The document text
+
+    Returns:
+        Dict[str, str]: Section text by section number, in document order;
+            empty when no headings are found
+    """
+    regions = _annex_regions(text)
+    annex_one = regions.get('I', (0, len(text))) if regions else (0, len(text))
+    headings = _numbered_headings(text, *annex_one)
+    if 'II' in regions:
+        headings += _lettered_headings(text, *regions['II'], prefix='II')
+    if not headings:
+        return {}
+    headings.sort(key=lambda heading: heading[1])
+
+    # Each section ends where the next heading outside it starts, or at the end of its annex
+    region_ends = sorted(end for _, end in regions.values()) if regions else [len(text)]
+    sections = {PREAMBLE_SECTION: text[:headings[0][1]].strip()}
+    for index, (section, start) in enumerate(headings):
+        end = next((region_end for region_end in region_ends if region_end > start), len(text))
+        for following, following_start in headings[index + 1:]:
+            if not _is_within(following, section):
+                end = min(end, following_start)
+                break
+        sections[section] = text[start:end].strip()
+    return sections
+
+
+def field_sections(compiled: CompiledTemplate, use_defaults: Optional[bool] = None) -> Dict[str, List[str]]:
+    """
+    Get the sections each routed field should be read from.
+
+    Sections given in the template take precedence. With use_defaults
+    (default SMPC_DEFAULT_SECTIONS), the standard SmPC fields fall back to
+    DEFAULT_FIELD_SECTIONS. Fields missing from the result are read from
+    the full document.
+    """
+    routes = {}
+    if SMPC_DEFAULT_SECTIONS if use_defaults is None else use_defaults:
+        routes.update({name: sections for name, sections in DEFAULT_FIELD_SECTIONS.items() if name in compiled.field_names})
+    routes.update({name: list(sections) for name, sections in compiled.field_sections})
+    return routes
+
+
+def route_fields(compiled: CompiledTemplate, sections: Dict[str, str],
+                 use_defaults: Optional[bool] = None) -> Tuple[Dict[str, List[str]], List[str]]:
+    """
+    Split a template's fields into those answered from their sections and
+    those that need the full document.
+
+    Args:
+        compiled (CompiledTemplate): The template being extracted
+        sections (Dict[str, str]): The document's sections from segment_sections
+        use_defaults (bool, optional): Whether to route by DEFAULT_FIELD_SECTIONS; defaults to SMPC_DEFAULT_SECTIONS
+
+    Returns:
+        Tuple[Dict[str, List[str]], List[str]]: Sections by routed field,
+            and the fields that are unrouted or whose sections are missing
+    """
+    routes = field_sections(compiled, use_defaults)
+    routed, unrouted = {}, []
+    for name in compiled.field_names:
+        wanted = routes.get(name)
+        if wanted and all(sections.get(section) for section in wanted):
+            routed[name] = wanted
+        else:
+            unrouted.append(name)
+    return routed, unrouted
+
+
+def section_text(sections: Dict[str, str], wanted: List[str]) -> Optional[str]:
+    """
+    Join the requested sections in document order, leaving out sections
+    already contained in a requested parent section.
+    """
+    keep = [
+        section for section in sections
+        if section in wanted and not any(parent != section and _is_within(section, parent) for parent in wanted)
+    ]
+    if not keep:
+        return None
+    return "\n\n".join(sections[section] for section in keep)
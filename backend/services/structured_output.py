@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import logging
+import threading
+import requests
+from typing import Dict, Optional
+
+from context.compiled_template import CompiledTemplate
+from services.prompt_builder import FILENAME_FIELD, FILENAME_DESCRIPTION
+
+logger = logging.getLogger(__name__)
+
+OPENROUTER_MODELS_URL = "https://openrouter.ai/api/v1/models"
+
+# Comma-separated model IDs to treat as supporting structured output without asking OpenRouter
+STRUCTURED_OUTPUT_MODELS = {
+    model_id.strip() for model_id in os.getenv('STRUCTURED_OUTPUT_MODELS', '').split(',') if model_id.strip()
+}
+# Set to 'false' to always use the free-form JSON prompt and parser
+STRUCTURED_OUTPUT_ENABLED = os.getenv('STRUCTURED_OUTPUT', 'true').lower() == 'true'
+# Seconds before asking OpenRouter for its model list again after a failed attempt
+SUPPORTED_MODELS_RETRY_INTERVAL = int(os.getenv('SUPPORTED_MODELS_RETRY_INTERVAL', '300'))
+
+
+class StructuredOutputError(ValueError):
+    """Raised when a structured response does not match the template's schema."""
+
+
+_supported_models = None
+_supported_models_failed_at = None
+_supported_models_lock = threading.Lock()
+
+
+def _retrying_too_soon() -> bool:
+    return (_supported_models_failed_at is not None
+            and time.time() - _supported_models_failed_at < SUPPORTED_MODELS_RETRY_INTERVAL)
+
+
+def _load_supported_models() -> set:
+    """
+    Get the IDs of OpenRouter models that accept a JSON schema response_format.
+
+    A failed fetch is remembered for SUPPORTED_MODELS_RETRY_INTERVAL
+    seconds, during which only STRUCTURED_OUTPUT_MODELS are treated as
+    supported, so an OpenRouter outage does not add a blocking request to
+    every extraction.
+    """
+    global _supported_models, _supported_models_failed_at
+    if _supported_models is None and not _retrying_too_soon():
+        with _supported_models_lock:
+            if _supported_models is None and not _retrying_too_soon():
+                try:
+                    response = requests.get(OPENROUTER_MODELS_URL, timeout=10)
+                    response.raise_for_status()
+                    _supported_models = {
+                        model['id'] for model in response.json().get('data', [])
+                        if 'structured_outputs' in (model.get('supported_parameters') or [])
+                    }
+                except Exception as e:
+                    logger.warning(
+                        f"Could not load structured output support from OpenRouter, "
+                        f"retrying in {SUPPORTED_MODELS_RETRY_INTERVAL}s: {str(e)}"
+                    )
+                    _supported_models_failed_at = time.time()
+    return _supported_models or set()
+
+
+def supports_structured_output(model_id: str) -> bool:
+    """Check whether a model can be sent the template's JSON schema as response_format."""
+    if not STRUCTURED_OUTPUT_ENABLED:
+        return False
+    return model_id in STRUCTURED_OUTPUT_MODELS or model_id in _load_supported_models()
+
+
+# Schemas are built for per-document field subsets too, so the cache is bounded
+SCHEMA_CACHE_SIZE = 1024
+_schema_cache = {}  # {(template_id, schema_hash): schema}
+
+
+def build_json_schema(compiled: CompiledTemplate) -> Dict:
+    """
+    Build the JSON schema of a template's extraction result: an object with
+    one required string property per field, plus the 'filename' field.
+
+    Args:
+        compiled (CompiledTemplate): The template to extract fields for
+
+    Returns:
+        Dict: The JSON schema, cached per template version
+    """
+    key = (compiled.template_id, compiled.schema_hash)
+    schema = _schema_cache.get(key)
+    if schema is None:
+        fields = ((FILENAME_FIELD, FILENAME_DESCRIPTION),) + compiled.fields
+        schema = {
+            'type': 'object',
+            'properties': {name: {'type': 'string', 'description': description} for name, description in fields},
+            'required': [name for name, _ in fields],
+            'additionalProperties': False
+        }
+        if len(_schema_cache) >= SCHEMA_CACHE_SIZE:
+            _schema_cache.clear()
+        _schema_cache[key] = schema
+    return schema
+
+
+def build_response_format(schema: Dict) -> Dict:
+    """Wrap a JSON schema as an OpenRouter/OpenAI structured output response_format."""
+    return {
+        'type': 'json_schema',
+        'json_schema': {
+            'name': 'metadata',
+            'strict': True,
+            'schema': schema
+        }
+    }
+
+
+def decode_structured_response(content: str, schema: Dict) -> Dict:
+    """
+    Decode and validate a structured output response.
+
+    Args:
+        content (str): The assistant's reply
+        schema (Dict): The schema the reply was requested with
+
+    Returns:
+        Dict: Field values by name
+
+    Raises:
+        StructuredOutputError: If the reply is not a JSON object matching the schema
+    """
+    try:
+        data = json.loads(content)
+    except (TypeError, json.JSONDecodeError) as e:
+        raise StructuredOutputError(f"Response is not valid JSON: {str(e)}")
+    if not isinstance(data, dict):
+        raise StructuredOutputError("Response is not a JSON object")
+
+    properties = schema['properties']
+    missing = [name for name in schema['required'] if name not in data]
+    if missing:
+        raise StructuredOutputError(f"Response is missing fields: {missing}")
+    unexpected = [name for name in data if name not in properties]
+    if unexpected and schema.get('additionalProperties') is False:
+        raise StructuredOutputError(f"Response has unexpected fields: {unexpected}")
+    wrong_type = [name for name in properties if name in data and not isinstance(data[name], str)]
+    if wrong_type:
+        raise StructuredOutputError(f"Response fields are not strings: {wrong_type}")
+
+    return {name: data[name].strip() or "Not found" for name in properties}
@@ -0,0 +1,142 @@
+from collections import deque
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Characters of context kept on each side of a match before it is cut down to its line
+CONTEXT_CHARS = 100
+
+
+def field_name_variations(field_name: str) -> List[str]:
+    """Get the lowercase spellings of a field name to look for in a response, in order of preference."""
+    field_lower = field_name.lower()
+    variations = [
+        field_lower,
+        field_lower.replace('/', ' or '),
+        field_lower.replace('_', ' '),
+        field_lower.replace('-', ' '),
+        field_lower.replace(' and ', ' & '),
+        field_lower.replace(' & ', ' and ')
+    ]
+    return list(dict.fromkeys(variation for variation in variations if variation))
+
+
+class _Automaton:
+    """Aho-Corasick automaton over a fixed set of patterns."""
+
+    __slots__ = ('goto', 'fail', 'output', 'patterns')
+
+    def __init__(self, patterns: Tuple[str, ...]):
+        self.patterns = patterns
+        self.goto = [{}]
+        self.output = [[]]
+        for pattern_id, pattern in enumerate(patterns):
+            state = 0
+            for char in pattern:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.output.append([])
+                state = next_state
+            self.output[state].append(pattern_id)
+
+        # Breadth-first pass to set failure links and merge outputs along them
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def first_occurrences(self, text: str) -> Dict[int, int]:
+        """Scan the text once and get the start offset of each pattern's first occurrence."""
+        found = {}
+        remaining = len(self.patterns)
+        goto, fail, output, patterns = self.goto, self.fail, self.output, self.patterns
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for pattern_id in output[state]:
+                if pattern_id not in found:
+                    found[pattern_id] = end - len(patterns[pattern_id])
+                    remaining -= 1
+            if not remaining:
+                break
+        return found
+
+
+@lru_cache(maxsize=64)
+def _get_automaton(patterns: Tuple[str, ...]) -> _Automaton:
+    # Templates ask for the same fields on every document, so automata are reused across responses
+    return _Automaton(patterns)
+
+
+class PartialMatchIndex:
+    """
+    Lowercased view of one LLM response for finding the lines that mention
+    field names the model did not answer.
+
+    The text is lowercased once, and all name variations of all requested
+    fields are found in a single Aho-Corasick scan. Context lines are then
+    cut out by offset, so resolving any number of fields is linear in the
+    size of the text.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        lowered = text.lower()
+        # A few characters change length when lowercased; offsets then refer to the lowered text
+        self._offsets_match = len(lowered) == len(text)
+        self.lowered = lowered
+
+    def _context_line(self, start: int, length: int) -> str:
+        """Get the line around a match, clipped to CONTEXT_CHARS on each side."""
+        source = self.text if self._offsets_match else self.lowered
+        line_start = max(source.rfind('\n', 0, start) + 1, start - CONTEXT_CHARS)
+        line_end = source.find('\n', start + length)
+        if line_end == -1:
+            line_end = len(source)
+        line_end = min(line_end, start + length + CONTEXT_CHARS)
+        return source[line_start:line_end].strip()
+
+    def find_all(self, field_names: Iterable[str]) -> Dict[str, Optional[str]]:
+        """
+        Find the context line for each field name in one pass over the text.
+
+        Args:
+            field_names (Iterable[str]): Names of the fields to look for
+
+        Returns:
+            Dict[str, Optional[str]]: The line mentioning each field, None when it is not mentioned
+        """
+        variations_by_field = {name: field_name_variations(name) for name in field_names}
+        patterns = tuple(sorted({variation for variations in variations_by_field.values() for variation in variations}))
+        if not patterns:
+            return {name: None for name in variations_by_field}
+
+        automaton = _get_automaton(patterns)
+        found = automaton.first_occurrences(self.lowered)
+        pattern_ids = {pattern: pattern_id for pattern_id, pattern in enumerate(patterns)}
+
+        matches = {}
+        for name, variations in variations_by_field.items():
+            matches[name] = None
+            for variation in variations:
+                start = found.get(pattern_ids[variation])
+                if start is not None:
+                    matches[name] = self._context_line(start, len(variation))
+                    break
+        return matches
+
+    def find(self, field_name: str) -> Optional[str]:
+        """Find the context line for a single field name."""
+        return self.find_all([field_name])[field_name]
@@ -0,0 +1,133 @@
+import json
+import os
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def hash_row(values: List) -> str:
+    """Return a stable hash for a single rendered worksheet row."""
+    payload = json.dumps([str(value) for value in values], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def hash_workbook_content(columns: List[str], row_hashes: List[str]) -> str:
+    """
+    Return a content hash for a rendered workbook.
+
+    The hash covers the header and every row in order. It is computed from the
+    rendered cell values rather than the .xlsx bytes, because openpyxl stamps
+    creation/modification times into the archive and the bytes of two
+    renders of the same data never match.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(list(columns), ensure_ascii=False).encode('utf-8'))
+    for row_hash in row_hashes:
+        digest.update(row_hash.encode('ascii'))
+    return digest.hexdigest()
+
+
+class UploadLedger:
+    """
+    Remembers what was last uploaded to SharePoint for each template and
+    target folder, so unchanged workbooks are never re-sent.
+    """
+
+    def __init__(self, storage_file: str = "upload_ledger.json"):
+        self.storage_file = storage_file
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._load_ledger()
+
+    @staticmethod
+    def _key(template_id: str, folder_path: str) -> str:
+        return f"{template_id}::{folder_path}"
+
+    def _load_ledger(self) -> None:
+        """Load the ledger from the storage file."""
+        try:
+            if os.path.exists(self.storage_file):
+                with open(self.storage_file, 'r') as f:
+                    self.entries = json.load(f)
+            else:
+                self.entries = {}
+        except Exception as e:
+            logger.error(f"Error loading upload ledger: {str(e)}")
+            self.entries = {}
+
+    def _save_ledger(self) -> None:
+        """Save the ledger to the storage file."""
+        try:
+            with open(self.storage_file, 'w') as f:
+                json.dump(self.entries, f, indent=2)
+        except Exception as e:
+            logger.error(f"Error saving upload ledger: {str(e)}")
+
+    def get_entry(self, template_id: str, folder_path: str) -> Optional[Dict]:
+        """Get the last upload recorded for a template and folder."""
+        with self._lock:
+            return self.entries.get(self._key(template_id, folder_path))
+
+    def is_unchanged(self, template_id: str, folder_path: str, content_hash: str) -> bool:
+        """Check whether the given content was already uploaded to the folder."""
+        entry = self.get_entry(template_id, folder_path)
+        return bool(entry and entry.get('content_hash') == content_hash and entry.get('sharepoint_url'))
+
+    def get_appended_rows(self, template_id: str, folder_path: str, columns: List[str],
+                          row_hashes: List[str]) -> Optional[int]:
+        """
+        Work out whether the new render only appends rows to the uploaded one.
+
+        Args:
+            template_id (str): The ID of the template
+            folder_path (str): The SharePoint target folder
+            columns (List[str]): Header of the new render
+            row_hashes (List[str]): Row hashes of the new render, in sheet order
+
+        Returns:
+            Optional[int]: Number of rows already present remotely when the new
+            render is the uploaded one plus trailing rows, None otherwise
+        """
+        entry = self.get_entry(template_id, folder_path)
+        if not entry or not entry.get('sharepoint_url'):
+            return None
+        if entry.get('columns') != list(columns):
+            return None
+        uploaded = entry.get('row_hashes', [])
+        if len(row_hashes) <= len(uploaded) or row_hashes[:len(uploaded)] != uploaded:
+            return None
+        return len(uploaded)
+
+    def record_upload(self, template_id: str, folder_path: str, file_name: str, columns: List[str],
+                      row_hashes: List[str], content_hash: str, sharepoint_url: str) -> None:
+        """Record a successful upload for a template and folder."""
+        with self._lock:
+            self.entries[self._key(template_id, folder_path)] = {
+                'template_id': template_id,
+                'folder_path': folder_path,
+                'file_name': file_name,
+                'columns': list(columns),
+                'row_hashes': list(row_hashes),
+                'content_hash': content_hash,
+                'sharepoint_url': sharepoint_url,
+                'uploaded_at': datetime.now().isoformat()
+            }
+            self._save_ledger()
+
+
+_upload_ledger = None
+_upload_ledger_lock = threading.Lock()
+
+
+def get_upload_ledger() -> UploadLedger:
+    """Get the process-wide upload ledger."""
+    global _upload_ledger
+    if _upload_ledger is None:
+        with _upload_ledger_lock:
+            if _upload_ledger is None:
+                _upload_ledger = UploadLedger()
+    return _upload_ledger
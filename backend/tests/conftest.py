@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from context.compiled_template import compile_template
+from services.openRouter import CompletionResult
+
+
+@pytest.fixture
+def make_template():
+    """Compile a template from field names, or from field dicts with sections or an extractor."""
+    def make(*fields, template_id='test'):
+        field_dicts = [field if isinstance(field, dict) else {'name': field, 'description': f"The {field}"} for field in fields]
+        return compile_template(template_id, {'name': template_id, 'metadataFields': field_dicts})
+    return make
+
+
+class FakeLLM:
+    """Stands in for request_completion, answering each request from a queue of replies."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.requests = []
+
+    def __call__(self, prompt, model_id, input_filename, **kwargs):
+        self.requests.append({'model_id': model_id, 'fields': tuple(kwargs.get('expected_fields') or ())})
+        reply = self.replies.pop(0)
+        content = reply if isinstance(reply, str) else json.dumps(reply)
+        return CompletionResult(content, model_id, {'prompt_tokens': 100, 'completion_tokens': 20}, 0.1)
+
+
+@pytest.fixture
+def processor(tmp_path, monkeypatch):
+    """A DocumentProcessor without external services, caching to a temporary file."""
+    from services import document_processor
+    from services.extraction_cache import ExtractionCache
+
+    monkeypatch.setattr(document_processor, 'supports_structured_output', lambda model_id: False)
+    monkeypatch.setattr(document_processor, 'SECOND_PASS_ENABLED', True)
+    processor = document_processor.DocumentProcessor.__new__(document_processor.DocumentProcessor)
+    processor.extraction_cache = ExtractionCache(storage_file=str(tmp_path / "extraction_cache.jsonl"))
+    processor.near_duplicates = None
+    return processor
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """Install a FakeLLM with the given replies as the processor's LLM."""
+    from services import document_processor
+
+    def install(*replies):
+        llm = FakeLLM(replies)
+        monkeypatch.setattr(document_processor, 'request_completion', llm)
+        return llm
+    return install
@@ -0,0 +1,49 @@
+from services.cascade import cascade_models, is_unresolved, unresolved_fields
+from services.second_pass import TokenUsage
+
+
+def test_cascade_models():
+    assert cascade_models('big', 'cheap') == ['cheap', 'big']
+    assert cascade_models('big', 'big') == ['big']
+
+
+def test_is_unresolved():
+    assert is_unresolved(None)
+    assert is_unresolved(' Not Found ')
+    assert is_unresolved('')
+    assert not is_unresolved('24 months')
+
+
+def test_unresolved_fields(make_template):
+    compiled = make_template('Product Name', 'Shelf Life')
+    values = {'Product Name': 'Foo', 'Shelf Life': 'Not found'}
+    assert unresolved_fields(compiled, values, compiled.field_names) == ['Shelf Life']
+
+
+def test_not_found_is_escalated_alone(processor, fake_llm, make_template):
+    compiled = make_template('Product Name', 'Shelf Life')
+    llm = fake_llm(
+        {'filename': 'leaflet.pdf', 'Product Name': 'Foo', 'Shelf Life': 'Not found'},
+        {'filename': 'leaflet.pdf', 'Shelf Life': '24 months'}
+    )
+
+    values = processor._extract_with_cascade(
+        "Foo tablets. Shelf life: 24 months.", compiled, compiled, ['cheap', 'big'], 'leaflet.pdf', usage=TokenUsage()
+    )
+
+    assert [request['model_id'] for request in llm.requests] == ['cheap', 'big']
+    assert llm.requests[1]['fields'] == ('filename', 'Shelf Life')
+    assert values['Product Name'] == 'Foo'
+    assert values['Shelf Life'] == '24 months'
+
+
+def test_escalation_not_found_keeps_earlier_answer(processor, fake_llm, make_template):
+    compiled = make_template('Product Name', 'Shelf Life')
+    fake_llm(
+        {'filename': 'leaflet.pdf', 'Product Name': 'Foo', 'Shelf Life': 'Not found'},
+        {'filename': 'leaflet.pdf', 'Shelf Life': 'Not found'}
+    )
+
+    values = processor._extract_with_cascade("Foo tablets.", compiled, compiled, ['cheap', 'big'], 'leaflet.pdf')
+
+    assert values['Shelf Life'] == 'Not found'
@@ -0,0 +1,51 @@
+from context.compiled_template import merge_templates, subset_template
+
+
+def test_subset_keeps_template_order(make_template):
+    compiled = make_template('A', 'B', 'C')
+    subset = subset_template(compiled, ['C', 'A'])
+    assert subset.field_names == ('A', 'C')
+    assert subset_template(compiled, ['A', 'B', 'C']) is compiled
+
+
+def test_subset_is_cached(make_template):
+    compiled = make_template('A', 'B', 'C')
+    assert subset_template(compiled, ['A', 'B']) is subset_template(compiled, ['B', 'A'])
+
+
+def test_routing_changes_the_schema_hash(make_template):
+    plain = make_template('Shelf Life', 'Batch')
+    routed = make_template({'name': 'Shelf Life', 'description': 'The Shelf Life', 'sections': ['6.3']}, 'Batch')
+    bound = make_template('Shelf Life', {'name': 'Batch', 'description': 'The Batch', 'extractor': 'batch_number'})
+    assert len({plain.schema_hash, routed.schema_hash, bound.schema_hash}) == 3
+
+
+def test_subset_sees_edited_sections_and_extractors(make_template):
+    before = make_template('Shelf Life', 'Batch', 'Name')
+    assert subset_template(before, ['Shelf Life', 'Batch']).field_sections == ()
+
+    after = make_template(
+        {'name': 'Shelf Life', 'description': 'The Shelf Life', 'sections': ['6.3']},
+        {'name': 'Batch', 'description': 'The Batch', 'extractor': 'batch_number'},
+        'Name'
+    )
+    subset = subset_template(after, ['Shelf Life', 'Batch'])
+    assert subset.field_sections == (('Shelf Life', ('6.3',)),)
+    assert subset.field_extractors == (('Batch', 'batch_number'),)
+
+
+def test_merge_sees_edited_sections(make_template):
+    other = make_template('Name', template_id='other')
+    before = merge_templates([make_template('Shelf Life'), other])
+    after = merge_templates([make_template({'name': 'Shelf Life', 'description': 'The Shelf Life', 'sections': ['6.3']}), other])
+    assert before.field_sections == ()
+    assert after.field_sections == (('Shelf Life', ('6.3',)),)
+
+
+def test_merge_asks_shared_fields_once(make_template):
+    first = make_template({'name': 'Name', 'description': 'Product name'}, 'A', template_id='first')
+    second = make_template({'name': 'Name', 'description': 'Brand'}, 'B', template_id='second')
+    merged = merge_templates([first, second])
+    assert merged.template_id == 'first+second'
+    assert merged.field_names == ('Name', 'A', 'B')
+    assert dict(merged.fields)['Name'] == 'Product name / Brand'
@@ -0,0 +1,40 @@
+from services.extraction_cache import ExtractionCache
+
+
+def cache(tmp_path, max_entries=10):
+    return ExtractionCache(storage_file=str(tmp_path / 'cache.jsonl'), max_entries=max_entries)
+
+
+def test_cached_extraction_leaves_out_per_file_keys(tmp_path):
+    extractions = cache(tmp_path)
+
+    extractions.put('pdf', 'schema', 'model', {'Document URL': 'a.pdf', 'File Name': 'a.pdf', 'Strength': '75 mg'})
+
+    assert extractions.get('pdf', 'schema', 'model') == {'Strength': '75 mg'}
+    assert extractions.get('pdf', 'other-schema', 'model') is None
+    assert extractions.get('pdf', 'schema', 'model', settings='second-pass') is None
+
+
+def test_reload_replays_puts_and_invalidations(tmp_path):
+    extractions = cache(tmp_path)
+    extractions.put('pdf-a', 'schema', 'model', {'Strength': '75 mg'})
+    extractions.put('pdf-b', 'schema', 'model', {'Strength': '150 mg'})
+    extractions.put('pdf-a', 'schema', 'model', {'Strength': '300 mg'})
+    assert extractions.invalidate('pdf-b') == 1
+
+    reloaded = cache(tmp_path)
+
+    assert reloaded.get('pdf-a', 'schema', 'model') == {'Strength': '300 mg'}
+    assert reloaded.get('pdf-b', 'schema', 'model') is None
+
+
+def test_oldest_entries_are_evicted_and_the_log_compacted(tmp_path):
+    extractions = cache(tmp_path, max_entries=2)
+
+    for number in range(6):
+        extractions.put(f'pdf-{number}', 'schema', 'model', {'Strength': str(number)})
+
+    assert extractions.get('pdf-0', 'schema', 'model') is None
+    assert extractions.get('pdf-5', 'schema', 'model') == {'Strength': '5'}
+    assert len((tmp_path / 'cache.jsonl').read_text().splitlines()) <= 4
+    assert list(cache(tmp_path, max_entries=2).entries) == list(extractions.entries)
@@ -0,0 +1,79 @@
+import json
+import random
+
+import pytest
+
+from services.incremental_json import IncrementalJsonParser
+
+
+REPLY = '```json\n' + json.dumps({
+    'Product Name': 'Praluent',
+    'Strength': '75 mg "pen"\\n150 mg',
+    'Shelf Life': None,
+    'Doses': [75, 150],
+    'Storage': {'Temperature': '2-8 °C', 'Note': 'Do not {freeze}'},
+    'Count': 3,
+    'Approved': True,
+}, ensure_ascii=False, indent=2) + '\n```\nSome trailing chatter {"x": 1}'
+
+
+def feed_in_chunks(text, sizes):
+    parser = IncrementalJsonParser()
+    closed = []
+    position = 0
+    for size in sizes:
+        closed.extend(parser.feed(text[position:position + size]))
+        position += size
+    closed.extend(parser.feed(text[position:]))
+    return parser, closed
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_any_chunking_gives_the_whole_object(seed):
+    rng = random.Random(seed)
+    sizes = [rng.randint(1, 12) for _ in range(len(REPLY))]
+
+    parser, closed = feed_in_chunks(REPLY, sizes)
+
+    expected = json.loads(REPLY[REPLY.index('{'):REPLY.rindex('```')])
+    assert parser.complete
+    assert dict(closed) == expected
+    assert [key for key, _ in closed] == list(expected)
+    assert parser.fields == expected
+
+
+def test_field_is_returned_as_soon_as_it_closes():
+    parser = IncrementalJsonParser()
+
+    assert parser.feed('{"Product Name": "Pral') == []
+    assert parser.in_field
+    assert parser.feed('uent", "Count": 1') == [('Product Name', 'Praluent')]
+    assert parser.feed('2}') == [('Count', 12)]
+    assert parser.complete
+    assert not parser.in_field
+
+
+def test_comma_leaves_the_parser_in_a_field():
+    parser = IncrementalJsonParser()
+
+    parser.feed('{"Product Name": "Praluent",')
+
+    assert parser.in_field
+    assert not parser.complete
+
+
+def test_raw_newlines_in_strings_are_accepted():
+    parser = IncrementalJsonParser()
+
+    closed = parser.feed('{"Indications": "line one\nline two"}')
+
+    assert closed == [('Indications', 'line one\nline two')]
+
+
+def test_unparsable_field_is_skipped():
+    parser = IncrementalJsonParser()
+
+    closed = parser.feed('{"Count": 12abc, "Product Name": "Praluent"}')
+
+    assert closed == [('Product Name', 'Praluent')]
+    assert parser.complete
@@ -0,0 +1,59 @@
+import json
+
+from services import metadata_storage
+from services.metadata_index import MetadataIndex
+from services.metadata_storage import MetadataStorage
+
+
+def record(template_id, shelf_life):
+    return {'Template ID': template_id, 'Shelf Life': shelf_life}
+
+
+def test_upserts_are_appended_not_rewritten(tmp_path):
+    storage_file = tmp_path / 'metadata.json'
+    storage = MetadataStorage(str(storage_file))
+
+    storage.add_metadata(record('t', '2 years'), 'doc-a')
+    storage.add_metadata(record('t', '3 years'), 'doc-b')
+
+    assert not storage_file.exists()
+    assert len((tmp_path / 'metadata.changes.jsonl').read_text().splitlines()) == 2
+
+
+def test_reload_replays_changes_over_the_snapshot(tmp_path):
+    storage_file = str(tmp_path / 'metadata.json')
+    storage = MetadataStorage(storage_file)
+    storage.add_metadata(record('t', '2 years'), 'doc-a')
+    storage.add_metadata(record('t', '3 years'), 'doc-b')
+    storage.add_metadata(record('t', '5 years'), 'doc-a')
+    storage.delete_metadata('doc-b')
+
+    reloaded = MetadataStorage(storage_file)
+
+    assert reloaded.get_metadata() == [{'Document URL': 'doc-a', **record('t', '5 years')}]
+
+
+def test_log_is_compacted_into_the_snapshot(monkeypatch, tmp_path):
+    monkeypatch.setattr(metadata_storage, 'METADATA_COMPACT_MIN_CHANGES', 3)
+    storage_file = tmp_path / 'metadata.json'
+    storage = MetadataStorage(str(storage_file))
+
+    for shelf_life in ('1 year', '2 years', '3 years', '4 years'):
+        storage.add_metadata(record('t', shelf_life), 'doc-a')
+
+    snapshot = json.loads(storage_file.read_text())
+    assert snapshot['version'] == metadata_storage.STORAGE_VERSION
+    assert (tmp_path / 'metadata.changes.jsonl').read_text() == ''
+    assert MetadataStorage(str(storage_file)).get_metadata_by_url('doc-a') == record('t', '4 years')
+
+
+def test_clear_resets_the_index(tmp_path):
+    storage = MetadataStorage(str(tmp_path / 'metadata.json'))
+    index = MetadataIndex(storage)
+    index.upsert('t', 'doc-a', {'Shelf Life': '2 years'})
+
+    storage.clear_metadata()
+
+    assert index.remove('doc-a') == []
+    assert index.upsert('t', 'doc-a', {'Shelf Life': '2 years'}) is True
+    assert MetadataStorage(str(tmp_path / 'metadata.json')).get_metadata_by_url('doc-a') == record('t', '2 years')
@@ -0,0 +1,49 @@
+import threading
+import time
+
+import pytest
+
+from services import openRouter
+from services.cancellation import CancellationToken, OperationCancelled
+
+
+class SlowResponse:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_post_is_sent_with_timeouts(monkeypatch):
+    sent = {}
+    def post(url, **kwargs):
+        sent.update(kwargs)
+        return SlowResponse()
+    monkeypatch.setattr(openRouter.requests, 'post', post)
+
+    openRouter._post({}, {'model': 'm'}, False, None)
+
+    assert sent['timeout'] == (openRouter.LLM_CONNECT_TIMEOUT, openRouter.LLM_READ_TIMEOUT)
+
+
+def test_cancel_releases_a_request_waiting_for_its_reply(monkeypatch):
+    monkeypatch.setattr(openRouter, 'CANCEL_POLL_INTERVAL', 0.01)
+    release = threading.Event()
+    response = SlowResponse()
+    def post(url, **kwargs):
+        release.wait(5)
+        return response
+    monkeypatch.setattr(openRouter.requests, 'post', post)
+    token = CancellationToken()
+    threading.Timer(0.05, token.cancel).start()
+
+    start = time.time()
+    with pytest.raises(OperationCancelled):
+        openRouter._post({}, {'model': 'm'}, True, token)
+    assert time.time() - start < 1
+
+    release.set()
+    deadline = time.time() + 2
+    while not response.closed and time.time() < deadline:
+        time.sleep(0.01)
+    assert response.closed
@@ -0,0 +1,40 @@
+from services.document_processor import _ignore_progress
+
+
+def _extract(processor, tmp_path, compiled, pages):
+    pdf = tmp_path / "leaflet.pdf"
+    pdf.write_bytes(b"%PDF-1.4")
+    processor.extract_pages = lambda path: pages
+    file = {'name': 'leaflet.pdf', 'url': 'https://example.com/leaflet.pdf'}
+    return processor._extract_content(str(pdf), 'content-hash', file, compiled, 'big', None, 'big', _ignore_progress)
+
+
+def test_parse_response_keeps_not_found(processor):
+    assert processor._parse_response('{"a": "Not found", "b": "x"}') == {'a': 'Not found', 'b': 'x'}
+
+
+def test_parse_response_lines_keep_not_found(processor):
+    parsed = processor._parse_response('"Shelf Life": "Not found",\n"Name": "Foo"')
+    assert parsed['Shelf Life'] == 'Not found'
+
+
+def test_not_found_field_reaches_second_pass(processor, fake_llm, make_template, tmp_path, monkeypatch):
+    compiled = make_template('Product Name', 'Shelf Life')
+    llm = fake_llm(
+        {'filename': 'leaflet.pdf', 'Product Name': 'Foo', 'Shelf Life': 'Not found'},
+        {'filename': 'leaflet.pdf', 'Shelf Life': '24 months'}
+    )
+    second_passes = []
+    run_second_pass = processor._run_second_pass
+    def spy(metadata, missing, *args, **kwargs):
+        second_passes.append(list(missing))
+        return run_second_pass(metadata, missing, *args, **kwargs)
+    monkeypatch.setattr(processor, '_run_second_pass', spy)
+
+    metadata = _extract(processor, tmp_path, compiled, ["Foo tablets. Shelf life: 24 months."])
+
+    assert second_passes == [['Shelf Life']]
+    assert llm.requests[1]['fields'] == ('filename', 'Shelf Life')
+    assert metadata['Shelf Life'] == '24 months'
+    assert metadata['Product Name'] == 'Foo'
+
@@ -0,0 +1,34 @@
+from services import smpc_sections
+from services.document_processor import _ignore_progress
+
+SMPC_TEXT = (
+    "1. NAME OF THE MEDICINAL PRODUCT\nFoo 10 mg tablets\n"
+    "2. QUALITATIVE AND QUANTITATIVE COMPOSITION\nEach tablet contains 10 mg foo.\n"
+    "3. PHARMACEUTICAL FORM\nTablet\n"
+    "4. CLINICAL PARTICULARS\nSee below.\n"
+    "5. PHARMACOLOGICAL PROPERTIES\nSee below.\n"
+    "6. PHARMACEUTICAL PARTICULARS\n"
+    "6.1 List of excipients\nLactose\n"
+    "6.2 Incompatibilities\nNot applicable.\n"
+    "6.3 Shelf life\n24 months\n"
+    "6.4 Special precautions for storage\nStore below 25 C\n"
+)
+
+
+def test_default_sections_apply_without_a_revision(processor, fake_llm, make_template, tmp_path, monkeypatch):
+    monkeypatch.setattr(smpc_sections, 'SMPC_DEFAULT_SECTIONS', True)
+    compiled = make_template('Shelf Life', 'Colour')
+    llm = fake_llm(
+        {'filename': 'smpc.pdf', 'Shelf Life': '24 months', 'Colour': 'White'},
+        {'filename': 'smpc.pdf', 'Shelf Life': '24 months', 'Colour': 'White'}
+    )
+    pdf = tmp_path / "smpc.pdf"
+    pdf.write_bytes(b"%PDF-1.4")
+    processor.extract_pages = lambda path: [SMPC_TEXT]
+
+    processor._extract_content(
+        str(pdf), 'content-hash', {'name': 'smpc.pdf', 'url': 'https://example.com/smpc.pdf'},
+        compiled, 'big', None, 'big', _ignore_progress
+    )
+
+    assert {request['fields'] for request in llm.requests} == {('filename', 'Shelf Life'), ('filename', 'Colour')}
@@ -0,0 +1,70 @@
+import random
+
+from services.text_index import CONTEXT_CHARS, PartialMatchIndex, field_name_variations
+
+
+def naive_first_occurrence(text, field_name):
+    lowered = text.lower()
+    starts = [(lowered.find(variation), variation) for variation in field_name_variations(field_name)]
+    return next(((start, variation) for start, variation in starts if start != -1), None)
+
+
+def test_finds_the_line_mentioning_each_field():
+    text = "Here is what I found.\nProduct Name: Praluent\nShelf life: 3 years\n"
+
+    matches = PartialMatchIndex(text).find_all(['Product Name', 'Shelf Life', 'Storage'])
+
+    assert matches == {
+        'Product Name': 'Product Name: Praluent',
+        'Shelf Life': 'Shelf life: 3 years',
+        'Storage': None,
+    }
+
+
+def test_name_variations_are_matched():
+    text = "Route or Form: subcutaneous\nstorage & handling: fridge\nactive substance: alirocumab"
+
+    matches = PartialMatchIndex(text).find_all(['Route/Form', 'Storage and Handling', 'Active_Substance'])
+
+    assert matches == {
+        'Route/Form': 'Route or Form: subcutaneous',
+        'Storage and Handling': 'storage & handling: fridge',
+        'Active_Substance': 'active substance: alirocumab',
+    }
+
+
+def test_earlier_variation_is_preferred_over_earlier_position():
+    text = "storage & handling: first\nstorage and handling: second"
+
+    assert PartialMatchIndex(text).find('Storage and Handling') == 'storage and handling: second'
+
+
+def test_long_lines_are_clipped_around_the_match():
+    text = 'x' * 500 + ' Shelf Life: 3 years ' + 'y' * 500
+
+    line = PartialMatchIndex(text).find('Shelf Life')
+
+    assert 'Shelf Life: 3 years' in line
+    assert len(line) <= 2 * CONTEXT_CHARS + len('Shelf Life')
+
+
+def test_overlapping_names_match_like_a_plain_search():
+    rng = random.Random(0)
+    names = ['Name', 'Product Name', 'Product', 'Duct', 'Nam']
+    for _ in range(50):
+        text = ''.join(rng.choice(['product ', 'name ', 'duct ', 'na', '\n', 'PRODUCT NAME ']) for _ in range(30))
+
+        index = PartialMatchIndex(text)
+        matches = index.find_all(names)
+
+        for name in names:
+            expected = naive_first_occurrence(text, name)
+            if expected is None:
+                assert matches[name] is None
+            else:
+                start, variation = expected
+                assert matches[name] == index._context_line(start, len(variation))
+
+
+def test_no_fields_gives_no_matches():
+    assert PartialMatchIndex("anything").find_all([]) == {}
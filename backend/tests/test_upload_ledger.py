@@ -0,0 +1,56 @@
+from services.upload_ledger import UploadLedger, get_upload_ledger, hash_row
+
+
+COLUMNS = ['Document URL', 'Shelf Life']
+
+
+def rows(*values):
+    return [hash_row([value]) for value in values]
+
+
+def uploaded_ledger(tmp_path, row_hashes):
+    ledger = UploadLedger(storage_file=str(tmp_path / 'ledger.json'))
+    ledger.record_upload('t', '/docs', 'out.xlsx', COLUMNS, row_hashes, 'hash', 'https://sp/out.xlsx')
+    return ledger
+
+
+def test_trailing_rows_are_an_append(tmp_path):
+    ledger = uploaded_ledger(tmp_path, rows('a', 'b'))
+
+    assert ledger.get_appended_rows('t', '/docs', COLUMNS, rows('a', 'b', 'c')) == 2
+
+
+def test_changed_or_removed_rows_are_not_an_append(tmp_path):
+    ledger = uploaded_ledger(tmp_path, rows('a', 'b'))
+
+    assert ledger.get_appended_rows('t', '/docs', COLUMNS, rows('a', 'x', 'c')) is None
+    assert ledger.get_appended_rows('t', '/docs', COLUMNS, rows('a')) is None
+    assert ledger.get_appended_rows('t', '/docs', COLUMNS, rows('a', 'b')) is None
+
+
+def test_new_columns_are_not_an_append(tmp_path):
+    ledger = uploaded_ledger(tmp_path, rows('a'))
+
+    assert ledger.get_appended_rows('t', '/docs', COLUMNS + ['Storage'], rows('a', 'b')) is None
+
+
+def test_other_folder_has_nothing_uploaded(tmp_path):
+    ledger = uploaded_ledger(tmp_path, rows('a'))
+
+    assert ledger.get_appended_rows('t', '/other', COLUMNS, rows('a', 'b')) is None
+
+
+def test_uploads_survive_a_reload(tmp_path):
+    uploaded_ledger(tmp_path, rows('a'))
+
+    reloaded = UploadLedger(storage_file=str(tmp_path / 'ledger.json'))
+
+    assert reloaded.is_unchanged('t', '/docs', 'hash')
+    assert reloaded.get_appended_rows('t', '/docs', COLUMNS, rows('a', 'b')) == 1
+
+
+def test_ledger_is_shared_across_the_process(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr('services.upload_ledger._upload_ledger', None)
+
+    assert get_upload_ledger() is get_upload_ledger()